@@ -21,6 +21,64 @@ EMBED_MODEL = "text-embedding-3-small"   # 向量化模型
 CHAT_MODEL = "gpt-4o-mini"               # 聊天模型
 VECTOR_DB_PATH = ".chroma"               # 向量库存储路径
 
+# OpenAI HTTP 客户端（连接池 / 超时 / 本地替身）
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or None            # 例如本地 mock：http://127.0.0.1:8000/v1
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "60"))         # 单次请求总超时（秒）
+OPENAI_CONNECT_TIMEOUT = float(os.getenv("OPENAI_CONNECT_TIMEOUT", "5"))
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "20"))
+OPENAI_MAX_KEEPALIVE = int(os.getenv("OPENAI_MAX_KEEPALIVE", "10"))
+OPENAI_KEEPALIVE_EXPIRY = float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", "30"))
+OPENAI_HTTP2 = os.getenv("OPENAI_HTTP2", "1") == "1"              # 需要安装 h2，否则自动回退 HTTP/1.1
+
+# OpenAI 调用弹性层（重试 / 熔断 / 对冲）
+OPENAI_MAX_TRIES = int(os.getenv("OPENAI_MAX_TRIES", "3"))
+OPENAI_BACKOFF_BASE = float(os.getenv("OPENAI_BACKOFF_BASE", "1.0"))     # 首次退避（秒）
+OPENAI_BACKOFF_CAP = float(os.getenv("OPENAI_BACKOFF_CAP", "20"))        # 单次退避上限（秒）
+OPENAI_BREAKER_COOLDOWN = float(os.getenv("OPENAI_BREAKER_COOLDOWN", "20"))
+OPENAI_HEDGE = os.getenv("OPENAI_HEDGE", "0") == "1"                     # 对冲请求（会增加调用量，默认关闭）
+OPENAI_HEDGE_MIN_SAMPLES = int(os.getenv("OPENAI_HEDGE_MIN_SAMPLES", "20"))
+
+# 检索门控：寒暄跳过 RAG、追问复用上一轮命中（RAG_GATE=0 关闭）
+RAG_GATE = os.getenv("RAG_GATE", "1") == "1"
+
+# 检索结果缓存条目上限（0 = 关闭）
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "512"))
+
+# 查询扩展（多路检索）：off / rules（本地规则改写）/ llm（规则 + 便宜模型改写与 HyDE 假设答案）
+QUERY_EXPANSION = os.getenv("QUERY_EXPANSION", "off")
+EXPANSION_MODEL = os.getenv("EXPANSION_MODEL", CHAT_MODEL)
+EXPANSION_DEADLINE_MS = int(os.getenv("EXPANSION_DEADLINE_MS", "800"))   # 超时回退普通检索
+EXPANSION_MAX_PROBES = int(os.getenv("EXPANSION_MAX_PROBES", "4"))      # 含原句
+EXPANSION_MAX_CHARS = int(os.getenv("EXPANSION_MAX_CHARS", "40"))       # 只扩展短查询
+
+# docs 直接在快照上检索（ingest export 的输出目录；只读，免导入 Chroma）。为空时使用 Chroma 里的 docs 集合
+DOCS_SNAPSHOT = os.getenv("DOCS_SNAPSHOT", "")
+
+# 写入去重：skip / merge / newest / off；近似重复的 SimHash 汉明距离阈值（0 = 只做精确去重，最大 3）
+DEDUP_POLICY = os.getenv("DEDUP_POLICY", "skip")
+DEDUP_NEAR_BITS = int(os.getenv("DEDUP_NEAR_BITS", "3"))
+
+# 记忆生命周期（聊天进程自己写入的集合；docs 由 ingest 管理，不在此列）
+# 保留策略：集合:ttl=天数,max=条数;…  ttl 从创建或最近一次被召回算起；超出 max 时淘汰最久未被召回的
+# 默认为空（不淘汰任何记忆）；需要时显式开启，例如 MEMORY_RETENTION="long_term:max=5000;user_notes:ttl=180,max=2000"
+MEMORY_RETENTION = os.getenv("MEMORY_RETENTION", "")
+MEMORY_RECENCY_WEIGHT = float(os.getenv("MEMORY_RECENCY_WEIGHT", "0.1"))   # 检索打分：新近度加权
+MEMORY_USAGE_WEIGHT = float(os.getenv("MEMORY_USAGE_WEIGHT", "0.05"))      # 检索打分：召回次数加权
+MEMORY_HALF_LIFE_DAYS = float(os.getenv("MEMORY_HALF_LIFE_DAYS", "30"))
+MEMORY_MAINTENANCE_INTERVAL = float(os.getenv("MEMORY_MAINTENANCE_INTERVAL", "600"))  # 后台维护周期（秒）
+MEMORY_COMPACT_RATIO = float(os.getenv("MEMORY_COMPACT_RATIO", "0.2"))     # 删除量占比超过它时重建索引
+MEMORY_COMPACT_MIN_DELETES = int(os.getenv("MEMORY_COMPACT_MIN_DELETES", "200"))
+
+# 性能剖析（默认全部关闭；聊天与 ingest 通用，REPL 里也可以用 profile on/off 切换）
+PROFILE = os.getenv("PROFILE", "0") == "1"                                # 每轮 cProfile，写 .pstats
+PROFILE_DIR = os.getenv("PROFILE_DIR", ".profiles")
+PROFILE_TRACEMALLOC = int(os.getenv("PROFILE_TRACEMALLOC", "0"))          # tracemalloc 保存的栈深度（0 = 关闭）
+PROFILE_SAMPLE_HZ = float(os.getenv("PROFILE_SAMPLE_HZ", "0"))            # 采样频率，输出 collapsed stacks（0 = 关闭）
+PROFILE_TOP = int(os.getenv("PROFILE_TOP", "10"))                         # 报告里显示的条数
+
+# evalprompts 并发评测的线程数
+EVAL_WORKERS = int(os.getenv("EVAL_WORKERS", "4"))
+
 # 方便打印确认（调试时用）
 if __name__ == "__main__":
     print("✅ Config 加载成功")
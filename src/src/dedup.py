@@ -0,0 +1,258 @@
+"""
+写入时去重：
+- 精确重复：规范化文本（合并空白、小写）后的 SHA1
+- 近似重复：64 位 SimHash（字符 3-gram，适合中文），汉明距离 <= DEDUP_NEAR_BITS 视为重复
+  4 个 16 位分段做倒排：距离 <= 3 的两条签名至少有一段完全相同，查找不必全表扫描
+- 签名索引持久化在 persist_dir/dedup/<collection>.sig（追加写，删除写墓碑，加载时自动压缩）
+
+策略（DEDUP_POLICY）：
+- skip   ：不写入，返回已有条目的 id
+- merge  ：不写入，把新元数据合并进已有条目（新值覆盖旧值，dup_count +1）
+- newest ：删除旧条目，写入新条目
+- off    ：关闭去重
+带 name 的条目（命名记忆）只与同名条目去重。
+"""
+
+import os
+import hashlib
+import threading
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+POLICIES = ("skip", "merge", "newest", "off")
+
+SIMHASH_BITS = 64
+_BANDS = 4
+_BAND_BITS = SIMHASH_BITS // _BANDS
+_BAND_MASK = (1 << _BAND_BITS) - 1
+
+
+# ---------- 签名 ----------
+def normalize_text(text: str) -> str:
+    return " ".join((text or "").split()).lower()
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha1(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+def simhash(text: str, ngram: int = 3) -> int:
+    t = "".join(normalize_text(text).split())
+    if not t:
+        return 0
+    grams = Counter(t[i:i + ngram] for i in range(max(1, len(t) - ngram + 1)))
+    acc = [0] * SIMHASH_BITS
+    for g, w in grams.items():
+        h = int.from_bytes(hashlib.blake2b(g.encode("utf-8"), digest_size=8).digest(), "big")
+        for b in range(SIMHASH_BITS):
+            acc[b] += w if (h >> b) & 1 else -w
+    return sum(1 << b for b in range(SIMHASH_BITS) if acc[b] > 0)
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+def _bands(sig: int) -> List[Tuple[int, int]]:
+    return [(i, (sig >> (i * _BAND_BITS)) & _BAND_MASK) for i in range(_BANDS)]
+
+
+class _PrefixExclude:
+    def __init__(self, ids: Set[str], prefix: str):
+        self.ids, self.prefix = ids, prefix
+
+    def __contains__(self, _id: str) -> bool:
+        return _id in self.ids or _id.startswith(self.prefix)
+
+
+# ---------- 持久化签名索引 ----------
+class DedupIndex:
+    """id -> (content_hash, simhash)，附带精确哈希与 SimHash 分段的倒排；path 为 None 时只在内存中"""
+
+    def __init__(self, path: Optional[str], near_bits: int = 3):
+        self.path = path
+        self.near_bits = min(near_bits, _BANDS - 1)  # 分段倒排只保证距离 <= 3 时不漏
+        self._lock = threading.Lock()
+        self._sigs: Dict[str, Tuple[str, int]] = {}
+        self._by_hash: Dict[str, Set[str]] = {}
+        self._by_band: Dict[Tuple[int, int], Set[str]] = {}
+        self._tombstones = 0
+        self._load()
+
+    def __len__(self) -> int:
+        return len(self._sigs)
+
+    # ---- 内存结构 ----
+    def _put(self, _id: str, h: str, sig: int):
+        self._drop(_id)
+        self._sigs[_id] = (h, sig)
+        self._by_hash.setdefault(h, set()).add(_id)
+        for band in _bands(sig):
+            self._by_band.setdefault(band, set()).add(_id)
+
+    def _drop(self, _id: str) -> bool:
+        old = self._sigs.pop(_id, None)
+        if old is None:
+            return False
+        h, sig = old
+        self._by_hash.get(h, set()).discard(_id)
+        for band in _bands(sig):
+            self._by_band.get(band, set()).discard(_id)
+        return True
+
+    # ---- 文件 ----
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                parts = line.rstrip("\n").split("\t")
+                if parts[0] == "+" and len(parts) == 4:
+                    self._put(parts[1], parts[2], int(parts[3], 16))
+                elif parts[0] == "-" and len(parts) == 2:
+                    self._drop(parts[1])
+                    self._tombstones += 1
+        if self._tombstones > max(1000, len(self._sigs)):
+            self._rewrite()
+
+    def _append(self, lines: Iterable[str]):
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.writelines(lines)
+
+    def _rewrite(self):
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            for _id, (h, sig) in self._sigs.items():
+                f.write(f"+\t{_id}\t{h}\t{sig:016x}\n")
+        os.replace(tmp, self.path)
+        self._tombstones = 0
+
+    # ---- 对外 ----
+    def find(
+        self,
+        text: str,
+        exclude: Optional[Set[str]] = None,
+        near: bool = True,
+        exclude_prefix: Optional[str] = None,
+    ) -> Optional[Tuple[str, str]]:
+        """
+        返回 (已有 id, "exact"|"near")；没有重复返回 None
+        exclude / exclude_prefix：不参与比较的 id（例如同一文件重新 ingest 时它自己的旧块）
+        """
+        exclude = exclude or set()
+        if exclude_prefix:
+            exclude = _PrefixExclude(exclude, exclude_prefix)
+        h = content_hash(text)
+        with self._lock:
+            for _id in self._by_hash.get(h, ()):
+                if _id not in exclude:
+                    return _id, "exact"
+            if not near or self.near_bits <= 0:
+                return None
+            sig = simhash(text)
+            seen: Set[str] = set()
+            for band in _bands(sig):
+                for _id in self._by_band.get(band, ()):
+                    if _id in seen or _id in exclude:
+                        continue
+                    seen.add(_id)
+                    if hamming(sig, self._sigs[_id][1]) <= self.near_bits:
+                        return _id, "near"
+        return None
+
+    def add(self, items: Iterable[Tuple[str, str]]):
+        """items: [(id, text), ...]"""
+        lines = []
+        with self._lock:
+            for _id, text in items:
+                h, sig = content_hash(text), simhash(text)
+                self._put(_id, h, sig)
+                lines.append(f"+\t{_id}\t{h}\t{sig:016x}\n")
+            if lines:
+                self._append(lines)
+
+    def remove(self, ids: Iterable[str]):
+        lines = []
+        with self._lock:
+            for _id in ids:
+                if self._drop(_id):
+                    lines.append(f"-\t{_id}\n")
+                    self._tombstones += 1
+            if lines:
+                self._append(lines)
+
+    def clear(self):
+        with self._lock:
+            self._sigs.clear()
+            self._by_hash.clear()
+            self._by_band.clear()
+            self._rewrite()
+
+    def rebuild(self, items: Iterable[Tuple[str, str]]):
+        """用 [(id, text), ...] 全量重建（dedupe 维护命令使用）"""
+        with self._lock:
+            self._sigs.clear()
+            self._by_hash.clear()
+            self._by_band.clear()
+            for _id, text in items:
+                self._put(_id, content_hash(text), simhash(text))
+            self._rewrite()
+
+
+_INDEXES: Dict[Tuple[str, str], DedupIndex] = {}
+_INDEXES_LOCK = threading.Lock()
+
+
+def get_index(persist_dir: str, collection: str, near_bits: int = 3) -> DedupIndex:
+    """同一进程内同一集合共享一个索引实例"""
+    key = (os.path.abspath(persist_dir), collection)
+    with _INDEXES_LOCK:
+        if key not in _INDEXES:
+            _INDEXES[key] = DedupIndex(os.path.join(key[0], "dedup", f"{collection}.sig"), near_bits)
+        return _INDEXES[key]
+
+
+# ---------- 存量集合去重 ----------
+def dedupe_collection(coll, index: DedupIndex, near: bool = True, page: int = 5000) -> Tuple[int, int]:
+    """
+    扫描整个集合，重复组内保留 created_at 最新的一条（无时间戳时保留先扫描到的），删除其余；
+    与写入时一致，带 name 的条目只与同名条目比较。最后用保留的条目重建签名索引。返回 (扫描条数, 删除条数)。
+    """
+    rows: List[Tuple[str, str, float, Optional[str]]] = []
+    offset, total = 0, coll.count()
+    while offset < total:
+        res = coll.get(include=["documents", "metadatas"], limit=page, offset=offset)
+        ids = res.get("ids") or []
+        if not ids:
+            break
+        docs = res.get("documents") or [""] * len(ids)
+        metas = res.get("metadatas") or [None] * len(ids)
+        for _id, doc, meta in zip(ids, docs, metas):
+            meta = meta or {}
+            rows.append((_id, doc or "", float(meta.get("created_at") or 0), meta.get("name")))
+        offset += len(ids)
+
+    # 新的排前面：重复时先入索引的（最新的）被保留
+    rows.sort(key=lambda r: r[2], reverse=True)
+    scratch: Dict[Optional[str], DedupIndex] = {}  # 扫描用的内存索引，按 name 分组
+
+    keep, drop = [], []
+    for _id, doc, _, name in rows:
+        if name not in scratch:
+            scratch[name] = DedupIndex(None, index.near_bits)
+        if scratch[name].find(doc, near=near):
+            drop.append(_id)
+            continue
+        scratch[name].add([(_id, doc)])
+        keep.append((_id, doc))
+
+    for i in range(0, len(drop), page):
+        coll.delete(ids=drop[i:i + page])
+    index.rebuild(keep)
+    return len(rows), len(drop)
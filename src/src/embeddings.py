@@ -5,11 +5,9 @@ Embedding 封装：
 """
 
 from typing import List, Sequence
-from openai import OpenAI
-from .config import OPENAI_API_KEY, EMBED_MODEL
-
-# 初始化全局客户端（避免重复创建）
-_client = OpenAI(api_key=OPENAI_API_KEY)
+from .config import EMBED_MODEL
+from .openai_client import get_client
+from .resilience import embed_guard
 
 
 class Embedder:
@@ -22,14 +20,17 @@ class Embedder:
 
     def __init__(self, model: str = EMBED_MODEL):
         self.model = model
-        self.client = _client
+        self.client = get_client()  # 全进程共享连接池
 
     def embed(self, texts: Sequence[str]) -> List[List[float]]:
         """
         批量向量化：返回与输入顺序一致的向量列表（List[List[float]]）
         """
         # OpenAI 新版 SDK: embeddings.create
-        resp = self.client.embeddings.create(model=self.model, input=list(texts))
+        # 经过弹性层：可重试错误自动退避，熔断时抛 CircuitOpenError
+        resp = embed_guard.call(
+            lambda: self.client.embeddings.create(model=self.model, input=list(texts))
+        )
         return [item.embedding for item in resp.data]
 
     def embed_one(self, text: str) -> List[float]:
@@ -0,0 +1,123 @@
+"""
+Prompt 多变体并行评测：N 个 prompt × M 个问题，整个矩阵一次跑完
+- 每个问题只检索一次，所有变体共用同一份上下文（比较才公平，也省掉重复检索）
+- 有界线程池并发调用模型（共享连接池；经 chat_guard 重试/熔断）
+- 报告每个变体的延迟（平均/p95）、输入/输出 token、回答长度与失败数，按总 token 从低到高排序
+
+用法：
+    variants = [{"name": "default", "system": SYSTEM_PROMPT, "developer": DEVELOPER_HINT}, ...]
+    trials = run_matrix(client, CHAT_MODEL, variants, questions, contexts, workers=4)
+    print(format_report(summarize(trials, variants)))
+"""
+
+import os
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List
+
+from .prompt import assemble_messages
+from .resilience import chat_guard
+
+
+def load_questions(path: str) -> List[str]:
+    """问题文件：.json 为字符串数组；其它格式每行一个问题（空行和 # 开头的行忽略）"""
+    with open(path, "r", encoding="utf-8") as f:
+        if path.lower().endswith(".json"):
+            return [str(q).strip() for q in json.load(f) if str(q).strip()]
+        return [ln.strip() for ln in f if ln.strip() and not ln.lstrip().startswith("#")]
+
+
+def retrieve_contexts(questions: List[str], retrieve: Callable[[str], str], workers: int = 4) -> List[str]:
+    """每个问题检索一次，返回与 questions 等长的上下文列表"""
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="eval-rag") as pool:
+        return list(pool.map(retrieve, questions))
+
+
+def _run_one(client, model: str, variant: Dict, qi: int, question: str, context: str, temperature: float) -> Dict:
+    messages = assemble_messages(
+        variant["system"], variant["developer"], [{"role": "user", "content": question}], context
+    )
+    trial = {"variant": variant["name"], "question": qi, "seconds": 0.0,
+             "prompt_tokens": 0, "completion_tokens": 0, "answer": "", "error": None}
+    t0 = time.perf_counter()
+    try:
+        resp = chat_guard.call(
+            lambda: client.chat.completions.create(model=model, messages=messages, temperature=temperature)
+        )
+        trial["answer"] = (resp.choices[0].message.content or "").strip()
+        usage = getattr(resp, "usage", None)
+        if usage is not None:
+            trial["prompt_tokens"] = usage.prompt_tokens or 0
+            trial["completion_tokens"] = usage.completion_tokens or 0
+    except Exception as e:
+        trial["error"] = f"{e.__class__.__name__}: {e}"
+    trial["seconds"] = time.perf_counter() - t0
+    return trial
+
+
+def run_matrix(
+    client,
+    model: str,
+    variants: List[Dict],
+    questions: List[str],
+    contexts: List[str],
+    workers: int = 4,
+    temperature: float = 0.7,
+) -> List[Dict]:
+    """并发跑完 变体 × 问题 的全部组合；单个失败不影响其它组合"""
+    jobs = [(v, qi) for qi in range(len(questions)) for v in variants]
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="eval") as pool:
+        futures = [
+            pool.submit(_run_one, client, model, v, qi, questions[qi], contexts[qi], temperature)
+            for v, qi in jobs
+        ]
+        return [f.result() for f in futures]
+
+
+def _p95(values: List[float]) -> float:
+    if not values:
+        return 0.0
+    data = sorted(values)
+    return data[min(len(data) - 1, int(round(0.95 * (len(data) - 1))))]
+
+
+def summarize(trials: List[Dict], variants: List[Dict]) -> List[Dict]:
+    rows = []
+    for v in variants:
+        ts = [t for t in trials if t["variant"] == v["name"]]
+        ok = [t for t in ts if not t["error"]]
+        n = len(ok) or 1
+        rows.append({
+            "name": v["name"],
+            "ok": len(ok),
+            "total": len(ts),
+            "avg_s": sum(t["seconds"] for t in ok) / n,
+            "p95_s": _p95([t["seconds"] for t in ok]),
+            "avg_in": sum(t["prompt_tokens"] for t in ok) / n,
+            "avg_out": sum(t["completion_tokens"] for t in ok) / n,
+            "avg_chars": sum(len(t["answer"]) for t in ok) / n,
+        })
+    # 成功率优先，其次平均总 token 越少越好
+    rows.sort(key=lambda r: (-r["ok"] / max(1, r["total"]), r["avg_in"] + r["avg_out"]))
+    return rows
+
+
+def format_report(rows: List[Dict]) -> str:
+    lines = [f"{'变体':<16}{'成功':>8}{'平均s':>8}{'p95s':>8}{'输入tok':>9}{'输出tok':>9}{'回答字数':>9}"]
+    for r in rows:
+        lines.append(
+            f"{r['name']:<16}{r['ok']:>4}/{r['total']:<3}{r['avg_s']:>8.2f}{r['p95_s']:>8.2f}"
+            f"{r['avg_in']:>9.0f}{r['avg_out']:>9.0f}{r['avg_chars']:>9.0f}"
+        )
+    return "\n".join(lines)
+
+
+def save_trials(trials: List[Dict], questions: List[str], out_dir: str = "evals") -> str:
+    """把每条回答落盘（jsonl），便于人工比较质量；返回文件路径"""
+    os.makedirs(out_dir, exist_ok=True)
+    path = os.path.join(out_dir, f"evalprompts-{time.strftime('%Y%m%d-%H%M%S')}.jsonl")
+    with open(path, "w", encoding="utf-8") as f:
+        for t in trials:
+            f.write(json.dumps(dict(t, question_text=questions[t["question"]]), ensure_ascii=False) + "\n")
+    return path
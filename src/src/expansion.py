@@ -0,0 +1,264 @@
+"""
+查询扩展（多路检索）：短/含糊的查询只用原句一个向量去检索，很容易漏召回
+- 改写：本地规则（去掉口语填充词、常见同义词替换）+ 可选的便宜模型（改写句 + HyDE 假设答案）
+- 模型改写结果按规范化查询做进程内 LRU 缓存，重复提问不再调用模型
+- 探针批量向量化，各集合并发检索，按名次做 RRF 融合
+    rules：原句与规则改写都是现成的，一次 embeddings 请求算出全部向量
+    llm  ：原句的普通检索不等模型改写，与扩展同时开始；改写 + HyDE 到达后再一次批量向量化
+          扩展有截止时间（EXPANSION_DEADLINE_MS），超时直接用普通检索的结果
+
+用法：
+    expander = QueryExpander(mode="rules")
+    if expander.should_expand(q):
+        docs_hits, facts_hits, notes_hits = expander.search(q, [v_docs, v_facts, v_notes], k=8)
+"""
+
+import re
+import json
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from typing import Dict, List, Optional, Sequence
+
+from .config import (
+    QUERY_EXPANSION,
+    EXPANSION_MODEL,
+    EXPANSION_DEADLINE_MS,
+    EXPANSION_MAX_PROBES,
+    EXPANSION_MAX_CHARS,
+)
+from .openai_client import get_client
+from .resilience import ResilientCaller
+
+MODES = ("off", "rules", "llm")
+RRF_K = 60  # RRF 平滑常数：名次靠后的命中贡献衰减得慢一些
+
+# 改写调用单独熔断：截止时间很紧，超时不应计入聊天调用的熔断器
+rewrite_guard = ResilientCaller("rewrite", max_tries=1)
+
+# 口语填充词：去掉后得到“关键词式”查询
+_FILLER_RE = re.compile(
+    r"(请问|请|麻烦|帮我|帮忙|能不能|能否|可不可以|可以|我想知道|想问一下|一下|到底|究竟|呢|吗|吧|啊|呀|嘛)"
+)
+_PUNCT_RE = re.compile(r"[\s,，。.!！?？~～、;；:：]+")
+
+# 常见同义说法（双向）：只替换第一个命中的词，生成一条改写
+_SYNONYMS = {
+    "怎么": "如何", "如何": "怎么",
+    "报错": "错误", "错误": "报错",
+    "配置": "设置", "设置": "配置",
+    "安装": "部署", "部署": "安装",
+    "删除": "移除", "移除": "删除",
+    "作用": "用途", "用途": "作用",
+    "区别": "差异", "差异": "区别",
+    "原理": "机制", "机制": "原理",
+    "失败": "出错", "出错": "失败",
+    "启动": "运行", "运行": "启动",
+}
+_SYNONYM_RE = re.compile("|".join(sorted(map(re.escape, _SYNONYMS), key=len, reverse=True)))
+
+_REWRITE_PROMPT = """你是检索查询改写助手。针对用户的查询，输出 JSON：
+{"paraphrases": ["改写1", "改写2"], "answer": "一段 2~3 句的假设性回答"}
+- paraphrases：补全省略的主语/术语，换成文档里可能出现的说法，每条都要能单独检索
+- answer：写成知识库原文里可能出现的片段；不确定也要写出具体内容（只用于检索，不会展示给用户）
+只输出 JSON。"""
+
+
+# ---------- 改写 ----------
+def rule_rewrites(query: str) -> List[str]:
+    """本地规则改写（零 API 调用）：关键词式查询 + 一条同义词替换"""
+    q = " ".join((query or "").split())
+    out = []
+    keywords = " ".join(_PUNCT_RE.sub(" ", _FILLER_RE.sub(" ", q)).split())
+    if keywords and keywords != q:
+        out.append(keywords)
+    base = keywords or q
+    m = _SYNONYM_RE.search(base)
+    if m:
+        out.append(base[:m.start()] + _SYNONYMS[m.group(0)] + base[m.end():])
+    return out
+
+
+def _parse_rewrite(text: str) -> List[str]:
+    t = (text or "").strip()
+    m = re.search(r"\{[\s\S]*\}", t)
+    if m:
+        t = m.group(0)
+    data = json.loads(t)
+    out = [str(p).strip() for p in (data.get("paraphrases") or []) if str(p).strip()]
+    answer = str(data.get("answer") or "").strip()
+    if answer:
+        out.append(answer)
+    return out
+
+
+def rrf_fuse(ranked_lists: Sequence[List[Dict]], limit: Optional[int] = None, k: int = RRF_K) -> List[Dict]:
+    """
+    按名次融合多路结果（Reciprocal Rank Fusion）：rrf = Σ 1/(k + 名次)
+    score 保留各路中的最高相似度（供 min_score 过滤），排序按 rrf
+    """
+    fused: Dict[str, Dict] = {}
+    for hits in ranked_lists:
+        for rank, h in enumerate(hits, 1):
+            cur = fused.get(h["id"])
+            if cur is None:
+                cur = fused[h["id"]] = dict(h, rrf=0.0)
+            else:
+                cur["score"] = max(cur["score"], h["score"])
+            cur["rrf"] += 1.0 / (k + rank)
+    out = sorted(fused.values(), key=lambda x: x["rrf"], reverse=True)
+    return out[:limit] if limit else out
+
+
+# ---------- 多路检索 ----------
+class QueryExpander:
+    def __init__(
+        self,
+        embedder=None,
+        mode: str = QUERY_EXPANSION,
+        model: str = EXPANSION_MODEL,
+        deadline_ms: int = EXPANSION_DEADLINE_MS,
+        max_probes: int = EXPANSION_MAX_PROBES,
+        max_chars: int = EXPANSION_MAX_CHARS,
+        cache_size: int = 256,
+    ):
+        if mode not in MODES:
+            raise ValueError(f"QUERY_EXPANSION 只能是 {'/'.join(MODES)}：{mode}")
+        self.embedder = embedder  # None 时用第一个集合的 embedder
+        self.mode = mode
+        self.model = model
+        self.deadline = deadline_ms / 1000.0
+        self.max_probes = max(1, max_probes)
+        self.max_chars = max_chars
+        self.cache_size = cache_size
+        self._rewrites: "OrderedDict[str, List[str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        # 外层任务（扩展 + 并行的普通检索）与各集合的检索分两个池：外层等内层时不会占满同一个池而互相等待
+        self._pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="expand")
+        self._fanout = ThreadPoolExecutor(max_workers=8, thread_name_prefix="expand-q")
+        self.counts = {"expanded": 0, "fallback": 0, "rewrite_cache_hits": 0}
+        self.seconds = 0.0  # 多路检索累计耗时（含改写、批量向量化与回退）
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != "off"
+
+    def should_expand(self, query: str) -> bool:
+        q = (query or "").strip()
+        return self.enabled and bool(q) and len(q) <= self.max_chars
+
+    # ---- 改写 ----
+    def _llm_rewrites(self, query: str, timeout: float) -> List[str]:
+        key = " ".join(query.split()).lower()
+        with self._lock:
+            hit = self._rewrites.get(key)
+            if hit is not None:
+                self._rewrites.move_to_end(key)
+                self.counts["rewrite_cache_hits"] += 1
+                return hit
+        client = get_client(timeout=max(0.05, timeout))
+        resp = rewrite_guard.call(
+            lambda: client.chat.completions.create(
+                model=self.model,
+                messages=[
+                    {"role": "system", "content": _REWRITE_PROMPT},
+                    {"role": "user", "content": query},
+                ],
+                temperature=0.3,
+            )
+        )
+        out = _parse_rewrite(resp.choices[0].message.content)
+        with self._lock:
+            self._rewrites[key] = out
+            while len(self._rewrites) > self.cache_size:
+                self._rewrites.popitem(last=False)
+        return out
+
+    def probes(self, query: str, deadline_at: Optional[float] = None) -> List[str]:
+        """原句 + 改写（去重，最多 max_probes 条）；模型改写失败/超时时只用规则改写"""
+        cands = [query] + rule_rewrites(query)
+        if self.mode == "llm":
+            remaining = (deadline_at - time.monotonic()) if deadline_at else self.deadline
+            try:
+                cands += self._llm_rewrites(query, remaining)
+            except Exception:
+                pass  # 改写失败/超时/熔断：只用规则改写
+        seen, out = set(), []
+        for c in cands:
+            key = " ".join(c.split()).lower()
+            if key and key not in seen:
+                seen.add(key)
+                out.append(c)
+        return out[: self.max_probes]
+
+    # ---- 检索 ----
+    def _plain(self, query: str, vmems: Sequence, k: int, filters: List[Optional[Dict]]) -> List[List[Dict]]:
+        return [vm.query(query, k=k, **f) if vm and f is not None else [] for vm, f in zip(vmems, filters)]
+
+    def _probe_lists(self, probes: List[str], vmems: Sequence, k: int, filters: List[Optional[Dict]]):
+        """探针的检索结果：与 vmems 对应，每项是各探针的结果列表（与 probes 同序）"""
+        live = [i for i, vm in enumerate(vmems) if vm and filters[i] is not None]
+        if not probes or not live:
+            return [[] for _ in vmems]
+        embedder = self.embedder or vmems[live[0]].embedder
+        embs = embedder.embed(probes)  # 一次请求算出全部探针的向量
+        futures = {
+            i: self._fanout.submit(vmems[i].query_embeddings, embs, k, **filters[i])
+            for i in live
+        }
+        out = [[] for _ in vmems]
+        for i, fut in futures.items():
+            out[i] = fut.result()
+        return out
+
+    def _expanded(self, query: str, vmems: Sequence, k: int, filters: List[Optional[Dict]], deadline_at: float):
+        """llm 模式的改写探针（不含原句，原句由并行的普通检索负责）"""
+        return self._probe_lists(self.probes(query, deadline_at)[1:], vmems, k, filters)
+
+    def search(
+        self,
+        query: str,
+        vmems: Sequence,
+        k: int = 6,
+        filters: Optional[List[Optional[Dict]]] = None,
+    ) -> List[List[Dict]]:
+        """
+        对每个集合做多路检索并融合，返回与 vmems 一一对应的结果列表
+        filters：每个集合的 query 过滤参数（{"where": ..., "where_document": ...}）；None 表示该集合跳过
+        rules：原句 + 规则改写一次批量向量化后检索并融合（没有需要等待的改写，不设截止时间）
+        llm  ：原句的普通检索与扩展同时开始：截止时间内扩展没完成（或出错）时直接用普通检索的结果，
+               最坏耗时不超过 max(截止时间, 普通检索)；扩展完成时普通检索作为 RRF 的一路参与融合
+        """
+        filters = list(filters) if filters is not None else [{} for _ in vmems]
+        t0 = time.monotonic()
+        if self.mode != "llm":
+            lists = self._probe_lists(self.probes(query), vmems, k, filters)
+            self.counts["expanded"] += 1
+            self.seconds += time.monotonic() - t0
+            return [rrf_fuse(ls, limit=k) for ls in lists]
+        plain = self._pool.submit(self._plain, query, vmems, k, filters)
+        expanded = self._pool.submit(self._expanded, query, vmems, k, filters, t0 + self.deadline)
+        try:
+            extra = expanded.result(timeout=self.deadline)
+        except (FutureTimeout, Exception):
+            extra = None
+        base = plain.result()  # 普通检索本身的错误（含熔断）照常抛给调用方
+        if extra is None:
+            self.counts["fallback"] += 1
+            result = base
+        else:
+            self.counts["expanded"] += 1
+            result = [rrf_fuse([hits] + lists, limit=k) for hits, lists in zip(base, extra)]
+        self.seconds += time.monotonic() - t0
+        return result
+
+    def stats_text(self) -> str:
+        if not self.enabled:
+            return "查询扩展：关闭（QUERY_EXPANSION=off）"
+        n = self.counts["expanded"] + self.counts["fallback"]
+        avg = self.seconds / n * 1000 if n else 0.0
+        return (
+            f"查询扩展（{self.mode}）：扩展 {self.counts['expanded']} 次，超时/出错回退 {self.counts['fallback']} 次，"
+            f"平均耗时 {avg:.0f} ms；改写缓存命中 {self.counts['rewrite_cache_hits']} 次"
+        )
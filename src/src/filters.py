@@ -0,0 +1,149 @@
+"""
+检索范围语法：把查询里的 @key:value 条件解析出来，下推成 Chroma 的 where / where_document
+（多个条件取交集，可以写在查询的任意位置）
+
+    @source:manual/*.md     来源路径，glob；匹配完整路径或路径结尾（manual/*.md 可匹配 data/manual/a.md）
+    @since:2025-10-01       created_at >= 该时间；也支持相对时间 30m / 12h / 7d
+    @until:2025-10-31       created_at <= 该时间（只写日期时包含当天）
+    @has:关键词              文档内容包含关键词
+    @name:项目计划 / @kind:system / @chunk:0 ……   其它任意元数据字段精确匹配
+
+用法：
+    query, scope = parse_scope("rag? @source:manual/*.md 安装步骤")
+    hits = vmem.query(query, k=8, **scope.filters_for(vmem))
+"""
+
+import re
+import time
+import fnmatch
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+_TOKEN_RE = re.compile(r"(?:(?<=\s)|^)@(\w+)[:：](\S+)")
+_RELATIVE_RE = re.compile(r"^(\d+(?:\.\d+)?)([mhdw])$", flags=re.I)
+_UNIT_SECONDS = {"m": 60, "h": 3600, "d": 86400, "w": 604800}
+_DATE_FORMATS = ("%Y-%m-%d %H:%M", "%Y-%m-%dT%H:%M", "%Y-%m-%d", "%Y/%m/%d")
+
+# 这些字段按数字写入，匹配时也要转成数字，其它字段一律按字符串比较
+NUMERIC_FIELDS = {"chunk", "created_at", "dup_count", "last_hit_at", "hit_count"}
+
+# 指向“查不到任何东西”的条件：范围为空时直接返回空结果，不发起检索
+NO_MATCH = object()
+
+# @source 展开成 $in 时最多允许的来源数；超过时报错，请用户写得更具体
+MAX_SOURCES = 500
+
+
+def parse_time(value: str, end_of_day: bool = False) -> float:
+    """绝对日期/时间或相对时间（7d = 7 天前）-> epoch 秒"""
+    m = _RELATIVE_RE.match(value)
+    if m:
+        return time.time() - float(m.group(1)) * _UNIT_SECONDS[m.group(2).lower()]
+    for fmt in _DATE_FORMATS:
+        try:
+            dt = datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+        if end_of_day and "%H" not in fmt:
+            dt += timedelta(days=1) - timedelta(seconds=1)
+        return dt.timestamp()
+    raise ValueError(f"无法解析时间：{value}（示例：2025-10-01、7d、12h）")
+
+
+def _scalar(value: str):
+    for cast in (int, float):
+        try:
+            return cast(value)
+        except ValueError:
+            pass
+    return value
+
+
+def source_matches(source: str, pattern: str) -> bool:
+    s = source.replace("\\", "/")
+    p = pattern.replace("\\", "/")
+    if fnmatch.fnmatch(s, p):
+        return True
+    # 允许只写路径结尾：manual/*.md 匹配 data/manual/a.md
+    parts = s.split("/")
+    return any(fnmatch.fnmatch("/".join(parts[i:]), p) for i in range(1, len(parts)))
+
+
+class Scope:
+    def __init__(self):
+        self.source_glob: Optional[str] = None
+        self.equals: Dict[str, object] = {}
+        self.since: Optional[float] = None
+        self.until: Optional[float] = None
+        self.contains: List[str] = []
+
+    def __bool__(self) -> bool:
+        return bool(self.source_glob or self.equals or self.since or self.until or self.contains)
+
+    def describe(self) -> str:
+        parts = []
+        if self.source_glob:
+            parts.append(f"source={self.source_glob}")
+        parts += [f"{k}={v}" for k, v in self.equals.items()]
+        if self.since:
+            parts.append("since=" + datetime.fromtimestamp(self.since).strftime("%Y-%m-%d %H:%M"))
+        if self.until:
+            parts.append("until=" + datetime.fromtimestamp(self.until).strftime("%Y-%m-%d %H:%M"))
+        parts += [f"has={c}" for c in self.contains]
+        return ", ".join(parts)
+
+    def filters_for(self, vmem) -> Dict:
+        """
+        针对某个集合生成 query(...) 的 where / where_document 参数。
+        @source 的 glob 按该集合的来源索引（vmem.source_counts()）展开成 $in；一个都不匹配时返回 {"where": NO_MATCH}，
+        匹配的来源超过 MAX_SOURCES 时抛 ValueError。
+        """
+        conds: List[Dict] = []
+        if self.source_glob:
+            sources = sorted(s for s in vmem.source_counts() if source_matches(s, self.source_glob))
+            if not sources:
+                return {"where": NO_MATCH}
+            if len(sources) > MAX_SOURCES:
+                raise ValueError(
+                    f"@source:{self.source_glob} 匹配到 {len(sources)} 个来源（上限 {MAX_SOURCES}），请写得更具体"
+                )
+            conds.append({"source": sources[0]} if len(sources) == 1 else {"source": {"$in": sources}})
+        conds += [{k: v} for k, v in self.equals.items()]
+        if self.since is not None:
+            conds.append({"created_at": {"$gte": int(self.since)}})
+        if self.until is not None:
+            conds.append({"created_at": {"$lte": int(self.until)}})
+
+        where = None
+        if len(conds) == 1:
+            where = conds[0]
+        elif conds:
+            where = {"$and": conds}
+        where_document = None
+        if len(self.contains) == 1:
+            where_document = {"$contains": self.contains[0]}
+        elif self.contains:
+            where_document = {"$and": [{"$contains": c} for c in self.contains]}
+        return {"where": where, "where_document": where_document}
+
+
+def parse_scope(text: str) -> Tuple[str, Scope]:
+    """拆出 @key:value 条件，返回 (剩余查询文本, Scope)"""
+    scope = Scope()
+
+    def _take(m: "re.Match") -> str:
+        key, value = m.group(1).lower(), m.group(2)
+        if key == "source":
+            scope.source_glob = value
+        elif key == "since":
+            scope.since = parse_time(value)
+        elif key == "until":
+            scope.until = parse_time(value, end_of_day=True)
+        elif key == "has":
+            scope.contains.append(value)
+        else:
+            scope.equals[m.group(1)] = _scalar(value) if key in NUMERIC_FIELDS else value
+        return ""
+
+    rest = _TOKEN_RE.sub(_take, text or "")
+    return " ".join(rest.split()), scope
@@ -1,12 +1,30 @@
 """
 将本地文件（data/）切块 -> 调用 OpenAI Embeddings -> 写入 Chroma 持久化向量库。
 运行示例：
-    python src/ingest.py --source data --persist .chroma --collection docs
+    python -m src.src.ingest --source data --persist .chroma --collection docs
+    python src/src/ingest.py --source data --persist .chroma --collection docs
+
+快照（换机器/重建时免重新向量化，零 API 调用）：
+    python -m src.src.ingest export --persist .chroma --collection docs --out snapshots/docs
+    python -m src.src.ingest import --persist .chroma --snapshot snapshots/docs [--collection docs]
+    DOCS_SNAPSHOT=snapshots/docs python -m src.src.main    # 聊天进程直接在快照上检索，不导入
+
+持续监听目录（watchdog/inotify，未安装时轮询），只增量处理变化的文件：
+    python -m src.src.ingest --source data --collection docs --watch
+
+去重维护（清理存量集合里的重复条目）：
+    python -m src.src.ingest dedupe --persist .chroma --collection docs
+
+剖析（输出到 PROFILE_DIR，默认 .profiles）：
+    PROFILE=1 PROFILE_TRACEMALLOC=25 PROFILE_SAMPLE_HZ=100 python -m src.src.ingest --source data
 """
 
 import os
+import re
+import sys
 import glob
 import json
+import time
 import argparse
 from typing import List, Dict, Tuple
 
@@ -14,11 +32,25 @@ from dotenv import load_dotenv
 load_dotenv()
 
 # ---- OpenAI Embeddings（直接用官方 SDK，不依赖 langchain）----
-from openai import OpenAI
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-if not OPENAI_API_KEY:
-    raise RuntimeError("未找到 OPENAI_API_KEY。请在项目根目录 .env 写入：OPENAI_API_KEY=sk-xxxx")
-client = OpenAI(api_key=OPENAI_API_KEY)
+# 与 main.py 共用同一个客户端工厂（连接池 / 超时 / OPENAI_BASE_URL）
+if __package__:
+    from .openai_client import get_client
+    from .resilience import embed_guard
+    from .memory import bump_collection_version, get_source_index
+    from . import snapshot
+    from .config import DEDUP_POLICY, DEDUP_NEAR_BITS
+    from .dedup import get_index as get_dedup_index, dedupe_collection, DedupIndex
+    from .profiling import get_profiler
+else:  # 以脚本方式运行：python src/src/ingest.py
+    sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+    from src.src.openai_client import get_client
+    from src.src.resilience import embed_guard
+    from src.src.memory import bump_collection_version, get_source_index
+    from src.src import snapshot
+    from src.src.config import DEDUP_POLICY, DEDUP_NEAR_BITS
+    from src.src.dedup import get_index as get_dedup_index, dedupe_collection, DedupIndex
+    from src.src.profiling import get_profiler
+client = get_client()
 
 EMBED_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-3-small")
 
@@ -47,29 +79,80 @@ def read_pdf_file(path: str) -> str:
         texts.append(page.extract_text() or "")
     return "\n".join(texts)
 
-def load_raw_documents(source_dir: str, pattern: str) -> List[Tuple[str, str]]:
-    """
-    返回 [(path, text), ...]
-    """
-    files = glob.glob(os.path.join(source_dir, pattern), recursive=True)
+def is_supported(path: str) -> bool:
+    ext = os.path.splitext(path)[1].lower()
+    return ext == ".pdf" or ext in SUPPORTED_EXTS
+
+def read_document(fp: str) -> str:
+    """读取单个文件；不支持的后缀返回空串"""
+    ext = os.path.splitext(fp)[1].lower()
+    if ext == ".pdf":
+        return read_pdf_file(fp).strip()
+    if ext in SUPPORTED_EXTS:
+        return read_text_file(fp).strip()
+    return ""
+
+def load_documents(paths: List[str]) -> List[Tuple[str, str]]:
     result = []
-    for fp in files:
-        ext = os.path.splitext(fp)[1].lower()
+    for fp in paths:
         try:
-            if ext == ".pdf":
-                text = read_pdf_file(fp)
-            elif ext in SUPPORTED_EXTS:
-                text = read_text_file(fp)
-            else:
-                # 不支持的后缀直接跳过
-                continue
-            text = text.strip()
+            text = read_document(fp)
             if text:
                 result.append((fp, text))
         except Exception as e:
             print(f"⚠️ 读取失败：{fp} -> {e}")
     return result
 
+def list_source_files(source_dir: str, pattern: str) -> List[str]:
+    files = glob.glob(os.path.join(source_dir, pattern), recursive=True)
+    # 不支持的后缀直接跳过
+    return [fp for fp in files if os.path.isfile(fp) and is_supported(fp)]
+
+def pattern_regex(pattern: str) -> "re.Pattern":
+    """
+    --pattern（glob，recursive=True）-> 匹配相对路径的正则：** 跨目录，* / ? / [..] 不跨目录
+    watch 模式用它判断事件里的单个路径，不必每批都整目录 glob
+    """
+    pat = pattern.replace("\\", "/")
+    out, i = [], 0
+    while i < len(pat):
+        if pat.startswith("**/", i):
+            out.append("(?:[^/]*/)*")
+            i += 3
+        elif pat.startswith("**", i):
+            out.append(".*")
+            i += 2
+        elif pat[i] == "*":
+            out.append("[^/]*")
+            i += 1
+        elif pat[i] == "?":
+            out.append("[^/]")
+            i += 1
+        elif pat[i] == "[" and "]" in pat[i + 2:]:
+            j = pat.index("]", i + 2)
+            body = pat[i + 1:j]
+            out.append("[" + ("^" + body[1:] if body.startswith("!") else body).replace("\\", "\\\\") + "]")
+            i = j + 1
+        else:
+            out.append(re.escape(pat[i]))
+            i += 1
+    return re.compile("".join(out) + r"\Z")
+
+
+def matches_source(path: str, source_dir: str, regex: "re.Pattern") -> bool:
+    """与 list_source_files 的结果一致：在 source_dir 下、匹配 pattern、不是隐藏文件（glob 的 * 不匹配 . 开头）、后缀受支持"""
+    rel = os.path.relpath(path, source_dir).replace("\\", "/")
+    if rel.startswith("../") or any(part.startswith(".") for part in rel.split("/")):
+        return False
+    return bool(regex.match(rel)) and is_supported(path) and os.path.isfile(path)
+
+
+def load_raw_documents(source_dir: str, pattern: str) -> List[Tuple[str, str]]:
+    """
+    返回 [(path, text), ...]
+    """
+    return load_documents(list_source_files(source_dir, pattern))
+
 
 # ========== 文本切块 ==========
 
@@ -86,6 +169,8 @@ def chunk_text(text: str, chunk_size: int = 800, chunk_overlap: int = 100) -> Li
     while start < n:
         end = min(start + chunk_size, n)
         chunks.append(text[start:end])
+        if end >= n:
+            break  # 已到结尾；否则短文本会因 start 回退到 0 而死循环
         start = end - chunk_overlap
         if start < 0:
             start = 0
@@ -104,47 +189,79 @@ def embed_batch(texts: List[str]) -> List[List[float]]:
     BATCH = 256
     for i in range(0, len(texts), BATCH):
         batch = texts[i:i+BATCH]
-        resp = client.embeddings.create(model=EMBED_MODEL, input=batch)
+        resp = embed_guard.call(
+            lambda: client.embeddings.create(model=EMBED_MODEL, input=batch),
+            on_retry=lambda kind, wait_s, e: print(f"⚠️ 向量化暂时失败（{kind}），{wait_s:.1f}s 后重试…"),
+        )
         out.extend([d.embedding for d in resp.data])
     return out
 
 
 # ========== 写入 Chroma ==========
 
-def get_chroma_collection(persist_dir: str, collection_name: str):
+def get_chroma_collection(persist_dir: str, collection_name: str, space: str = None):
+    """space：新建集合时的距离度量（如 "cosine"）；已存在的集合保持原设置"""
     os.makedirs(persist_dir, exist_ok=True)
     client = chromadb.PersistentClient(
         path=persist_dir,
         settings=Settings(allow_reset=False)
     )
-    coll = client.get_or_create_collection(collection_name)
+    metadata = {"hnsw:space": space} if space else None
+    coll = client.get_or_create_collection(collection_name, metadata=metadata)
     return coll
 
 def upsert_documents(
     coll,
     docs: List[Tuple[str, str]],
     chunk_size: int,
-    chunk_overlap: int
-):
+    chunk_overlap: int,
+    dedup_index=None,
+    near_dup: bool = False,
+) -> int:
+    """将文档切块后写入/更新到 Chroma，返回写入的块数（见 upsert_chunks）"""
+    return len(upsert_chunks(coll, docs, chunk_size, chunk_overlap, dedup_index, near_dup))
+
+
+def upsert_chunks(
+    coll,
+    docs: List[Tuple[str, str]],
+    chunk_size: int,
+    chunk_overlap: int,
+    dedup_index=None,
+    near_dup: bool = False,
+) -> List[str]:
     """
-    将文档切块后写入/更新到 Chroma。
+    将文档切块后写入/更新到 Chroma，返回写入的块 id。
     id 规则： {path}::{idx}
-    metadata: {"source": path, "chunk": idx}
+    metadata: {"source": path, "chunk": idx, "created_at": 写入时间}
+    dedup_index 不为空时跳过同一文件内重复的块，并把写入的块登记进签名索引；
+    不跨文件去重：跳过的块依赖另一个文件，那个文件被删除后内容就从集合里消失了。
+    near_dup=True 时同时跳过近似重复。
     """
     all_ids: List[str] = []
     all_docs: List[str] = []
     all_metas: List[Dict] = []
+    skipped = 0
+    now = int(time.time())
 
     for path, text in docs:
         chunks = chunk_text(text, chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+        seen = DedupIndex(None, dedup_index.near_bits) if dedup_index is not None else None
         for idx, ck in enumerate(chunks):
+            if seen is not None:
+                if seen.find(ck, near=near_dup):
+                    skipped += 1
+                    continue
+                seen.add([(str(idx), ck)])
             all_ids.append(f"{path}::{idx}")
             all_docs.append(ck)
-            all_metas.append({"source": path, "chunk": idx})
+            all_metas.append({"source": path, "chunk": idx, "created_at": now})
 
+    if skipped:
+        print(f"♻️ 跳过 {skipped} 个重复文本块。")
     if not all_docs:
         print("ℹ️ 没有可写入的文档块。")
-        return 0
+        return []
 
     print(f"🧩 共 {len(all_docs)} 个文本块，开始生成向量（模型：{EMBED_MODEL}）...")
     vectors = embed_batch(all_docs)
@@ -157,13 +274,315 @@ def upsert_documents(
         metadatas=all_metas,
         embeddings=vectors
     )
+    if dedup_index is not None:
+        dedup_index.add(zip(all_ids, all_docs))
     print("🎉 写入完成。")
-    return len(all_docs)
+    return all_ids
+
+
+def remove_sources(coll, paths: List[str], dedup_index=None) -> int:
+    """删除这些文件已写入的全部文本块（文件被删除，或内容变化需要整体替换时）"""
+    removed = 0
+    for path in paths:
+        ids = coll.get(where={"source": path}, include=[]).get("ids") or []
+        if ids:
+            coll.delete(ids=ids)
+            if dedup_index is not None:
+                dedup_index.remove(ids)
+            removed += len(ids)
+    return removed
+
+
+# ========== Watch 模式 ==========
+
+WATCH_BATCH_FILES = 16   # 每批处理的文件数：小批量，新内容尽快可检索
+WATCH_RETRY_S = 30       # 同步失败（API 出错/熔断/文件读不出来）后多久重试
+
+
+def _file_sig(path: str) -> List[int]:
+    st = os.stat(path)
+    return [st.st_mtime_ns, st.st_size]
+
+
+def scan_signatures(source_dir: str, pattern: str) -> Dict[str, List[int]]:
+    sigs = {}
+    for fp in list_source_files(source_dir, pattern):
+        try:
+            sigs[fp] = _file_sig(fp)
+        except OSError:
+            pass  # 扫描期间被删除
+    return sigs
+
+
+def _start_fs_events(source_dir: str):
+    """
+    优先用 watchdog（Linux 下基于 inotify）推送文件事件；未安装时返回 None，退回轮询。
+    返回 (observer, queue)；队列里是发生变化的绝对路径。
+    """
+    try:
+        from watchdog.observers import Observer  # pip install watchdog
+        from watchdog.events import FileSystemEventHandler
+    except Exception:
+        return None
+    import queue
+
+    q = queue.Queue()
+
+    class _Handler(FileSystemEventHandler):
+        def on_any_event(self, event):
+            if event.is_directory:
+                return
+            q.put(event.src_path)
+            dest = getattr(event, "dest_path", None)
+            if dest:
+                q.put(dest)
+
+    observer = Observer()
+    observer.schedule(_Handler(), os.path.abspath(source_dir), recursive=True)
+    observer.start()
+    return observer, q
+
+
+def sync_changes(coll, args, changed: List[str], deleted: List[str], dedup_index=None) -> Tuple[int, int, List[str]]:
+    """
+    把变化的文件分小批做 切块 -> 向量化 -> upsert -> 删除多出来的旧块；返回 (写入块数, 删除块数, 失败的文件)
+    先写新块再删旧块：向量化失败/熔断/文件读不出来时，该文件的旧块保持原样，由调用方稍后重试
+    """
+    written = removed = 0
+    failed: List[str] = []
+    counts: Dict[str, int] = {}  # 来源 -> 最新块数，随版本号一起写进来源索引（@source 展开时不必重扫集合）
+    sources = get_source_index(args.persist, args.collection)
+
+    def _publish():
+        # 每批都让聊天进程的检索缓存失效：新内容几秒内可见
+        version = bump_collection_version(args.persist, args.collection)
+        sources.update(counts, version - 1, version)
+        counts.clear()
+
+    if deleted:
+        try:
+            removed += remove_sources(coll, deleted, dedup_index)
+            counts.update((p, 0) for p in deleted)
+        except Exception as e:
+            print(f"⚠️ 删除旧块失败，稍后重试：{e}")
+            failed += deleted
+    for i in range(0, len(changed), WATCH_BATCH_FILES):
+        docs = []
+        for fp in changed[i:i + WATCH_BATCH_FILES]:
+            try:
+                docs.append((fp, read_document(fp)))  # 空文本也保留：它的旧块要删掉
+            except Exception as e:
+                print(f"⚠️ 读取失败，稍后重试：{fp} -> {e}")
+                failed.append(fp)
+        if not docs:
+            continue
+        paths = [fp for fp, _ in docs]
+        try:
+            old_ids = coll.get(where={"source": {"$in": paths}}, include=[]).get("ids") or []
+            new_ids = set(upsert_chunks(
+                coll, docs, args.chunk_size, args.chunk_overlap,
+                dedup_index=dedup_index, near_dup=args.near_dup,
+            ))
+            stale = [_id for _id in old_ids if _id not in new_ids]
+            if stale:
+                coll.delete(ids=stale)
+                if dedup_index is not None:
+                    dedup_index.remove(stale)
+        except Exception as e:
+            print(f"⚠️ 同步失败，稍后重试（{len(paths)} 个文件）：{e}")
+            failed += paths
+            continue
+        written += len(new_ids)
+        removed += len(stale)
+        for fp in paths:
+            counts[fp] = 0
+        for _id in new_ids:
+            src = _id.rsplit("::", 1)[0]
+            counts[src] += 1
+        _publish()
+    if counts:
+        _publish()
+    return written, removed, failed
+
+
+def watch(coll, args, dedup_index=None):
+    """
+    持续监听 --source：只处理变化的文件，不做全量重扫。
+    上次运行的文件签名保存在 persist/watch_state_<collection>.json，重启后只补处理期间的变化。
+    """
+    state_path = os.path.join(args.persist, f"watch_state_{args.collection}.json")
+
+    def save_state(sigs):
+        tmp = state_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(sigs, f, ensure_ascii=False)
+        os.replace(tmp, state_path)
+
+    # known：已成功同步的文件签名（只有同步成功的文件才更新，失败的保留旧签名以便重启后也会重试）
+    known: Dict[str, List[int]] = {}
+    if os.path.exists(state_path):
+        with open(state_path, "r", encoding="utf-8") as f:
+            known = json.load(f)
+    pending: set = set()
+    retry_at = 0.0
+
+    def run_sync(changed: List[str], deleted: List[str], sigs: Dict[str, List[int]]):
+        nonlocal retry_at
+        t0 = time.time()
+        try:
+            with get_profiler("ingest").turn("sync"):
+                written, removed, failed = sync_changes(coll, args, changed, deleted, dedup_index)
+        except Exception as e:
+            print(f"⚠️ 同步失败：{e}")
+            written = removed = 0
+            failed = changed + deleted
+        failed_set = set(failed)
+        for p in changed:
+            if p not in failed_set:
+                known[p] = sigs[p]
+        for p in deleted:
+            if p not in failed_set:
+                known.pop(p, None)
+        save_state(known)
+        ok_changed = sum(1 for p in changed if p not in failed_set)
+        ok_deleted = sum(1 for p in deleted if p not in failed_set)
+        if ok_changed or ok_deleted:
+            print(f"✅ 同步 {ok_changed} 个变化 / {ok_deleted} 个删除："
+                  f"写入 {written} 块，移除 {removed} 块（{time.time() - t0:.1f}s）")
+        if failed:
+            pending.update(failed)
+            retry_at = time.time() + WATCH_RETRY_S
+            print(f"⏳ {len(failed)} 个文件同步失败，{WATCH_RETRY_S}s 后重试。")
+
+    current = scan_signatures(args.source, args.pattern)
+    changed = [p for p, sig in current.items() if known.get(p) != sig]
+    deleted = [p for p in known if p not in current]
+    if changed or deleted:
+        print(f"🔄 启动同步：变化 {len(changed)} 个文件，删除 {len(deleted)} 个文件")
+        run_sync(changed, deleted, current)
+
+    fs_events = _start_fs_events(args.source)
+    mode = "文件事件（watchdog/inotify）" if fs_events else f"轮询（每 {args.poll_interval}s）"
+    print(f"👀 监听 {args.source}（{mode}，防抖 {args.debounce}s），Ctrl+C 退出。")
+
+    source_abs = os.path.abspath(args.source)
+    source_re = pattern_regex(args.pattern)
+    last_event = 0.0
+    try:
+        while True:
+            if fs_events:
+                observer, q = fs_events
+                try:
+                    p = q.get(timeout=args.debounce)
+                    while True:
+                        rel = os.path.relpath(os.path.abspath(p), source_abs)
+                        if not rel.startswith(".."):
+                            pending.add(os.path.join(args.source, rel))
+                            last_event = time.time()
+                        p = q.get_nowait()
+                except Exception:
+                    pass  # 队列已取空 / 超时
+            else:
+                time.sleep(args.poll_interval)
+                now_sigs = scan_signatures(args.source, args.pattern)
+                diff = {p for p, sig in now_sigs.items() if known.get(p) != sig} | (set(known) - set(now_sigs))
+                if diff - pending:
+                    last_event = time.time()
+                pending |= diff
+
+            # 防抖：最后一次变化后安静 debounce 秒再处理，合并编辑器的连续保存；上次失败后等 retry_at 再重试
+            now = time.time()
+            if not pending or now - last_event < args.debounce or now < retry_at:
+                continue
+
+            changed, deleted, sigs = [], [], {}
+            for p in sorted(pending):
+                if matches_source(p, args.source, source_re):
+                    try:
+                        sig = _file_sig(p)
+                    except OSError:
+                        continue
+                    if known.get(p) != sig:
+                        changed.append(p)
+                        sigs[p] = sig
+                elif p in known:
+                    deleted.append(p)
+            pending.clear()
+            if changed or deleted:
+                run_sync(changed, deleted, sigs)
+    except KeyboardInterrupt:
+        print("👋 停止监听。")
+    finally:
+        if fs_events:
+            fs_events[0].stop()
+            fs_events[0].join()
+
+
+# ========== 快照 导出 / 导入 ==========
+
+def cmd_export(argv: List[str]):
+    parser = argparse.ArgumentParser(prog="ingest export", description="把集合导出为快照（float16 向量 + 按列 jsonl）")
+    parser.add_argument("--persist", default=".chroma", help="Chroma 持久化目录（默认 .chroma）")
+    parser.add_argument("--collection", default="docs", help="集合名称（默认 docs）")
+    parser.add_argument("--out", required=True, help="快照输出目录")
+    args = parser.parse_args(argv)
+
+    coll = get_chroma_collection(args.persist, args.collection)
+    print(f"📦 导出集合 {args.collection}（{coll.count()} 条）-> {args.out}")
+    n = snapshot.export_collection(coll, args.out, embed_model=EMBED_MODEL)
+    print(f"🎉 导出完成：{n} 条。")
+
+
+def cmd_import(argv: List[str]):
+    parser = argparse.ArgumentParser(prog="ingest import", description="从快照批量导入集合（不调用 API）")
+    parser.add_argument("--persist", default=".chroma", help="Chroma 持久化目录（默认 .chroma）")
+    parser.add_argument("--snapshot", required=True, help="快照目录")
+    parser.add_argument("--collection", default=None, help="目标集合（默认使用快照里的集合名）")
+    parser.add_argument("--batch", type=int, default=snapshot.IMPORT_BATCH, help="每批 upsert 条数")
+    args = parser.parse_args(argv)
+
+    manifest = snapshot.read_manifest(args.snapshot)
+    name = args.collection or manifest["collection"]
+    if manifest.get("embed_model") and manifest["embed_model"] != EMBED_MODEL:
+        print(f"⚠️ 快照向量模型为 {manifest['embed_model']}，当前为 {EMBED_MODEL}：查询向量可能不兼容。")
+
+    coll = get_chroma_collection(args.persist, name, space=manifest.get("space"))
+    print(f"📥 导入快照 {args.snapshot}（{manifest['count']} 条，dim={manifest['dim']}）-> {name}")
+    dedup_index = None if DEDUP_POLICY == "off" else get_dedup_index(args.persist, name, DEDUP_NEAR_BITS)
+    n = snapshot.import_snapshot(coll, args.snapshot, batch=args.batch, dedup_index=dedup_index)
+    if n:
+        bump_collection_version(args.persist, name)
+    print(f"🎉 导入完成：{n} 条。")
+
+
+# ========== 去重维护 ==========
+
+def cmd_dedupe(argv: List[str]):
+    parser = argparse.ArgumentParser(prog="ingest dedupe", description="清理集合中已有的重复条目并重建签名索引")
+    parser.add_argument("--persist", default=".chroma", help="Chroma 持久化目录（默认 .chroma）")
+    parser.add_argument("--collection", default="docs", help="集合名称（默认 docs）")
+    parser.add_argument("--exact-only", action="store_true", help="只清理完全相同的条目")
+    args = parser.parse_args(argv)
+
+    coll = get_chroma_collection(args.persist, args.collection)
+    index = get_dedup_index(args.persist, args.collection, DEDUP_NEAR_BITS)
+    print(f"🔍 扫描集合 {args.collection}（{coll.count()} 条）…")
+    scanned, removed = dedupe_collection(coll, index, near=not args.exact_only)
+    if removed:
+        bump_collection_version(args.persist, args.collection)
+    print(f"🎉 扫描 {scanned} 条，删除重复 {removed} 条；签名索引 {len(index)} 条。")
+
+
+SUBCOMMANDS = {"export": cmd_export, "import": cmd_import, "dedupe": cmd_dedupe}
 
 
 # ========== CLI ==========
 
-def main():
+def main(argv: List[str] = None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv and argv[0] in SUBCOMMANDS:
+        return SUBCOMMANDS[argv[0]](argv[1:])
+
     parser = argparse.ArgumentParser(description="将本地文件向量化并写入 Chroma")
     parser.add_argument("--source", default="data", help="原始文档目录（默认 data）")
     parser.add_argument(
@@ -175,14 +594,39 @@ def main():
     parser.add_argument("--collection", default="docs", help="集合名称（默认 docs）")
     parser.add_argument("--chunk-size", type=int, default=800, help="切块大小（默认 800）")
     parser.add_argument("--chunk-overlap", type=int, default=100, help="切块重叠（默认 100）")
-    args = parser.parse_args()
+    parser.add_argument("--near-dup", action="store_true", help="同时跳过近似重复的文本块（默认只跳过完全相同的）")
+    parser.add_argument("--watch", action="store_true", help="持续监听 --source，只增量处理变化的文件")
+    parser.add_argument("--debounce", type=float, default=1.0, help="watch：最后一次变化后等待多少秒再处理（默认 1.0）")
+    parser.add_argument("--poll-interval", type=float, default=2.0, help="watch：未安装 watchdog 时的轮询间隔（默认 2.0）")
+    args = parser.parse_args(argv)
+
+    # PROFILE / PROFILE_TRACEMALLOC / PROFILE_SAMPLE_HZ：整次运行（watch 为每次同步）一份剖析
+    profiler = get_profiler("ingest")
+    try:
+        if args.watch:
+            coll = get_chroma_collection(args.persist, args.collection)
+            dedup_index = None if DEDUP_POLICY == "off" else get_dedup_index(args.persist, args.collection, DEDUP_NEAR_BITS)
+            return watch(coll, args, dedup_index)
+        with profiler.turn("ingest"):
+            run_ingest(args)
+    finally:
+        profiler.close()
 
+
+def run_ingest(args):
     print(f"📂 扫描目录：{args.source}（模式：{args.pattern}）")
     raw_docs = load_raw_documents(args.source, args.pattern)
     print(f"📝 读取到 {len(raw_docs)} 个文件。")
 
     coll = get_chroma_collection(args.persist, args.collection)
-    n = upsert_documents(coll, raw_docs, args.chunk_size, args.chunk_overlap)
+    dedup_index = None if DEDUP_POLICY == "off" else get_dedup_index(args.persist, args.collection, DEDUP_NEAR_BITS)
+    n = upsert_documents(
+        coll, raw_docs, args.chunk_size, args.chunk_overlap,
+        dedup_index=dedup_index, near_dup=args.near_dup,
+    )
+    if n:
+        # 让正在运行的聊天进程的检索缓存失效
+        bump_collection_version(args.persist, args.collection)
 
     # 记录一次 ingest 信息
     meta = {
@@ -0,0 +1,325 @@
+"""
+记忆生命周期：保留策略 + 衰减打分 + 后台压缩
+（只管理聊天进程自己写入的集合；docs 由 ingest 维护，可用 export/import 快照重建）
+
+- 保留策略（MEMORY_RETENTION，按集合配置，默认关闭；例如 "long_term:ttl=180,max=5000;user_notes:max=2000"）
+    ttl=天数：创建后、以及最近一次被召回后都超过 ttl 天的条目过期删除（没有时间戳的旧条目不按 ttl 删）
+    max=条数：超出上限时按“最近使用时间”（召回或创建，取较晚者）从旧到新淘汰
+- 召回记录：被用进上下文的条目写回 last_hit_at / hit_count（后台线程批量写，不占对话耗时）
+- 衰减打分：score = 相似度 + 新近度权重 × 0.5^(距上次使用天数 / 半衰期) + 使用权重 × 召回次数（对数归一）
+- 后台压缩：Chroma 删除后 HNSW 索引里留有已删除的节点，检索会越来越慢；
+  删除量超过比例时把集合复制成新集合（索引重新构建）再原名替换，id/文档/元数据/向量保持不变
+
+用法：
+    lifecycle = LifecycleManager([vmem_facts, vmem_notes], persist_dir)
+    lifecycle.start()
+    hits = rerank(vmem_notes, vmem_notes.query(q, k=8))
+    lifecycle.record_hits(vmem_notes, [h["id"] for h in kept])
+    lifecycle.stop()
+"""
+
+import os
+import json
+import math
+import time
+import queue
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from .config import (
+    MEMORY_RETENTION,
+    MEMORY_RECENCY_WEIGHT,
+    MEMORY_USAGE_WEIGHT,
+    MEMORY_HALF_LIFE_DAYS,
+    MEMORY_MAINTENANCE_INTERVAL,
+    MEMORY_COMPACT_RATIO,
+    MEMORY_COMPACT_MIN_DELETES,
+)
+
+USAGE_SATURATION = 20     # 召回 20 次即视为满分使用度
+SCAN_PAGE = 5000
+COPY_BATCH = 4096         # 需小于 Chroma 的 max_batch_size
+COMPACT_SUFFIX = "__compact"
+RETIRED_SUFFIX = "__retired"
+
+
+def parse_retention(spec: str) -> Dict[str, Dict]:
+    """'long_term:ttl=180,max=5000;user_notes:max=2000' -> {集合: {"ttl_days": .., "max": ..}}"""
+    policies = {}
+    for part in (spec or "").split(";"):
+        if not part.strip():
+            continue
+        name, _, opts = part.partition(":")
+        policy = {"ttl_days": None, "max": None}
+        for opt in opts.split(","):
+            key, _, value = opt.partition("=")
+            key = key.strip().lower()
+            if key == "ttl":
+                policy["ttl_days"] = float(value)
+            elif key == "max":
+                policy["max"] = int(value)
+            elif key:
+                raise ValueError(f"MEMORY_RETENTION 不支持的选项：{key}（只支持 ttl / max）")
+        policies[name.strip()] = policy
+    return policies
+
+
+# ---------- 打分 ----------
+def _last_used(vmem, _id: str, meta: Dict) -> Tuple[float, int]:
+    """(最近使用时间, 召回次数)：本进程的召回记录优先（缓存里的元数据可能是旧的）"""
+    last_hit, count = vmem.hit_stats.get(_id) or (meta.get("last_hit_at") or 0, meta.get("hit_count") or 0)
+    return max(float(last_hit or 0), float(meta.get("created_at") or 0)), int(count)
+
+
+def rerank(vmem, hits: List[Dict], now: Optional[float] = None) -> List[Dict]:
+    """相似度叠加新近度与使用度（只影响排序）；原相似度保留在 sim，min_score 过滤应使用 sim"""
+    if not hits or not vmem or not (MEMORY_RECENCY_WEIGHT or MEMORY_USAGE_WEIGHT):
+        return hits
+    now = now or time.time()
+    for h in hits:
+        last, count = _last_used(vmem, h["id"], h.get("meta") or {})
+        recency = 0.5 ** (max(0.0, now - last) / 86400 / MEMORY_HALF_LIFE_DAYS) if last else 0.0
+        usage = min(1.0, math.log1p(count) / math.log1p(USAGE_SATURATION))
+        boost = MEMORY_RECENCY_WEIGHT * recency + MEMORY_USAGE_WEIGHT * usage
+        h["sim"] = h["score"]
+        h["score"] = h["score"] + boost
+        if "rrf" in h:
+            h["rrf"] *= 1.0 + boost
+    hits.sort(key=lambda x: x.get("rrf", x["score"]), reverse=True)
+    return hits
+
+
+# ---------- 保留策略 ----------
+def _scan(vmem) -> List[Tuple[str, float, int]]:
+    """[(id, 最近使用时间, 召回次数)]；最近使用时间为 0 表示没有时间戳"""
+    rows, offset, total = [], 0, vmem.count()
+    while offset < total:
+        got = vmem.col.get(include=["metadatas"], limit=SCAN_PAGE, offset=offset)
+        ids = got.get("ids") or []
+        if not ids:
+            break
+        for _id, meta in zip(ids, got.get("metadatas") or [None] * len(ids)):
+            rows.append((_id, *_last_used(vmem, _id, meta or {})))
+        offset += len(ids)
+    return rows
+
+
+def enforce_retention(vmem, policy: Dict, now: Optional[float] = None) -> Tuple[int, int]:
+    """按策略删除过期/超额条目；返回 (过期条数, 淘汰条数)"""
+    ttl_days, cap = policy.get("ttl_days"), policy.get("max")
+    if not ttl_days and not cap:
+        return 0, 0
+    now = now or time.time()
+    rows = _scan(vmem)
+    expired = set()
+    if ttl_days:
+        expired = {_id for _id, last, _ in rows if last and now - last > ttl_days * 86400}
+    evicted = []
+    if cap:
+        # 最久未使用的先淘汰；同一时间的按召回次数少的先淘汰
+        remaining = sorted((r for r in rows if r[0] not in expired), key=lambda r: (r[1], r[2]))
+        evicted = [r[0] for r in remaining[: max(0, len(remaining) - cap)]]
+    drop = list(expired) + evicted
+    for i in range(0, len(drop), SCAN_PAGE):
+        vmem.delete(drop[i:i + SCAN_PAGE])
+    return len(expired), len(evicted)
+
+
+# ---------- 压缩 ----------
+def compact_collection(vmem) -> bool:
+    """
+    复制重建集合并原名替换；复制期间被写过的条目（写入/删除/召回记录）在替换前按 id 重新同步。
+    集合在复制期间被清空，或条数仍对不上时放弃本次压缩，返回 False。
+    旧集合改名为 <name>__retired 而不是立即删除：正在进行的读取仍持有它的句柄，由下一轮维护清理。
+    """
+    client, old = vmem.client, vmem.col
+    name = old.name
+    _drop_if_exists(client, name + COMPACT_SUFFIX)
+    new = client.create_collection(name=name + COMPACT_SUFFIX, metadata=old.metadata)
+    vmem.track_changes()
+    try:
+        offset, total = 0, old.count()
+        while offset < total:
+            got = old.get(include=["documents", "metadatas", "embeddings"], limit=COPY_BATCH, offset=offset)
+            ids = got.get("ids") or []
+            if not ids:
+                break
+            _copy_rows(new, got)
+            offset += len(ids)
+
+        with vmem.write_lock:
+            changed = vmem.take_changes()
+            if changed is None:  # 复制期间集合被 reset
+                client.delete_collection(new.name)
+                return False
+            changed = list(changed)
+            for i in range(0, len(changed), COPY_BATCH):
+                batch = changed[i:i + COPY_BATCH]
+                got = old.get(ids=batch, include=["documents", "metadatas", "embeddings"])
+                if got.get("ids"):
+                    _copy_rows(new, got, upsert=True)
+                gone = list(set(batch) - set(got.get("ids") or []))
+                if gone:
+                    new.delete(ids=gone)
+            if old.count() != new.count():
+                client.delete_collection(new.name)
+                return False
+            _drop_if_exists(client, name + RETIRED_SUFFIX)
+            old.modify(name=name + RETIRED_SUFFIX)
+            new.modify(name=name)
+            vmem.col = new
+        return True
+    finally:
+        vmem.take_changes()
+
+
+def _copy_rows(col, got: Dict, upsert: bool = False):
+    ids = got.get("ids") or []
+    write = col.upsert if upsert else col.add
+    write(
+        ids=ids,
+        documents=got.get("documents"),
+        metadatas=[m or None for m in (got.get("metadatas") or [None] * len(ids))],
+        embeddings=got.get("embeddings"),
+    )
+
+
+def _drop_if_exists(client, name: str):
+    try:
+        client.delete_collection(name)
+    except Exception:
+        pass
+
+
+# ---------- 后台维护 ----------
+class LifecycleManager:
+    """后台线程：批量写回召回记录，定期执行保留策略与压缩；状态持久化在 persist_dir/lifecycle_state.json"""
+
+    STATE_FILE = "lifecycle_state.json"
+
+    def __init__(
+        self,
+        vmems: List,
+        persist_dir: str,
+        policies: Optional[Dict[str, Dict]] = None,
+        interval: float = MEMORY_MAINTENANCE_INTERVAL,
+    ):
+        self.vmems = {vm.col.name: vm for vm in vmems}
+        self.policies = parse_retention(MEMORY_RETENTION) if policies is None else policies
+        self.interval = interval
+        self.state_path = os.path.join(persist_dir, self.STATE_FILE)
+        self.state: Dict[str, Dict] = self._load_state()
+        self.last_report: Dict[str, Dict] = {}
+        self._seen_deleted = {name: vm.deleted_count for name, vm in self.vmems.items()}
+        self._hits: "queue.Queue[tuple]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    # ---- 状态 ----
+    def _load_state(self) -> Dict[str, Dict]:
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_state(self):
+        os.makedirs(os.path.dirname(self.state_path) or ".", exist_ok=True)
+        tmp = self.state_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.state, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, self.state_path)
+
+    # ---- 召回记录 ----
+    def record_hits(self, vmem, ids: List[str]):
+        """只入队，由后台线程批量写回（未启动后台线程时在 stop/run_maintenance 时写回）"""
+        if vmem is not None and ids:
+            self._hits.put((vmem, list(ids)))
+
+    def flush_hits(self):
+        pending: Dict[int, tuple] = {}
+        while True:
+            try:
+                vmem, ids = self._hits.get_nowait()
+            except queue.Empty:
+                break
+            pending.setdefault(id(vmem), (vmem, []))[1].extend(ids)
+        now = int(time.time())
+        for vmem, ids in pending.values():
+            try:
+                vmem.touch(ids, now=now)
+            except Exception:
+                pass  # 条目已被删除/集合正在替换：丢弃这次统计即可
+
+    # ---- 维护 ----
+    def _should_compact(self, name: str, vmem) -> bool:
+        deleted = self.state.get(name, {}).get("deleted", 0)
+        return deleted >= MEMORY_COMPACT_MIN_DELETES and deleted >= MEMORY_COMPACT_RATIO * (vmem.count() + deleted)
+
+    def run_maintenance(self) -> Dict[str, Dict]:
+        """执行一轮：写回召回记录 → 清理上轮替换下来的旧集合 → 保留策略 → 必要时压缩"""
+        with self._lock:
+            self.flush_hits()
+            for name, vmem in self.vmems.items():
+                _drop_if_exists(vmem.client, name + RETIRED_SUFFIX)
+                report = {"expired": 0, "evicted": 0, "compacted": False}
+                policy = self.policies.get(name)
+                if policy:
+                    report["expired"], report["evicted"] = enforce_retention(vmem, policy)
+
+                st = self.state.setdefault(name, {"deleted": 0, "last_compact": 0})
+                st["deleted"] += vmem.deleted_count - self._seen_deleted.get(name, 0)
+                self._seen_deleted[name] = vmem.deleted_count
+                if self._should_compact(name, vmem) and compact_collection(vmem):
+                    report["compacted"] = True
+                    st["deleted"] = 0
+                    st["last_compact"] = int(time.time())
+                report["count"] = vmem.count()
+                report["at"] = int(time.time())
+                self.last_report[name] = report
+            self._save_state()
+            return dict(self.last_report)
+
+    def _loop(self):
+        next_run = time.monotonic() + min(self.interval, 60)  # 启动后先等一会儿，不和首轮对话抢资源
+        while not self._stop.wait(1.0):
+            self.flush_hits()
+            if time.monotonic() >= next_run:
+                try:
+                    self.run_maintenance()
+                except Exception:
+                    pass  # 维护失败不影响对话，下个周期重试
+                next_run = time.monotonic() + self.interval
+
+    def start(self):
+        if self._thread is None and self.interval > 0:
+            self._thread = threading.Thread(target=self._loop, name="memory-lifecycle", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        self.flush_hits()
+
+    def stats_text(self) -> str:
+        lines = []
+        for name, vmem in self.vmems.items():
+            policy = self.policies.get(name) or {}
+            rule = ", ".join(
+                p for p in (
+                    f"ttl={policy['ttl_days']:g}d" if policy.get("ttl_days") else "",
+                    f"max={policy['max']}" if policy.get("max") else "",
+                ) if p
+            ) or "不过期"
+            st = self.state.get(name, {})
+            pending = st.get("deleted", 0) + vmem.deleted_count - self._seen_deleted.get(name, 0)
+            line = f"  - {name}: {vmem.count()} 条（{rule}），上次压缩后删除 {pending} 条"
+            rep = self.last_report.get(name)
+            if rep:
+                line += (f"；上轮维护：过期 {rep['expired']}，淘汰 {rep['evicted']}"
+                         + ("，已压缩" if rep["compacted"] else ""))
+            lines.append(line)
+        return "\n".join(lines)
@@ -0,0 +1,205 @@
+"""
+压测驱动：按目标并发回放脚本化的多轮会话，统计整条轮次流水线（门控检索 → 组装 → 模型调用）的吞吐与延迟分位数
+- 每个会话一个 Session（独立的短期记忆/门控），所有会话共享向量库、连接池、熔断器（与真实进程一致）
+- --concurrency 可以给多个值（1,4,16），逐档运行，看吞吐在哪一档不再增长、延迟开始上升
+- 默认拒绝连接真实 API：需要 --spawn-mock（同进程启动 mock_openai）或显式设置 OPENAI_BASE_URL
+
+用法：
+    python -m src.src.loadtest --spawn-mock --concurrency 1,4,16 --sessions 32
+    python -m src.src.loadtest --spawn-mock --faults rate=0.05,timeout=0.01 --timeout 2
+    OPENAI_BASE_URL=http://127.0.0.1:8000/v1 python -m src.src.loadtest --script sessions.json
+
+脚本格式：.json 为会话数组（每个会话是按顺序发送的字符串数组）；其它格式每行一轮、空行分隔会话
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+from . import mock_openai  # 只依赖标准库，不会提前加载 config
+
+# 覆盖门控的几种决策（寒暄跳过 / 追问复用 / 完整检索 / 带范围检索）
+DEFAULT_SCRIPT = [
+    ["你好", "如何安装这个项目？", "展开说说", "配置文件放在哪里", "谢谢"],
+    ["向量库用的是什么", "怎么清空检索缓存", "继续", "@since:7d 最近写入了什么"],
+    ["遇到 429 报错怎么办", "重试策略是怎样的", "举个例子", "好的"],
+    ["怎么保存一段对话为记忆", "召回记忆是怎么注入上下文的", "它会写进历史吗"],
+]
+
+SEED_DOCS = [
+    "安装：先创建虚拟环境，然后 pip install -r requirements.txt，最后在项目根目录创建 .env 并写入 OPENAI_API_KEY。",
+    "启动：python -m src.src.main，输入 exit 退出。",
+    "配置：所有配置集中在 config.py，从环境变量读取，也可以写在 .env 文件里。",
+    "向量库使用 Chroma 持久化存储，默认目录为 .chroma，集合包括 docs、long_term、user_notes、prompts_bank。",
+    "检索缓存按集合版本号失效，cache stats 查看命中率，cache clear 清空。",
+    "遇到 429 限速时会按 Retry-After 或指数退避加抖动自动重试，连续失败会触发熔断。",
+    "熔断打开时不再调用模型，直接返回检索到的片段作为降级回答。",
+    "save 名称 会把最近几轮对话保存为命名记忆；saveas 名称: 内容 直接保存指定内容。",
+    "recall 名称 会召回记忆，并在下一轮作为尾部上下文注入，不写进对话历史。",
+    "ingest 支持 --watch 持续监听目录，只增量处理变化的文件。",
+    "检索范围语法：@source:glob、@since:7d、@until:日期、@has:关键词，可写在查询任意位置。",
+    "记忆生命周期：按集合配置 ttl 与 max，超出上限时淘汰最久未被召回的条目。",
+]
+
+
+def load_script(path: str) -> List[List[str]]:
+    with open(path, "r", encoding="utf-8") as f:
+        if path.lower().endswith(".json"):
+            return [[str(t) for t in sess if str(t).strip()] for sess in json.load(f)]
+        sessions, cur = [], []
+        for line in f:
+            if line.strip():
+                cur.append(line.strip())
+            elif cur:
+                sessions.append(cur); cur = []
+        if cur:
+            sessions.append(cur)
+        return sessions
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    data = sorted(values)
+    return data[min(len(data) - 1, int(round(q * (len(data) - 1))))]
+
+
+# ---------- 运行 ----------
+def run_level(stores, script: List[List[str]], sessions: int, concurrency: int, think_s: float = 0.0) -> Dict:
+    """以 concurrency 个并发会话跑完 sessions 个会话（轮流取脚本），返回这一档的统计"""
+    from .main import Session
+
+    records: List[Dict] = []
+    lock = threading.Lock()
+
+    def _one(idx: int):
+        sess = Session(stores)
+        for turn in script[idx % len(script)]:
+            try:
+                _, status = sess.chat(turn)
+            except Exception as e:  # 流水线本身的异常也算失败，不中断整档
+                status = "error"
+                sess.last_timings = {"rag": 0.0, "llm": 0.0, "total": 0.0, "exc": repr(e)}
+            with lock:
+                records.append(dict(sess.last_timings, status=status))
+            if think_s:
+                time.sleep(think_s)
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="loadtest") as pool:
+        list(pool.map(_one, range(sessions)))
+    wall = time.perf_counter() - t0
+
+    def _ms(key: str, q: float) -> float:
+        return percentile([r[key] for r in records], q) * 1000
+
+    statuses = {s: sum(1 for r in records if r["status"] == s) for s in ("ok", "degraded", "error")}
+    return {
+        "concurrency": concurrency,
+        "sessions": sessions,
+        "turns": len(records),
+        "seconds": wall,
+        "throughput": len(records) / wall if wall else 0.0,
+        "p50_ms": _ms("total", 0.50),
+        "p95_ms": _ms("total", 0.95),
+        "p99_ms": _ms("total", 0.99),
+        "rag_p95_ms": _ms("rag", 0.95),
+        "llm_p95_ms": _ms("llm", 0.95),
+        **statuses,
+    }
+
+
+def format_report(rows: List[Dict]) -> str:
+    lines = [f"{'并发':>4}{'轮次':>7}{'耗时s':>8}{'轮/s':>8}{'p50ms':>8}{'p95ms':>8}{'p99ms':>8}"
+             f"{'检索p95':>9}{'模型p95':>9}   ok/降级/失败"]
+    for r in rows:
+        lines.append(
+            f"{r['concurrency']:>4}{r['turns']:>7}{r['seconds']:>8.1f}{r['throughput']:>8.2f}"
+            f"{r['p50_ms']:>8.0f}{r['p95_ms']:>8.0f}{r['p99_ms']:>8.0f}"
+            f"{r['rag_p95_ms']:>9.0f}{r['llm_p95_ms']:>9.0f}   {r['ok']}/{r['degraded']}/{r['error']}"
+        )
+    return "\n".join(lines)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    ap = argparse.ArgumentParser(description="按目标并发回放多轮会话，统计整轮流水线的吞吐与延迟")
+    ap.add_argument("--script", default=None, help="会话脚本（.json 或空行分隔的文本）；不填用内置脚本")
+    ap.add_argument("--concurrency", default="1,4,16", help="并发会话数，可逗号分隔多档")
+    ap.add_argument("--sessions", type=int, default=32, help="每档运行的会话数")
+    ap.add_argument("--think-ms", type=float, default=0, help="同一会话两轮之间的间隔")
+    ap.add_argument("--persist", default=".chroma-loadtest", help="压测用向量库目录（不要指向正式库）")
+    ap.add_argument("--no-seed", action="store_true", help="docs 集合为空时不写入示例文档")
+    ap.add_argument("--json", default=None, help="把结果另存为 JSON")
+    ap.add_argument("--no-query-cache", action="store_true",
+                    help="关闭检索结果缓存（脚本重复时缓存会掩盖检索耗时）")
+    ap.add_argument("--verbose", action="store_true", help="显示流水线自身的打印（默认静默）")
+    mock = ap.add_argument_group("mock（--spawn-mock 时生效，含义同 mock_openai）")
+    mock.add_argument("--spawn-mock", action="store_true", help="同进程启动本地 mock 并指向它")
+    mock.add_argument("--chat-latency", default="lognormal:400,0.4")
+    mock.add_argument("--embed-latency", default="lognormal:60,0.3")
+    mock.add_argument("--faults", default="")
+    mock.add_argument("--hang", type=float, default=None, help="默认 --timeout + 5")
+    mock.add_argument("--timeout", type=float, default=10.0, help="客户端请求超时（写入 OPENAI_TIMEOUT）")
+    return ap
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    levels = [int(x) for x in args.concurrency.split(",") if x.strip()]
+    script = load_script(args.script) if args.script else DEFAULT_SCRIPT
+
+    server = None
+    if args.spawn_mock:
+        server = mock_openai.start_server(mock_openai.build_parser().parse_args([
+            "--port", "0", "--chat-latency", args.chat_latency, "--embed-latency", args.embed_latency,
+            "--faults", args.faults, "--hang", str(args.hang if args.hang is not None else args.timeout + 5),
+        ]))
+        host, port = server.server_address[:2]
+        # config 在导入时读取环境变量：必须在导入 main 之前设置（QUERY_CACHE_SIZE 同理）
+        os.environ["OPENAI_BASE_URL"] = f"http://{host}:{port}/v1"
+        os.environ.setdefault("OPENAI_API_KEY", "mock")
+        os.environ["OPENAI_TIMEOUT"] = str(args.timeout)
+        print(f"🧪 mock 已启动：{os.environ['OPENAI_BASE_URL']}（faults={args.faults or '无'}）")
+    elif not os.getenv("OPENAI_BASE_URL"):
+        print("❌ 未设置 OPENAI_BASE_URL：为避免对真实 API 压测，请使用 --spawn-mock 或指向本地 mock。")
+        return 2
+
+    if args.no_query_cache:
+        os.environ["QUERY_CACHE_SIZE"] = "0"
+    from .main import Stores
+
+    stores = Stores(persist_dir=args.persist)
+    if not args.no_seed and stores.docs.count() == 0 and not getattr(stores.docs, "read_only", False):
+        stores.docs.add_memories(SEED_DOCS, [{"source": "loadtest/seed.md", "chunk": i} for i in range(len(SEED_DOCS))])
+
+    rows = []
+    try:
+        for c in levels:
+            print(f"▶ 并发 {c}：{args.sessions} 个会话 …")
+            out = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+            with out:
+                rows.append(run_level(stores, script, args.sessions, c, args.think_ms / 1000))
+    finally:
+        stores.close()
+
+    print("\n📈 整轮流水线（检索 + 模型），延迟单位 ms：")
+    print(format_report(rows))
+    if server is not None:
+        print("\n🧪 mock 统计：", json.dumps(server.mock.stats(), ensure_ascii=False))
+        server.shutdown()
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(rows, f, ensure_ascii=False, indent=2)
+        print(f"💾 结果已保存：{args.json}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
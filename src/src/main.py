@@ -1,20 +1,33 @@
 # src/main.py
-from .config import OPENAI_API_KEY, CHAT_MODEL, VECTOR_DB_PATH
-from .prompt import SYSTEM_PROMPT, DEVELOPER_HINT
-from .memory import VectorMemory, ChatMemory
+import os
 import re
-from openai import OpenAI
-
-import os, traceback
-DEBUG = os.getenv("DEBUG", "0") == "1" 
+import json
+import time
+import traceback
+from typing import Callable, Dict, List, Optional, Tuple
+
+import httpx
+from openai import OpenAIError
+
+from .config import (
+    OPENAI_API_KEY, CHAT_MODEL, EMBED_MODEL, VECTOR_DB_PATH, RAG_GATE, EVAL_WORKERS, DEDUP_POLICY, DOCS_SNAPSHOT,
+    PROFILE_TRACEMALLOC, PROFILE_SAMPLE_HZ,
+)
+from .prompt import SYSTEM_PROMPT, DEVELOPER_HINT, assemble_messages
+from .memory import VectorMemory, SnapshotMemory, ChatMemory, query_cache
+from .openai_client import get_client
+from .resilience import chat_guard, classify_error, classify_openai_error, CircuitOpenError
+from .retrieval_gate import RetrievalGate
+from . import evaluate
+from .filters import parse_scope, NO_MATCH
+from .expansion import QueryExpander
+from .lifecycle import LifecycleManager, rerank
+from .profiling import get_profiler
 
+DEBUG = os.getenv("DEBUG", "0") == "1"
 
 
 # --- Debug/Logging helpers ---
-import os, time, traceback
-
-DEBUG = os.getenv("DEBUG", "0") == "1"
-
 def log(*args):
     if DEBUG:
         print("[DEBUG]", *args)
@@ -24,75 +37,67 @@ def warn(*args):
 
 def oops(title: str, e: Exception):
     """统一的人类可读错误 & 调试详情"""
-    msg = str(e) or e.__class__.__name__
-    print(f"❌ {title}: {msg}")
+    print(oops_text(title, e))
+
+def oops_text(title: str, e: Exception) -> str:
+    """同 oops，但返回文本（命令处理函数放进 CommandResult，不直接打印）"""
     if DEBUG:
         traceback.print_exc()
+    return f"❌ {title}: {str(e) or e.__class__.__name__}"
+
+# --- OpenAI 调用重试与错误分类（重试/熔断/对冲见 resilience.py）---
+# 错误类别 -> (标题, 解决提示)；未列出的类别归为“未知错误”
+ERROR_HINTS = {
+    "quota":   ("额度不足/已用尽（insufficient_quota）", "💡 解决：检查账单/充值或换用可用的 API Key。"),
+    "auth":    ("鉴权失败（API Key 无效或未配置）", "💡 解决：检查 .env 中的 OPENAI_API_KEY 是否正确；或环境变量是否生效。"),
+    "model":   ("模型不可用/不存在", "💡 解决：确认 config.CHAT_MODEL 名称无误、账号有权限。"),
+    "network": ("网络错误（DNS/连接）", "💡 解决：切换网络/DNS(1.1.1.1/8.8.8.8)，或清理代理。"),
+    "rate":    ("请求被限速（429）", "💡 解决：降低并发/频率，或提高额度/速率限制。"),
+}
+
+def openai_error_text(e: Exception) -> str:
+    """按错误类别给出人类可读的报错 + 解决提示"""
+    title, hint = ERROR_HINTS.get(classify_error(e), ("未知错误", ""))
+    return oops_text(title, e) + (f"\n{hint}" if hint else "")
+
+def call_openai_with_retry(client, model, messages, temperature=0.7, max_tries=None, timeout=None, on_error=None):
+    """对 429/网络问题做带抖动的退避重试；其它错误给出具体提示并返回 None
+    client 传 None 时使用共享客户端；timeout 为本次调用单独的超时（秒）
+    on_error：接收报错文本（命令处理函数用它把报错放进 CommandResult）；默认直接打印
+    熔断打开时抛 CircuitOpenError，由调用方决定降级方式"""
+    client = client or get_client()
+    if timeout is not None:
+        client = client.with_options(timeout=timeout)
+
+    def _create():
+        return client.chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+        )
+
+    def _on_retry(kind, wait_s, e):
+        warn(f"请求暂时失败（{kind}），{wait_s:.1f}s 后重试…")
+        if DEBUG:
+            traceback.print_exception(type(e), e, e.__traceback__)
+
+    try:
+        log(f"OpenAI call model={model}, msgs={len(messages)}, breaker={chat_guard.breaker.state}")
+        return chat_guard.call(_create, max_tries=max_tries, on_retry=_on_retry)
+    except CircuitOpenError:
+        raise
+    except Exception as e:
+        # 不可重试或已用尽次数
+        (on_error or print)(openai_error_text(e))
+        return None
+
+
+def retrieval_only_answer(recalled_block: str) -> str:
+    """熔断时的快速降级：直接返回检索到的片段"""
+    if not recalled_block:
+        return "（模型暂不可用，且没有检索到相关资料，请稍后再试。）"
+    return "（模型暂不可用，以下为检索到的相关片段，供参考）\n" + recalled_block
 
-# --- OpenAI 调用重试与错误分类 ---
-RETRYABLE = ("rate_limit", "timeout", "temporarily_unavailable")
-
-def classify_openai_error(text: str) -> str:
-    t = (text or "").lower()
-    if "insufficient_quota" in t or "quota" in t:
-        return "quota"
-    if "invalid_api_key" in t or "authentication" in t or "unauthorized" in t:
-        return "auth"
-    if "model_not_found" in t or "not found" in t:
-        return "model"
-    if "connection" in t or "dns" in t or "resolve host" in t:
-        return "network"
-    if "rate" in t or "429" in t or "retry" in t:
-        return "rate"
-    if "timeout" in t:
-        return "timeout"
-    return "unknown"
-
-def call_openai_with_retry(client, model, messages, temperature=0.7, max_tries=3):
-    """对 429/网络问题做指数退避重试；其它错误给出具体提示"""
-    delay = 1.0
-    for attempt in range(1, max_tries + 1):
-        try:
-            log(f"OpenAI call attempt {attempt}, model={model}, msgs={len(messages)}")
-            return client.chat.completions.create(
-                model=model,
-                messages=messages,
-                temperature=temperature,
-            )
-        except Exception as e:
-            kind = classify_openai_error(str(e))
-            if kind in ("rate", "timeout", "network") and attempt < max_tries:
-                warn(f"请求暂时失败（{kind}），{delay:.1f}s 后重试…")
-                if DEBUG:
-                    traceback.print_exc()
-                time.sleep(delay)
-                delay *= 2
-                continue
-            # 不可重试或已用尽次数
-            if kind == "quota":
-                oops("额度不足/已用尽（insufficient_quota）", e)
-                print("💡 解决：检查账单/充值或换用可用的 API Key。")
-            elif kind == "auth":
-                oops("鉴权失败（API Key 无效或未配置）", e)
-                print("💡 解决：检查 .env 中的 OPENAI_API_KEY 是否正确；或环境变量是否生效。")
-            elif kind == "model":
-                oops("模型不可用/不存在", e)
-                print("💡 解决：确认 config.CHAT_MODEL 名称无误、账号有权限。")
-            elif kind == "network":
-                oops("网络错误（DNS/连接）", e)
-                print("💡 解决：切换网络/DNS(1.1.1.1/8.8.8.8)，或清理代理。")
-            elif kind == "rate":
-                oops("请求被限速（429）", e)
-                print("💡 解决：降低并发/频率，或提高额度/速率限制。")
-            else:
-                oops("未知错误", e)
-            return None
-        
-
-
-from .config import OPENAI_API_KEY, CHAT_MODEL, VECTOR_DB_PATH
-from .prompt import SYSTEM_PROMPT, DEVELOPER_HINT
-from .memory import VectorMemory, ChatMemory
 
 # 各集合
 DOCS_COLLECTION   = "docs"        # 外部文档（ingest写入）
@@ -101,30 +106,72 @@ NOTES_COLLECTION  = "user_notes"  # ✨ 新增：用户命名记忆
 PERSIST_DIR       = VECTOR_DB_PATH
 PROMPTS_COLLECTION = "prompts_bank"
 
-active_system_prompt = SYSTEM_PROMPT
-active_developer_hint = DEVELOPER_HINT
-
 # ---------- 工具函数 ----------
 def build_recalled_context(recalls, min_score=0.2, max_items=5, label=""):
     seen, kept = set(), []
-    for r in sorted(recalls, key=lambda x: x["score"], reverse=True):
-        if r["score"] < min_score: continue
+    # 多路检索的结果带 rrf（融合名次分），按它排序；普通检索按相似度
+    for r in sorted(recalls, key=lambda x: x.get("rrf", x["score"]), reverse=True):
+        # 阈值按原始相似度（rerank 之后在 sim 里），新近度/使用度加分不能把低相关的结果带进上下文
+        if r.get("sim", r["score"]) < min_score: continue
         key = r["text"].strip()[:100]
         if key in seen: continue
         seen.add(key); kept.append(r)
         if len(kept) >= max_items: break
+    return kept, format_hits(kept, label)
+
+def format_hits(hits, label=""):
     lines = []
-    for i, r in enumerate(kept, 1):
+    for i, r in enumerate(hits, 1):
         src = r.get("meta", {}).get("source") or r.get("meta", {}).get("name") or r.get("meta", {}).get("path") or ""
         src_info = f"  ({src})" if src else ""
         tag = f"[{label}]" if label else ""
         lines.append(f"[R{i}{tag}] {r['text']}{src_info}")
-    return kept, "\n".join(lines)
+    return "\n".join(lines)
+
+def scope_filters(vmem, scope):
+    """范围条件 -> query 的过滤参数；范围内没有候选时返回 None"""
+    if not scope:
+        return {}
+    filters = scope.filters_for(vmem)
+    return None if filters["where"] is NO_MATCH else filters
+
+def scoped_query(vmem, q: str, k: int, scope=None):
+    """带范围条件的检索：条件下推给 Chroma；范围内没有候选时直接返回空"""
+    if not vmem:
+        return []
+    filters = scope_filters(vmem, scope)
+    if filters is None:
+        return []
+    return vmem.query(q, k=k, **filters)
+
+def list_all(v_docs, v_facts, v_notes, scope, k_each=6):
+    """只有范围条件、没有查询文本：列出各集合范围内的条目（未按相关度排序，结果不带 score）"""
+    out = []
+    for vm, limit in ((v_docs, 5), (v_facts, 3), (v_notes, 5)):
+        filters = scope_filters(vm, scope) if vm else None
+        out.append(vm.get(limit=min(k_each, limit), **filters) if filters is not None else [])
+    kd, kf, kn = out
+    blocks = [b for b in (format_hits(kd, "docs"), format_hits(kf, "facts"), format_hits(kn, "note")) if b]
+    return kd, kf, kn, "\n".join(blocks)
 
-def query_all(v_docs, v_facts, v_notes, q: str, k_each=6, min_score=0.2):
-    docs_hits  = v_docs.query(q,  k=k_each) if v_docs  else []
-    facts_hits = v_facts.query(q, k=k_each) if v_facts else []
-    notes_hits = v_notes.query(q, k=k_each) if v_notes else []
+def query_all(v_docs, v_facts, v_notes, q: str, k_each=6, min_score=0.2, scope=None, expander=None):
+    """
+    三个集合一起检索，返回 (docs 命中, facts 命中, notes 命中, 上下文块)
+    查询文本为空、只有范围条件时改为列出范围内的条目（见 list_all）
+    范围条件无效（例如 @source 匹配的来源过多）时抛 ValueError
+    """
+    if not (q or "").strip():
+        return list_all(v_docs, v_facts, v_notes, scope, k_each) if scope else ([], [], [], "")
+    vmems = (v_docs, v_facts, v_notes)
+    if expander is not None and expander.should_expand(q):
+        # 短查询：多条改写一次批量向量化，三库并发检索后按名次融合（超时回退普通检索）
+        filters = [scope_filters(vm, scope) if vm else None for vm in vmems]
+        docs_hits, facts_hits, notes_hits = expander.search(q, vmems, k_each, filters)
+    else:
+        docs_hits, facts_hits, notes_hits = (scoped_query(vm, q, k_each, scope) for vm in vmems)
+    # 记忆类集合：相似度叠加新近度/召回次数（docs 是外部文档，只看相似度）
+    facts_hits = rerank(v_facts, facts_hits)
+    notes_hits = rerank(v_notes, notes_hits)
 
     kd, bd = build_recalled_context(docs_hits,  min_score, 5, "docs")
     kf, bf = build_recalled_context(facts_hits, min_score, 3, "facts")
@@ -133,390 +180,777 @@ def query_all(v_docs, v_facts, v_notes, q: str, k_each=6, min_score=0.2):
     blocks = [b for b in (bd, bf, bn) if b]
     return kd, kf, kn, "\n".join(blocks)
 
-def extract_saveas(cmd: str):
-    # 形如：saveas 记忆名: 内容
-    m = re.match(r"^saveas\s+([^\:]+?)\s*:\s*(.+)$", cmd, flags=re.I)
-    return (m.group(1).strip(), m.group(2).strip()) if m else (None, None)
-
-# ---------- 主程序 ----------
-def main():
-    client = OpenAI(api_key=OPENAI_API_KEY)
-
-    memory     = ChatMemory(max_turns=10)
-    vmem_docs  = VectorMemory(persist_dir=PERSIST_DIR, collection=DOCS_COLLECTION)
-    vmem_facts = VectorMemory(persist_dir=PERSIST_DIR, collection=FACTS_COLLECTION)
-    vmem_notes = VectorMemory(persist_dir=PERSIST_DIR, collection=NOTES_COLLECTION)  # 新增集合
-    vmem_prompts = VectorMemory(persist_dir=PERSIST_DIR, collection=PROMPTS_COLLECTION)
-
-    print("🤖 Chatbot 已启动，输入 'exit' 退出。")
-    print("命令：\n"
-          "  rag? 关键词        查看 RAG 命中\n"
-          "  save 名称          保存最近对话摘要为命名记忆\n"
-          "  saveas 名称: 内容  直接把指定内容保存为记忆\n"
-          "  recall 名称/关键词  召回记忆并注入上下文\n"
-          "  list memories      列出所有命名记忆（Top 20）\n"
-          "  delete 名称        删除最相关的一条命名记忆\n")
+def usage_tokens(resp):
+    """从 resp.usage 取 (prompt_tokens, cached_tokens, completion_tokens)；缺字段时按 0 计"""
+    usage = getattr(resp, "usage", None)
+    if usage is None:
+        return 0, 0, 0
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = getattr(details, "cached_tokens", 0) if details is not None else 0
+    return usage.prompt_tokens or 0, cached or 0, usage.completion_tokens or 0
+
+
+class PromptCacheStats:
+    """逐轮记录输入/缓存命中 token，验证前缀稳定布局是否真的降低了延迟与成本"""
+
+    def __init__(self):
+        self.turns = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.seconds = 0.0
+        self.last = None
+
+    def record(self, resp, seconds: float):
+        prompt, cached, completion = usage_tokens(resp)
+        self.turns += 1
+        self.prompt_tokens += prompt
+        self.cached_tokens += cached
+        self.seconds += seconds
+        self.last = (prompt, cached, completion, seconds)
+        return self.last
+
+    def text(self) -> str:
+        if not self.turns:
+            return "（暂无对话轮次）"
+        p, c, o, sec = self.last
+        ratio = self.cached_tokens / self.prompt_tokens if self.prompt_tokens else 0.0
+        return (
+            f"上一轮：输入 {p} tokens（缓存命中 {c}），输出 {o} tokens，耗时 {sec:.2f}s\n"
+            f"累计 {self.turns} 轮：输入 {self.prompt_tokens} tokens，缓存命中 {self.cached_tokens}"
+            f"（{ratio:.0%}），平均耗时 {self.seconds / self.turns:.2f}s"
+        )
 
-    while True:
-        user_input = input("你：").strip()
-        if user_input.lower() in {"exit", "quit"}:
-            print("👋 再见！"); break
 
-        def extract_after_colon(cmd: str):
-            m = re.match(r"^optprompt\s+([^:：]+?)\s*[:：]\s*(.+)$", cmd, flags=re.I)
-            return (m.group(1).strip(), m.group(2).strip()) if m else (None, None)
-
-        def parse_json_maybe(text: str):
-            t = text.strip()
-            m = re.search(r"```json\s*(\{[\s\S]*?\})\s*```", t, flags=re.I)
-            if m: t = m.group(1)
-            return json.loads(t)
-
-        PROMPT_ENGINEER = """You are an expert prompt engineer.
-        Given (1) the current SYSTEM_PROMPT and DEVELOPER_HINT, (2) recent conversation transcript,
-        and (3) my optimization goal, produce an improved pair of prompts.
-
-        Constraints:
-        - Output strictly JSON with keys: system_prompt, developer_hint, notes.
-        - Keep the assistant safe, helpful, and grounded.
-        - Encourage concise chain-of-thought OUTLINE (not full internal reasoning) via few bullet planning lines if needed.
-        - Prefer Chinese responses by default when the user speaks Chinese.
-
-        Example JSON:
-        {
-        "system_prompt": "...",
-        "developer_hint": "...",
-        "notes": "why these changes work"
-        }
+def load_prompt(vmem_prompts, key: str):
+    """按名称取出保存的 Prompt，返回 (system, developer)，缺失的部分为 None"""
+    sys_txt, dev_txt = None, None
+    # 元数据精确过滤（不做向量检索，不调用 API）
+    for h in vmem_prompts.get(where={"$and": [{"type": "prompt"}, {"name": key}]}, limit=20):
+        meta = h.get("meta",{})
+        if meta.get("name")==key and meta.get("kind")=="system":
+            sys_txt = h.get("text")
+        if meta.get("name")==key and meta.get("kind")=="developer":
+            dev_txt = h.get("text")
+    return sys_txt, dev_txt
+
+
+def duplicate_text(dup_id: str, kind: str) -> str:
+    action = {"skip": "未重复写入", "merge": "已合并元数据", "newest": "已替换旧条目"}.get(DEDUP_POLICY, "")
+    label = "完全相同" if kind == "exact" else "高度相似"
+    return f"ℹ️ 与已有记忆（{dup_id}）{label}，{action}（DEDUP_POLICY={DEDUP_POLICY}）"
+
+
+def duplicates_text(vmem) -> str:
+    """最近一次写入命中的重复项说明；没有重复返回空串"""
+    return "\n".join(duplicate_text(dup_id, kind) for _, dup_id, kind in vmem.last_duplicates)
+
+
+def parse_json_maybe(text: str):
+    t = text.strip()
+    m = re.search(r"```json\s*(\{[\s\S]*?\})\s*```", t, flags=re.I)
+    if m: t = m.group(1)
+    return json.loads(t)
+
+
+PROMPT_ENGINEER = """You are an expert prompt engineer.
+Given (1) the current SYSTEM_PROMPT and DEVELOPER_HINT, (2) recent conversation transcript,
+and (3) my optimization goal, produce an improved pair of prompts.
+
+Constraints:
+- Output strictly JSON with keys: system_prompt, developer_hint, notes.
+- Keep the assistant safe, helpful, and grounded.
+- Encourage concise chain-of-thought OUTLINE (not full internal reasoning) via few bullet planning lines if needed.
+- Prefer Chinese responses by default when the user speaks Chinese.
+
+Example JSON:
+{
+"system_prompt": "...",
+"developer_hint": "...",
+"notes": "why these changes work"
+}
+"""
+
+RAG_CONTEXT_HEADER = ("【检索到的相关资料（请优先依据这些片段回答，并在句末标注 [R#] 引用；"
+                      "docs=外部文档，facts=长期事实，note=用户记忆）】\n")
+
+# ---------- 会话 ----------
+def open_docs(persist_dir: str):
+    """docs 集合：设置了 DOCS_SNAPSHOT 时直接在快照上检索（只读，免导入），否则用 Chroma"""
+    if not DOCS_SNAPSHOT:
+        return VectorMemory(persist_dir=persist_dir, collection=DOCS_COLLECTION)
+    docs = SnapshotMemory(DOCS_SNAPSHOT)
+    model = docs.snapshot.manifest.get("embed_model")
+    if model and model != EMBED_MODEL:
+        warn(f"快照向量模型为 {model}，当前为 {EMBED_MODEL}：检索结果可能不可靠。")
+    print(f"📦 docs 使用快照 {DOCS_SNAPSHOT}（{docs.count()} 条，只读）")
+    return docs
+
+
+class Stores:
+    """各集合 + 查询扩展 + 记忆生命周期：同一进程里的多个会话共享一份"""
+
+    def __init__(self, persist_dir: str = PERSIST_DIR, start_lifecycle: bool = True):
+        self.docs    = open_docs(persist_dir)
+        self.facts   = VectorMemory(persist_dir=persist_dir, collection=FACTS_COLLECTION)
+        self.notes   = VectorMemory(persist_dir=persist_dir, collection=NOTES_COLLECTION)
+        self.prompts = VectorMemory(persist_dir=persist_dir, collection=PROMPTS_COLLECTION)
+        self.expander = QueryExpander()  # QUERY_EXPANSION=off 时不做任何额外工作
+        # 保留策略 / 召回记录 / 删除较多时后台重建索引
+        self.lifecycle = LifecycleManager([self.facts, self.notes, self.prompts], persist_dir)
+        if start_lifecycle:
+            self.lifecycle.start()
+        self.profiler = get_profiler("chat")  # PROFILE* 都未设置时不做任何事
+
+    def close(self):
+        self.lifecycle.stop()  # 写回未落盘的召回记录
+        self.profiler.close()  # 写出采样结果
+
+
+class Session:
+    """
+    一个会话的状态 + 一轮对话的完整流水线（范围解析 → 门控检索 → 组装消息 → 调用模型 → 写短期记忆）
+    REPL 与压测（loadtest.py）共用；chat() 不打印回答，由调用方决定如何展示
+    """
+
+    def __init__(self, stores: Stores, client=None):
+        self.stores = stores
+        self.client = client or get_client()  # 共享连接池；OPENAI_BASE_URL 可指向本地 mock
+        self.memory = ChatMemory(max_turns=10, trim_slack=8)  # 成批裁剪历史，保持前缀稳定
+        self.gate = RetrievalGate(enabled=RAG_GATE)
+        self.usage_stats = PromptCacheStats()
+        self.pending_recall = ""  # recall 召回的记忆：下一轮作为易变上下文放在消息尾部
+        self.system_prompt = SYSTEM_PROMPT    # useprompt / revert prompt 切换
+        self.developer_hint = DEVELOPER_HINT
+        self.last_timings: Dict[str, float] = {}  # 上一轮各阶段耗时（秒）：rag / llm / total
+
+    def retrieve(self, user_input: str):
+        """本轮检索：返回 (kd, kf, kn, recalled_block)；检索熔断或调用失败时返回空结果"""
+        st = self.stores
+        try:
+            # 对话里也可以用 @source:… 等限定检索范围；问题本身照原样发给模型
+            rag_q, scope = parse_scope(user_input)
+        except ValueError as e:
+            warn(str(e)); rag_q, scope = user_input, None
+        try:
+            decision, result = self.gate.run(
+                rag_q,
+                lambda: query_all(st.docs, st.facts, st.notes, rag_q, k_each=8, min_score=0.2,
+                                  scope=scope, expander=st.expander),
+                force=bool(scope),  # 显式限定了范围：不复用/跳过
+            )
+            log(f"RAG gate: {decision}")
+        except CircuitOpenError as e:
+            warn(f"检索暂不可用（{e}），本轮不使用 RAG。")
+            return [], [], [], ""
+        except ValueError as e:
+            warn(f"{e}，本轮不使用 RAG。")
+            return [], [], [], ""
+        except (OpenAIError, httpx.HTTPError) as e:
+            # 向量化重试用尽（超时/网络/5xx 等）：与熔断一样降级为不用 RAG，不让整个 REPL 崩掉
+            title, _ = ERROR_HINTS.get(classify_error(e), ("未知错误", ""))
+            warn(f"检索失败（{title}），本轮不使用 RAG。")
+            log(f"retrieve error: {e!r}")
+            return [], [], [], ""
+        kd, kf, kn, _ = result
+        # 用进上下文的记忆：记录召回时间/次数（后台写回）
+        st.lifecycle.record_hits(st.facts, [h["id"] for h in kf])
+        st.lifecycle.record_hits(st.notes, [h["id"] for h in kn])
+        return result
+
+    def chat(self, user_input: str) -> Tuple[Optional[str], str]:
         """
+        跑完一轮对话，返回 (回答, 状态)：
+        - ok       正常回答
+        - degraded 补全熔断，回答为检索片段
+        - error    调用失败（原因已由 call_openai_with_retry 打印），回答为 None
+        """
+        with self.stores.profiler.turn("chat"):
+            return self._chat(user_input)
 
-        if user_input.lower().startswith("optprompt"):
-            name, goal = extract_after_colon(user_input)
-            if not (name and goal):
-                print("⚠️ 用法：optprompt 名称: 目标（支持中文冒号）"); 
-                continue
-
-            recent = memory.to_text(max_msgs=12) or "(无最近对话)"
-            cur = {"system": active_system_prompt, "developer": active_developer_hint}
-
-            try:
-                resp = client.chat.completions.create(
-                    model=CHAT_MODEL, temperature=0.2,
-                    messages=[
-                        {"role":"system","content":PROMPT_ENGINEER},
-                        {"role":"user","content":f"【当前 SYSTEM_PROMPT】\n{cur['system']}"},
-                        {"role":"user","content":f"【当前 DEVELOPER_HINT】\n{cur['developer']}"},
-                        {"role":"user","content":f"【最近对话（截断）】\n{recent}"},
-                        {"role":"user","content":f"【优化目标】\n{goal}\n请只输出 JSON。"}
-                    ]
-                )
-                text = (resp.choices[0].message.content or "").strip()
-                data = parse_json_maybe(text)
-                new_sys = data.get("system_prompt","").strip()
-                new_dev = data.get("developer_hint","").strip()
-                if not new_sys or not new_dev:
-                    print("⚠️ 优化结果缺少字段，请重试或调整目标。")
-                    if DEBUG: print(text)
-                    continue
-
-                vmem_prompts.add_memories(
-                    [new_sys, new_dev],
-                    [
-                        {"type":"prompt","name":name,"kind":"system"},
-                        {"type":"prompt","name":name,"kind":"developer"},
-                    ]
-                )
-                print(f"✅ 已生成优化 Prompt：{name}\n可用命令：useprompt {name} / showprompt {name}")
-            except Exception as e:
-                print(f"⚠️ 生成优化 Prompt 失败：{e}")
-                if DEBUG: traceback.print_exc()
-            continue
-
-        if user_input.lower().startswith("list prompts"):
-            hits = vmem_prompts.query("", k=100)
-            grouped = {}
-            for h in hits:
-                meta = h.get("meta",{})
-                nm = meta.get("name","(未命名)")
-                grouped.setdefault(nm, []).append(meta.get("kind"))
-            if not grouped:
-                print("（暂无保存的 Prompt）")
-            else:
-                print("🗂 Prompts：")
-                for nm, kinds in grouped.items():
-                    kinds = ",".join(sorted(set(kinds)))
-                    print(f"- {nm}  [{kinds}]")
-            continue
-
-        if user_input.lower().startswith("showprompt "):
-            key = user_input.split(" ",1)[1].strip()
-            hits = vmem_prompts.query(key, k=20)
-            sys_txt, dev_txt = None, None
-            for h in hits:
-                meta = h.get("meta",{})
-                if meta.get("name")==key and meta.get("kind")=="system":
-                    sys_txt = h.get("text")
-                if meta.get("name")==key and meta.get("kind")=="developer":
-                    dev_txt = h.get("text")
-            if not (sys_txt or dev_txt):
-                print("❌ 未找到该 Prompt。")
-            else:
-                print(f"\n--- {key}: SYSTEM_PROMPT ---\n{sys_txt or '(无)'}")
-                print(f"\n--- {key}: DEVELOPER_HINT ---\n{dev_txt or '(无)'}\n")
-            continue
-
-        if user_input.lower().startswith("useprompt "):
-            key = user_input.split(" ",1)[1].strip()
-            hits = vmem_prompts.query(key, k=20)
-            sys_txt, dev_txt = None, None
-            for h in hits:
-                meta = h.get("meta",{})
-                if meta.get("name")==key and meta.get("kind")=="system":
-                    sys_txt = h.get("text")
-                if meta.get("name")==key and meta.get("kind")=="developer":
-                    dev_txt = h.get("text")
-            if not (sys_txt and dev_txt):
-                print("❌ 未找到完整的 Prompt（system/developer）。先执行 showprompt 查看。")
-            else:
-                active_system_prompt = sys_txt
-                active_developer_hint = dev_txt
-                print(f"✅ 已启用 Prompt：{key}")
-            continue
-        
-        if user_input.lower().startswith("revert prompt"):
-            active_system_prompt = SYSTEM_PROMPT
-            active_developer_hint = DEVELOPER_HINT
-            print("↩️ 已回滚为默认 Prompt。")
-            continue
-
-        if user_input.lower().startswith("delprompt "):
-            key = user_input.split(" ",1)[1].strip()
-            hits = vmem_prompts.query(key, k=50)
-            ids = []
-            for h in hits:
-                meta = h.get("meta",{})
-                if meta.get("name")==key and meta.get("type")=="prompt":
-                    ids.append(h["id"])
-            if not ids:
-                print("❌ 未找到要删除的 Prompt。"); 
-                continue
-            try:
-                vmem_prompts.col.delete(ids=ids)
-                print(f"🗑️ 已删除 Prompt：{key}")
-            except Exception as e:
-                print(f"⚠️ 删除失败：{e}")
-                if DEBUG: traceback.print_exc()
-            continue
-
-        if user_input.lower().startswith("abtest "):
-            m = re.match(r"^abtest\s+([^:：]+?)\s*[:：]\s*(.+)$", user_input, flags=re.I)
-            if not m:
-                print("⚠️ 用法：abtest 名称: 问题"); 
-                continue
-            key, question = m.groups()
-            hits = vmem_prompts.query(key, k=20)
-            sys_txt, dev_txt = None, None
-            for h in hits:
-                meta = h.get("meta",{})
-                if meta.get("name")==key and meta.get("kind")=="system":
-                    sys_txt = h.get("text")
-                if meta.get("name")==key and meta.get("kind")=="developer":
-                    dev_txt = h.get("text")
-            if not (sys_txt and dev_txt):
-                print("❌ 未找到完整 Prompt。"); 
-                continue
-            try:
-                trial_msgs = [
-                    {"role":"system","content":sys_txt},
-                    {"role":"developer","content":dev_txt},
-                    {"role":"user","content":question}
-                ]
-                trial = client.chat.completions.create(model=CHAT_MODEL, temperature=0.7, messages=trial_msgs)
-                ans = (trial.choices[0].message.content or "").strip()
-                print("\n--- A/B 试用回答 ---\n", ans, "\n")
-            except Exception as e:
-                print(f"⚠️ A/B 试用失败：{e}")
-                if DEBUG: traceback.print_exc()
-            continue
-        
-        # ---- testerr <kind> ：模拟各种错误，验证报错分支 ----
-        if user_input.lower().startswith("testerr "):
-            kind = user_input.split(" ", 1)[1].strip().lower()
-            def show(title): print(f"🔬 模拟：{title}")
-            if kind == "quota":
-                show("额度用尽"); oops("额度不足/已用尽（insufficient_quota）", Exception("insufficient_quota"))
-            elif kind == "auth":
-                show("鉴权失败"); oops("鉴权失败（API Key 无效或未配置）", Exception("invalid_api_key"))
-            elif kind == "model":
-                show("模型不存在"); oops("模型不可用/不存在", Exception("model_not_found"))
-            elif kind == "network":
-                show("网络/DNS"); oops("网络错误（DNS/连接）", Exception("Could not resolve host"))
-            elif kind == "rate":
-                show("限速429"); oops("请求被限速（429）", Exception("Rate limit exceeded"))
-            elif kind == "timeout":
-                show("超时"); oops("未知错误", Exception("timeout"))
-            elif kind == "parse":
-                show("解析返回失败"); oops("解析 OpenAI 返回内容失败", Exception("list index out of range"))
-            elif kind == "vdb":
-                show("向量库写入失败"); oops("保存记忆失败（向量库写入）", Exception("chroma write failed"))
-            else:
-                print("可选：quota/auth/model/network/rate/timeout/parse/vdb")
-            continue
-
-        # ---------- 调试/管理命令 ----------
-        # 1) 查看 RAG 命中
-        if user_input.lower().startswith("rag?"):
-            q = user_input.split("?", 1)[1].strip() or " "
-            _, _, _, block = query_all(vmem_docs, vmem_facts, vmem_notes, q, k_each=8, min_score=0.0)
-            print("\n🔎 RAG 命中：\n" + (block or "(无检索结果)")); continue
-
-                # 2) saveas 名称: 内容  （支持中文冒号：）
-        name, content = extract_saveas(user_input)
-        if name and content:
-            try:
-                vmem_notes.add_memories([content], [{"type": "user_note", "name": name.strip()}])
-                print(f"✅ 已保存记忆：{name.strip()}")
-            except Exception as e:
-                print(f"⚠️ 保存记忆失败（向量库写入）: {e}")
-                if DEBUG:
-                    traceback.print_exc()
-            continue
-        elif user_input.lower().startswith("saveas"):
-            print("⚠️ 用法：saveas 名称: 内容   （支持中文冒号：）")
-            continue
-
-
-        # 3) save / save2 / save3 / save10 ...
-        if re.match(r"^save\d*\s", user_input.lower()):
-            m = re.match(r"^save(\d*)\s+(.+)$", user_input.strip(), flags=re.I)
-            if not m:
-                print("⚠️ 用法：save[轮数] 名称   例如：save2 项目计划")
-                continue
-
-            count_str, name = m.groups()
-            if not name.strip():
-                print("⚠️ 请提供记忆名称，例如：save3 项目计划")
-                continue
-
-            try:
-                # 每轮=2条消息（user+assistant）
-                max_msgs = int(count_str) * 2 if count_str else 8
-            except ValueError:
-                max_msgs = 8
-
-            try:
-                text = memory.to_text(max_msgs=max_msgs) or "(空)"
-                vmem_notes.add_memories([text], [{"type": "user_note", "name": name.strip()}])
-                print(f"✅ 已保存最近 {max_msgs//2} 轮对话为记忆：{name.strip()}")
-            except Exception as e:
-                print(f"⚠️ 保存记忆失败（向量库写入）: {e}")
-                if DEBUG:
-                    traceback.print_exc()
-            continue
-
-        # 4) list memories
-        if user_input.lower().startswith("list memories"):
-            hits = vmem_notes.query("", k=20)  # 空查询时 peek，VectorMemory.query 已做保护
-            if not hits:
-                print("（暂无命名记忆）")
-            else:
-                print("\n🗂 已保存记忆（Top 20）：")
-                for i, h in enumerate(hits, 1):
-                    nm = h.get("meta", {}).get("name") or "(未命名)"
-                    print(f"{i}. {nm}  score={h['score']:.2f}")
-            continue
-
-        # 5) delete 名称
-        if user_input.lower().startswith("delete "):
-            name = user_input.split(" ", 1)[1].strip()
-            cand = vmem_notes.query(name, k=1)
-            if not cand:
-                print("❌ 未找到可删除的记忆。"); 
-                continue
-
-            _id = cand[0]["id"]
-
-            try:
-                # 尝试删除
-                vmem_notes.col.delete(ids=[_id])
-                print(f"🗑️ 已删除：{cand[0].get('meta', {}).get('name', '(未命名)')}")
-            except Exception as e:
-                print(f"⚠️ 删除记忆失败（向量库）: {e}")
-                # 如果开了调试模式，输出完整堆栈
-                if DEBUG:
-                    import traceback
-                    traceback.print_exc()
-            continue
-
-        # 6) recall 名称/关键词 —— 召回并注入上下文
-        if user_input.lower().startswith("recall "):
-            key = user_input.split(" ", 1)[1].strip()
-            hits = vmem_notes.query(key, k=5)
-            if not hits:
-                print("❌ 未找到相关记忆。"); continue
-            _, block = build_recalled_context(hits, min_score=0.0, max_items=5, label="note")
-            # 直接把召回的记忆作为 system 上下文注入（一次性有效）
-            memory.add("system", "【召回记忆】\n" + block)
-            print("🔁 已将记忆注入上下文，本轮回答会参考以上内容。"); 
-            # 不继续，因为还要让用户下一条问问题
-            continue
+    def _chat(self, user_input: str) -> Tuple[Optional[str], str]:
+        t_start = time.perf_counter()
+        _, _, _, recalled_block = self.retrieve(user_input)
+        t_rag = time.perf_counter()
+        self.last_timings = {"rag": t_rag - t_start, "llm": 0.0, "total": 0.0}
 
-        # ---------- 常规对话：先做 RAG 召回，再问答 ----------
-        kd, kf, kn, recalled_block = query_all(
-            vmem_docs, vmem_facts, vmem_notes, user_input, k_each=8, min_score=0.2
-        )
-        context_msg = ""
+        context_parts = []
         if recalled_block:
-            context_msg = ("【检索到的相关资料（请优先依据这些片段回答，并在句末标注 [R#] 引用；"
-                           "docs=外部文档，facts=长期事实，note=用户记忆）】\n" + recalled_block)
+            context_parts.append(RAG_CONTEXT_HEADER + recalled_block)
+        if self.pending_recall:
+            context_parts.append(self.pending_recall)
+            self.pending_recall = ""
 
         # 短期记忆：写入用户消息
-        memory.add("user", user_input)
-        messages = [
-            {"role": "system", "content": active_system_prompt},
-            {"role": "developer", "content": active_developer_hint},
-        ]
-        if context_msg:
-            messages.append({"role": "system", "content": context_msg})
-        messages += memory.get()
+        self.memory.add("user", user_input)
+        # 稳定前缀（提示词 + 较早历史）在前，本轮检索上下文紧挨着本轮用户消息
+        messages = assemble_messages(
+            self.system_prompt, self.developer_hint, self.memory.get(), "\n\n".join(context_parts)
+        )
 
         try:
-            resp = client.chat.completions.create(
-                model=CHAT_MODEL, messages=messages, temperature=0.7
-            )
-            reply = resp.choices[0].message.content.strip()
+            resp = call_openai_with_retry(self.client, CHAT_MODEL, messages, temperature=0.7)
+        except CircuitOpenError as e:
+            # 上游降级：不再走完整重试阶梯，直接返回检索结果
+            warn(str(e))
+            return self._finish(t_rag, retrieval_only_answer(recalled_block), "degraded")
+        if resp is None:
+            return self._finish(t_rag, None, "error")
+        prompt_toks, cached_toks, _, secs = self.usage_stats.record(resp, time.perf_counter() - t_rag)
+        log(f"usage: prompt={prompt_toks} cached={cached_toks} ({secs:.2f}s)")
+        try:
+            reply = (resp.choices[0].message.content or "").strip()
         except Exception as e:
-            print(f"⚠️ 出错了: {e}"); continue
+            oops("解析 OpenAI 返回内容失败", e)
+            return self._finish(t_rag, None, "error")
+        self.memory.add("assistant", reply)
+        return self._finish(t_rag, reply, "ok")
+
+    def _finish(self, t_rag: float, reply: Optional[str], status: str):
+        now = time.perf_counter()
+        self.last_timings["llm"] = now - t_rag
+        self.last_timings["total"] = self.last_timings["rag"] + self.last_timings["llm"]
+        return reply, status
+
+
+
+
+# ---------- 命令注册表 ----------
+class CommandResult:
+    """命令的返回：text 供 REPL 打印；data 供批处理/程序化调用使用"""
+
+    def __init__(self, text: str = "", ok: bool = True, data=None):
+        self.text = text
+        self.ok = ok
+        self.data = data
+
+
+class Command:
+    def __init__(self, head: str, pattern: str, handler: Callable, usage: Optional[str] = None, help: str = ""):
+        self.head = head
+        self.regex = re.compile(pattern, flags=re.I)
+        self.handler = handler
+        self.usage = usage
+        self.help = help
+
+
+# 首个单词（小写）-> 该词开头的命令；一次字典查找 + 少量预编译正则匹配
+COMMANDS: Dict[str, List[Command]] = {}
+_HEAD_RE = re.compile(r"^([a-z]+)", flags=re.I)
+
+
+def command(head: str, pattern: str, usage: Optional[str] = None, help: str = ""):
+    """注册命令：pattern 匹配整行输入，命名分组作为关键字参数传给 handler(session, **groups)"""
+    def deco(fn):
+        COMMANDS.setdefault(head, []).append(Command(head, pattern, fn, usage, help))
+        return fn
+    return deco
+
+
+def dispatch(text: str) -> Optional[Tuple[Command, Optional["re.Match"]]]:
+    """
+    查找命令：返回 (命令, 匹配结果)；首词是命令但格式不对时匹配结果为 None（只对带 usage 的命令）
+    不是命令（应当走对话）时返回 None
+    """
+    m = _HEAD_RE.match(text)
+    group = COMMANDS.get(m.group(1).lower()) if m else None
+    if not group:
+        return None
+    for cmd in group:
+        found = cmd.regex.match(text)
+        if found:
+            return cmd, found
+    with_usage = [c for c in group if c.usage]
+    return (with_usage[0], None) if with_usage else None
+
+
+def run_command(session: "Session", text: str) -> Optional[CommandResult]:
+    """执行一行命令；不是命令时返回 None（由调用方决定是否当作对话）"""
+    found = dispatch(text.strip())
+    if found is None:
+        return None
+    cmd, m = found
+    if m is None:
+        return CommandResult(f"⚠️ 用法：{cmd.usage}", ok=False)
+    kwargs = {k: (v.strip() if isinstance(v, str) else v) for k, v in m.groupdict().items()}
+    return cmd.handler(session, **kwargs)
+
+
+def help_text() -> str:
+    return "命令：\n" + "\n".join(
+        f"  {cmd.help}" for group in COMMANDS.values() for cmd in group if cmd.help
+    ) + "\n"
+
+
+# ---------- Prompt 管理 ----------
+@command("optprompt", r"^optprompt\s+(?P<name>[^:：]+?)\s*[:：]\s*(?P<goal>.+)$",
+         usage="optprompt 名称: 目标（支持中文冒号）")
+def cmd_optprompt(session, name, goal):
+    recent = session.memory.to_text(max_msgs=12) or "(无最近对话)"
+    errors = []
+    try:
+        resp = call_openai_with_retry(
+            session.client, CHAT_MODEL, temperature=0.2,
+            messages=[
+                {"role":"system","content":PROMPT_ENGINEER},
+                {"role":"user","content":f"【当前 SYSTEM_PROMPT】\n{session.system_prompt}"},
+                {"role":"user","content":f"【当前 DEVELOPER_HINT】\n{session.developer_hint}"},
+                {"role":"user","content":f"【最近对话（截断）】\n{recent}"},
+                {"role":"user","content":f"【优化目标】\n{goal}\n请只输出 JSON。"}
+            ],
+            on_error=errors.append,
+        )
+        if resp is None:
+            return CommandResult("\n".join(errors), ok=False)
+        text = (resp.choices[0].message.content or "").strip()
+        data = parse_json_maybe(text)
+        new_sys = data.get("system_prompt","").strip()
+        new_dev = data.get("developer_hint","").strip()
+        if not new_sys or not new_dev:
+            log(text)
+            return CommandResult("⚠️ 优化结果缺少字段，请重试或调整目标。", ok=False)
+
+        session.stores.prompts.add_memories(
+            [new_sys, new_dev],
+            [
+                {"type":"prompt","name":name,"kind":"system"},
+                {"type":"prompt","name":name,"kind":"developer"},
+            ],
+            dedup="off",  # Prompt 按名称区分，相同文本也要各存一份
+        )
+    except Exception as e:
+        if DEBUG: traceback.print_exc()
+        return CommandResult(f"⚠️ 生成优化 Prompt 失败：{e}", ok=False)
+    return CommandResult(f"✅ 已生成优化 Prompt：{name}\n可用命令：useprompt {name} / showprompt {name}\n"
+                         f"对比评测：evalprompts default,{name}: 问题文件",
+                         data={"system": new_sys, "developer": new_dev, "notes": data.get("notes", "")})
+
+
+@command("list", r"^list\s+prompts\b", help="list prompts       列出保存的 Prompt")
+def cmd_list_prompts(session):
+    grouped = {}
+    for h in session.stores.prompts.get(where={"type": "prompt"}, limit=1000):
+        meta = h.get("meta",{})
+        grouped.setdefault(meta.get("name","(未命名)"), set()).add(meta.get("kind"))
+    if not grouped:
+        return CommandResult("（暂无保存的 Prompt）", data={})
+    lines = ["🗂 Prompts："] + [f"- {nm}  [{','.join(sorted(map(str, kinds)))}]" for nm, kinds in grouped.items()]
+    return CommandResult("\n".join(lines), data=grouped)
+
+
+@command("showprompt", r"^showprompt\s+(?P<key>.+)$", help="showprompt 名称     查看保存的 Prompt")
+def cmd_showprompt(session, key):
+    sys_txt, dev_txt = load_prompt(session.stores.prompts, key)
+    if not (sys_txt or dev_txt):
+        return CommandResult("❌ 未找到该 Prompt。", ok=False)
+    return CommandResult(f"\n--- {key}: SYSTEM_PROMPT ---\n{sys_txt or '(无)'}\n"
+                         f"\n--- {key}: DEVELOPER_HINT ---\n{dev_txt or '(无)'}\n",
+                         data={"system": sys_txt, "developer": dev_txt})
+
+
+@command("useprompt", r"^useprompt\s+(?P<key>.+)$", help="useprompt 名称      启用保存的 Prompt（revert prompt 回滚）")
+def cmd_useprompt(session, key):
+    sys_txt, dev_txt = load_prompt(session.stores.prompts, key)
+    if not (sys_txt and dev_txt):
+        return CommandResult("❌ 未找到完整的 Prompt（system/developer）。先执行 showprompt 查看。", ok=False)
+    session.system_prompt, session.developer_hint = sys_txt, dev_txt
+    session.gate.reset()
+    return CommandResult(f"✅ 已启用 Prompt：{key}")
+
+
+@command("revert", r"^revert\s+prompt\b")
+def cmd_revert_prompt(session):
+    session.system_prompt, session.developer_hint = SYSTEM_PROMPT, DEVELOPER_HINT
+    session.gate.reset()
+    return CommandResult("↩️ 已回滚为默认 Prompt。")
+
+
+@command("delprompt", r"^delprompt\s+(?P<key>.+)$", help="delprompt 名称      删除保存的 Prompt")
+def cmd_delprompt(session, key):
+    prompts = session.stores.prompts
+    hits = prompts.get(where={"$and": [{"type": "prompt"}, {"name": key}]}, limit=50)
+    ids = [h["id"] for h in hits
+           if h.get("meta", {}).get("name") == key and h.get("meta", {}).get("type") == "prompt"]
+    if not ids:
+        return CommandResult("❌ 未找到要删除的 Prompt。", ok=False)
+    try:
+        prompts.delete(ids)
+    except Exception as e:
+        if DEBUG: traceback.print_exc()
+        return CommandResult(f"⚠️ 删除失败：{e}", ok=False)
+    return CommandResult(f"🗑️ 已删除 Prompt：{key}", data=ids)
+
+
+@command("abtest", r"^abtest\s+(?P<key>[^:：]+?)\s*[:：]\s*(?P<question>.+)$", usage="abtest 名称: 问题")
+def cmd_abtest(session, key, question):
+    sys_txt, dev_txt = load_prompt(session.stores.prompts, key)
+    if not (sys_txt and dev_txt):
+        return CommandResult("❌ 未找到完整 Prompt。", ok=False)
+    try:
+        trial_msgs = [
+            {"role":"system","content":sys_txt},
+            {"role":"developer","content":dev_txt},
+            {"role":"user","content":question}
+        ]
+        errors = []
+        trial = call_openai_with_retry(session.client, CHAT_MODEL, trial_msgs, temperature=0.7,
+                                       on_error=errors.append)
+        if trial is None:
+            return CommandResult("\n".join(errors), ok=False)
+        ans = (trial.choices[0].message.content or "").strip()
+    except Exception as e:
+        if DEBUG: traceback.print_exc()
+        return CommandResult(f"⚠️ A/B 试用失败：{e}", ok=False)
+    return CommandResult(f"\n--- A/B 试用回答 ---\n {ans} \n", data=ans)
+
+
+# ---- evalprompts 名称1,名称2,...: 问题文件 —— 多变体 × 多问题并行评测 ----
+@command("evalprompts", r"^evalprompts\s+(?P<names>[^:：]+?)\s*[:：]\s*(?P<qpath>.+)$",
+         usage="evalprompts 名称1,名称2[,default|active]: 问题文件（每行一个问题）",
+         help="evalprompts A,B: 问题文件  多个 Prompt × 多个问题并行评测（延迟/token/回答长度）")
+def cmd_evalprompts(session, names, qpath):
+    st = session.stores
+    variants, missing = [], []
+    for nm in (n.strip() for n in re.split(r"[,，]", names) if n.strip()):
+        if nm == "default":
+            sys_txt, dev_txt = SYSTEM_PROMPT, DEVELOPER_HINT
+        elif nm == "active":
+            sys_txt, dev_txt = session.system_prompt, session.developer_hint
+        else:
+            sys_txt, dev_txt = load_prompt(st.prompts, nm)
+        if sys_txt and dev_txt:
+            variants.append({"name": nm, "system": sys_txt, "developer": dev_txt})
+        else:
+            missing.append(nm)
+    if missing:
+        return CommandResult(f"❌ 未找到完整 Prompt：{', '.join(missing)}", ok=False)
+    try:
+        questions = evaluate.load_questions(qpath)
+    except Exception as e:
+        return CommandResult(oops_text("读取问题文件失败", e), ok=False)
+    if not questions:
+        return CommandResult("⚠️ 问题文件为空。", ok=False)
+
+    def _context(q):
+        _, _, _, block = query_all(st.docs, st.facts, st.notes, q, k_each=8, min_score=0.2)
+        return (RAG_CONTEXT_HEADER + block) if block else ""
+
+    header = f"🧪 评测 {len(variants)} 个变体 × {len(questions)} 个问题（并发 {EVAL_WORKERS}）"
+    try:
+        t0 = time.perf_counter()
+        contexts = evaluate.retrieve_contexts(questions, _context, workers=EVAL_WORKERS)
+        trials = evaluate.run_matrix(session.client, CHAT_MODEL, variants, questions, contexts, workers=EVAL_WORKERS)
+        elapsed = time.perf_counter() - t0
+    except Exception as e:
+        return CommandResult(f"{header}\n{oops_text('评测失败', e)}", ok=False)
+    rows = evaluate.summarize(trials, variants)
+    path = evaluate.save_trials(trials, questions)
+    for t in trials:
+        if t["error"]:
+            log(f"{t['variant']} #{t['question']}: {t['error']}")
+    return CommandResult(f"{header}\n{evaluate.format_report(rows)}\n⏱ 总耗时 {elapsed:.1f}s；逐条回答已保存：{path}",
+                         data={"rows": rows, "path": path})
+
+
+# ---- testerr <kind> ：模拟各种错误，验证报错分支 ----
+TESTERR_CASES = {
+    "quota":   ("额度用尽", "额度不足/已用尽（insufficient_quota）", "insufficient_quota"),
+    "auth":    ("鉴权失败", "鉴权失败（API Key 无效或未配置）", "invalid_api_key"),
+    "model":   ("模型不存在", "模型不可用/不存在", "model_not_found"),
+    "network": ("网络/DNS", "网络错误（DNS/连接）", "Could not resolve host"),
+    "rate":    ("限速429", "请求被限速（429）", "Rate limit exceeded"),
+    "timeout": ("超时", "未知错误", "timeout"),
+    "parse":   ("解析返回失败", "解析 OpenAI 返回内容失败", "list index out of range"),
+    "vdb":     ("向量库写入失败", "保存记忆失败（向量库写入）", "chroma write failed"),
+}
+
+
+@command("testerr", r"^testerr\s+(?P<kind>\S+)")
+def cmd_testerr(session, kind):
+    case = TESTERR_CASES.get(kind.lower())
+    if case is None:
+        return CommandResult("可选：" + "/".join(TESTERR_CASES), ok=False)
+    show, title, msg = case
+    return CommandResult(f"🔬 模拟：{show}\n{oops_text(title, Exception(msg))}")
+
+
+# ---------- 调试/管理命令 ----------
+@command("gate", r"^gate\s+stats\b", help="gate stats         查看检索门控与查询扩展统计（跳过/复用次数、扩展/回退次数）")
+def cmd_gate_stats(session):
+    gate = session.gate
+    return CommandResult("🚦 检索门控：" + ("开启" if gate.enabled else "关闭（RAG_GATE=0）") + "\n"
+                         + gate.stats_text() + "\n" + session.stores.expander.stats_text())
+
+
+@command("memory", r"^memory\s+(?P<sub>stats|maintain)$",
+         help="memory stats       查看各记忆集合的保留策略/淘汰/压缩情况（memory maintain 立即维护一次）")
+def cmd_memory(session, sub):
+    lifecycle = session.stores.lifecycle
+    if sub.lower() == "maintain":
+        try:
+            lifecycle.run_maintenance()
+        except Exception as e:
+            return CommandResult(oops_text("记忆维护失败", e), ok=False)
+    return CommandResult("🧠 记忆生命周期：\n" + lifecycle.stats_text())
 
-        print("Chatbot：", reply, "\n")
-        memory.add("assistant", reply)
 
-            # ---- 细化分类 ----
-        if "insufficient_quota" in err or "quota" in err:
-            print("💡 原因：API 额度已用完。")
-            print("👉 解决：登录 https://platform.openai.com/account/billing 查看账单或充值。")
+@command("usage", r"^usage$", help="usage              查看上一轮/累计的输入 token 与 prompt 缓存命中")
+def cmd_usage(session):
+    return CommandResult("📊 " + session.usage_stats.text())
 
-        elif "invalid_api_key" in err or "authentication" in err:
-            print("💡 原因：API Key 无效或环境变量未加载。")
-            print("👉 解决：检查 .env 文件或环境变量 OPENAI_API_KEY。")
 
-        elif "model_not_found" in err or "does not exist" in err:
-            print("💡 原因：模型名称错误或你账号无访问权限。")
-            print("👉 解决：检查 config.py 中的 CHAT_MODEL 是否拼写正确。")
+@command("profile", r"^profile\s+(?:(?P<what>mem|sample)\s+)?(?P<switch>on|off)$",
+         usage="profile on|off / profile mem on|off / profile sample on|off / profile stats",
+         help="profile on/off     按轮 cProfile 写 .pstats（profile mem on/off 轮间内存对比，profile sample on/off 采样火焰图）")
+def cmd_profile(session, what, switch):
+    prof = session.stores.profiler
+    on = switch.lower() == "on"
+    what = (what or "").lower()
+    if what == "mem":
+        if on:
+            prof.start_tracemalloc(PROFILE_TRACEMALLOC or 25)
+        else:
+            prof.stop_tracemalloc()
+        return CommandResult(f"🧠 tracemalloc 已{'开启，每轮结束对比内存增长' if on else '关闭'}。")
+    if what == "sample":
+        if on:
+            prof.start_sampling(PROFILE_SAMPLE_HZ or 100)
+            return CommandResult("🔥 采样已开启（profile sample off 写出 .collapsed）。")
+        path = prof.stop_sampling()
+        return CommandResult("🔥 采样已关闭" + ("。" if path else "（没有样本）。"), data=path)
+    prof.cprofile = on
+    return CommandResult(f"🔬 cProfile 已{'开启，每轮写出 .pstats 到 ' + prof.out_dir if on else '关闭'}。")
+
+
+@command("profile", r"^profile\s+stats$", help="profile stats      查看剖析开关与最近一轮的热点函数/内存增长")
+def cmd_profile_stats(session):
+    return CommandResult("🔬 " + session.stores.profiler.stats_text())
+
+
+@command("cache", r"^cache\s+(?P<sub>stats|clear)\s*$", help="cache stats        查看检索缓存大小/命中率（cache clear 清空）")
+def cmd_cache(session, sub):
+    if sub.lower() == "clear":
+        query_cache().invalidate()
+        session.gate.reset()
+        return CommandResult("🧹 检索缓存已清空。")
+    st = query_cache().stats()
+    lines = [f"🗃 检索缓存：{st['size']}/{st['max']} 条，命中 {st['hits']} / 未命中 {st['misses']}"
+             f"（命中率 {st['hit_rate']:.0%}）"]
+    stores = session.stores
+    for vm in (stores.docs, stores.facts, stores.notes, stores.prompts):
+        lines.append(f"  - {vm.name}: version={vm.version}")
+    return CommandResult("\n".join(lines), data=st)
+
+
+# ---------- 记忆 ----------
+@command("rag", r"^rag\?\s*(?P<query>.*)$",
+         help="rag? 关键词        查看 RAG 命中（可加范围：@source:manual/*.md @since:7d @name:xx @has:词）")
+def cmd_rag(session, query):
+    try:
+        q, scope = parse_scope(query)
+    except ValueError as e:
+        return CommandResult(f"⚠️ {e}", ok=False)
+    st = session.stores
+    head = f"🎯 范围：{scope.describe()}\n" if scope else ""
+    try:
+        kd, kf, kn, block = query_all(st.docs, st.facts, st.notes, q, k_each=8, min_score=0.0,
+                                      scope=scope, expander=st.expander)
+    except ValueError as e:
+        return CommandResult(f"⚠️ {e}", ok=False)
+    title = "\n🔎 RAG 命中：\n" if q.strip() else "\n📋 范围内的条目（未按相关度排序）：\n"
+    return CommandResult(head + title + (block or "(无检索结果)"),
+                         data={"docs": kd, "facts": kf, "notes": kn, "block": block})
+
+
+NOTE_BATCH = 256  # 批量保存时每次向量化/写入的条数（OpenAI 单次 embeddings 最多 2048 条）
+
+
+def save_notes(stores: "Stores", items: List[Tuple[str, str]]) -> Tuple[List[str], Dict[int, tuple]]:
+    """
+    批量保存命名记忆 [(名称, 内容), ...]：每 NOTE_BATCH 条一次向量化 + 一次写入
+    返回 (与 items 对应的 id, {位置: (已有 id, exact|near)})；被去重的位置 id 为已有条目的 id
+    """
+    ids, dups = [], {}
+    for i in range(0, len(items), NOTE_BATCH):
+        chunk = items[i:i + NOTE_BATCH]
+        ids += stores.notes.add_memories(
+            [content for _, content in chunk],
+            [{"type": "user_note", "name": name} for name, _ in chunk],
+        )
+        dups.update((i + pos, (dup_id, kind)) for pos, dup_id, kind in stores.notes.last_duplicates)
+    return ids, dups
+
+
+@command("saveas", r"^saveas\s+(?P<name>[^:：]+?)\s*[:：]\s*(?P<content>\S.*)$",
+         usage="saveas 名称: 内容   （支持中文冒号：）", help="saveas 名称: 内容  直接把指定内容保存为记忆")
+def cmd_saveas(session, name, content):
+    try:
+        ids, dups = save_notes(session.stores, [(name, content)])
+    except Exception as e:
+        if DEBUG: traceback.print_exc()
+        return CommandResult(f"⚠️ 保存记忆失败（向量库写入）: {e}", ok=False)
+    return CommandResult(duplicate_text(*dups[0]) if dups else f"✅ 已保存记忆：{name}", data=ids)
+
+
+# save / save2 / save3 / save10 ...
+@command("save", r"^save(?P<turns>\d*)\s+(?P<name>.+)$",
+         usage="save[轮数] 名称   例如：save2 项目计划", help="save 名称          保存最近对话摘要为命名记忆")
+def cmd_save(session, turns, name):
+    # 每轮=2条消息（user+assistant）
+    max_msgs = int(turns) * 2 if turns else 8
+    try:
+        text = session.memory.to_text(max_msgs=max_msgs) or "(空)"
+        ids, dups = save_notes(session.stores, [(name, text)])
+    except Exception as e:
+        if DEBUG: traceback.print_exc()
+        return CommandResult(f"⚠️ 保存记忆失败（向量库写入）: {e}", ok=False)
+    return CommandResult(duplicate_text(*dups[0]) if dups
+                         else f"✅ 已保存最近 {max_msgs//2} 轮对话为记忆：{name}", data=ids)
+
+
+@command("list", r"^list\s+memories\b", help="list memories      列出命名记忆（前 20 条）")
+def cmd_list_memories(session):
+    hits = session.stores.notes.get(limit=20)  # 直接列出，不做向量化
+    if not hits:
+        return CommandResult("（暂无命名记忆）", data=[])
+    lines = ["\n🗂 已保存记忆（前 20 条）："]
+    for i, h in enumerate(hits, 1):
+        nm = h.get("meta", {}).get("name") or "(未命名)"
+        lines.append(f"{i}. {nm}")
+    return CommandResult("\n".join(lines), data=hits)
+
+
+@command("delete", r"^delete\s+(?P<name>.+)$", help="delete 名称        删除最相关的一条命名记忆")
+def cmd_delete(session, name):
+    notes = session.stores.notes
+    cand = notes.query(name, k=1)
+    if not cand:
+        return CommandResult("❌ 未找到可删除的记忆。", ok=False)
+    try:
+        notes.delete([cand[0]["id"]])
+    except Exception as e:
+        if DEBUG: traceback.print_exc()
+        return CommandResult(f"⚠️ 删除记忆失败（向量库）: {e}", ok=False)
+    return CommandResult(f"🗑️ 已删除：{cand[0].get('meta', {}).get('name', '(未命名)')}", data=cand[0]["id"])
+
+
+# recall 名称/关键词 —— 召回并注入上下文
+@command("recall", r"^recall\s+(?P<key>.+)$", help="recall 名称/关键词  召回记忆并注入上下文")
+def cmd_recall(session, key):
+    notes = session.stores.notes
+    hits = notes.query(key, k=5)
+    if not hits:
+        return CommandResult("❌ 未找到相关记忆。", ok=False)
+    kept, block = build_recalled_context(rerank(notes, hits), min_score=0.0, max_items=5, label="note")
+    session.stores.lifecycle.record_hits(notes, [h["id"] for h in kept])
+    # 召回的记忆只在下一轮作为尾部上下文注入（一次性有效），不写进历史，避免破坏前缀缓存
+    session.pending_recall = "【召回记忆】\n" + block
+    return CommandResult("🔁 已将记忆注入上下文，本轮回答会参考以上内容。", data=kept)
+
+
+# ---------- 批处理 ----------
+def run_batch(session: "Session", lines: List[str], chat: bool = False) -> List[Optional[CommandResult]]:
+    """
+    非交互地逐行执行命令（与 REPL 同一套处理函数）；返回与 lines 对应的结果
+    - 连续的 saveas 合并成批量写入（一次向量化请求处理 NOTE_BATCH 条）
+    - 不是命令的行：chat=True 时当作对话，否则跳过（结果为 None）
+    """
+    results: List[Optional[CommandResult]] = [None] * len(lines)
+    pending: List[Tuple[int, str, str]] = []
+
+    def _flush():
+        if not pending:
+            return
+        try:
+            ids, dups = save_notes(session.stores, [(name, content) for _, name, content in pending])
+            for i, ((pos, name, _), _id) in enumerate(zip(pending, ids)):
+                text = duplicate_text(*dups[i]) if i in dups else f"✅ 已保存记忆：{name}"
+                results[pos] = CommandResult(text, data=[_id])
+        except Exception as e:
+            for pos, _, _ in pending:
+                results[pos] = CommandResult(f"⚠️ 保存记忆失败（向量库写入）: {e}", ok=False)
+        pending.clear()
 
-        elif "rate limit" in err or "429" in err:
-            print("💡 原因：请求被限速（429）。")
-            print("👉 解决：稍等几秒后再试，或降低调用频率。")
+    for pos, raw in enumerate(lines):
+        text = raw.strip()
+        if not text or text.startswith("#"):
+            continue
+        found = dispatch(text)
+        if found and found[0].handler is cmd_saveas and found[1] is not None:
+            pending.append((pos, found[1].group("name").strip(), found[1].group("content").strip()))
+            continue
+        _flush()
+        if found is not None:
+            results[pos] = run_command(session, text)
+        elif chat:
+            reply, status = session.chat(text)
+            results[pos] = CommandResult(reply or "", ok=(status == "ok"), data=status)
+    _flush()
+    return results
 
-        elif "connection" in err or "resolve host" in err or "timeout" in err:
-            print("💡 原因：网络或 DNS 问题。")
-            print("👉 解决：检查网络连接、代理设置，或更换 DNS（如 8.8.8.8）。")
 
+# ---------- 主程序 ----------
+def main(argv=None):
+    import argparse
+    ap = argparse.ArgumentParser(description="Chatbot：交互式对话；--batch 时非交互地执行命令文件")
+    ap.add_argument("--batch", default=None, help="命令文件（每行一条命令，# 开头为注释；- 表示标准输入）")
+    ap.add_argument("--chat", action="store_true", help="批处理时把非命令行当作对话发送")
+    args = ap.parse_args(argv)
+
+    stores  = Stores()
+    session = Session(stores)
+
+    # 任何退出路径（exit / Ctrl-D / Ctrl-C / 异常）都要 close：刷出排队的生命周期写回等后台任务
+    try:
+        if args.batch:
+            run_batch_file(session, args.batch, chat=args.chat)
         else:
-            print("💡 原因未知，请查看完整错误日志以排查。")
+            repl(session)
+    finally:
+        stores.close()
+
+
+def run_batch_file(session: Session, path: str, chat: bool = False) -> None:
+    import sys
+    f = sys.stdin if path == "-" else open(path, "r", encoding="utf-8")
+    try:
+        lines = f.read().splitlines()
+    finally:
+        if f is not sys.stdin:
+            f.close()
+    results = run_batch(session, lines, chat=chat)
+    done = [r for r in results if r is not None]
+    failed = sum(1 for r in done if not r.ok)
+    for r in done:
+        if not r.ok and r.text:
+            print(r.text)
+    print(f"📦 批处理完成：{len(done)} 条命令，失败 {failed} 条，跳过 {len(lines) - len(done)} 行")
+
+
+def repl(session: Session) -> None:
+    print("🤖 Chatbot 已启动，输入 'exit' 退出。")
+    print(help_text())
+
+    while True:
+        try:
+            user_input = input("你：").strip()
+        except (EOFError, KeyboardInterrupt):
+            print("\n👋 再见！"); break
+        if user_input.lower() in {"exit", "quit"}:
+            print("👋 再见！"); break
 
-        continue  # 跳过本轮，继续下一轮输入
+        result = run_command(session, user_input)
+        if result is not None:
+            if result.text:
+                print(result.text)
+            continue
 
+        # ---------- 常规对话：先做 RAG 召回，再问答 ----------
+        reply, status = session.chat(user_input)
+        if status == "degraded":
+            print("Chatbot（仅检索）：", reply, "\n")
+        elif status == "ok":
+            print("Chatbot：", reply, "\n")
+        # error：具体原因 call_openai_with_retry 已打印
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
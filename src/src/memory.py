@@ -4,24 +4,317 @@
 
 - VectorMemory：基于 Chroma 的向量库
     - add_memories(texts, metadatas=None) -> List[str]
-    - query(query_text, k=5) -> List[Dict]
+    - query(query_text, k=5, where=None, where_document=None) -> List[Dict]
+    - query_embeddings(embeddings, k=5, where=None, where_document=None) -> List[List[Dict]]
+    - get(where=None, where_document=None, limit=100) -> List[Dict]   按条件列出（无 score）
+    - source_counts() -> Dict[str, int]                               来源 -> 块数
+    - delete(ids) -> None
+    - touch(ids) -> None          记录召回（last_hit_at / hit_count），见 lifecycle.py
     - count() -> int
     - reset() -> None
 
+- 写入去重：add_memories 按 DEDUP_POLICY 做精确/近似重复检测（见 dedup.py）
+
+- 检索结果缓存：按 (集合, 版本号, 规范化查询, k) 缓存 query 结果
+    - 每个集合一个版本号，写入/删除/重置/ingest upsert 时 +1，失效是精确的（不靠 TTL）
+    - 版本号持久化在 persist_dir/collection_versions.json，ingest 进程的写入也能被聊天进程感知
+
+- SnapshotMemory：只读，直接在 ingest export 的快照上检索（DOCS_SNAPSHOT），免导入 Chroma
+    - query / query_embeddings / get / source_counts / count 与 VectorMemory 一致
+
 - ChatMemory：简易会话缓冲（只存最近 N 轮）
     - add(role, content) -> None
     - get() -> List[Dict]
 """
 
+import os
+import json
 import time
 import uuid
+import hashlib
+import functools
+import contextlib
+import threading
+from array import array
+from collections import OrderedDict
 from typing import List, Dict, Optional
 
+try:
+    import fcntl  # 仅 POSIX；Windows 下跨进程写版本号时不加锁
+except ImportError:
+    fcntl = None
+
 import chromadb
 from chromadb.config import Settings
 
 from .embeddings import Embedder
-from .config import VECTOR_DB_PATH
+from .config import VECTOR_DB_PATH, QUERY_CACHE_SIZE, DEDUP_POLICY, DEDUP_NEAR_BITS
+from .dedup import DedupIndex, get_index as get_dedup_index
+from .snapshot import Snapshot
+
+
+# ---------- 集合版本号 ----------
+class CollectionVersions:
+    """persist_dir 下所有集合的版本号（进程内缓存，文件 mtime 变化时重新读取）"""
+
+    FILENAME = "collection_versions.json"
+
+    def __init__(self, persist_dir: str):
+        self.path = os.path.join(persist_dir, self.FILENAME)
+        self._lock = threading.Lock()
+        self._mtime: Optional[int] = None
+        self._versions: Dict[str, int] = {}
+
+    def _reload(self):
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            self._mtime, self._versions = None, {}
+            return
+        if mtime == self._mtime:
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self._versions = {k: int(v) for k, v in json.load(f).items()}
+        except (OSError, ValueError):
+            self._versions = {}
+        self._mtime = mtime
+
+    def get(self, collection: str) -> int:
+        with self._lock:
+            self._reload()
+            return self._versions.get(collection, 0)
+
+    def all(self) -> Dict[str, int]:
+        with self._lock:
+            self._reload()
+            return dict(self._versions)
+
+    def bump(self, collection: str) -> int:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with self._lock, open(self.path + ".lock", "w") as lock_f:
+            if fcntl:
+                fcntl.flock(lock_f, fcntl.LOCK_EX)
+            self._mtime = None  # 强制重读，拿到其它进程的最新值
+            self._reload()
+            v = self._versions.get(collection, 0) + 1
+            self._versions[collection] = v
+            tmp = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self._versions, f, ensure_ascii=False)
+            os.replace(tmp, self.path)
+            self._mtime = os.stat(self.path).st_mtime_ns
+        _QUERY_CACHE.invalidate(_cache_ns(self.path, collection))
+        return v
+
+
+_VERSIONS: Dict[str, CollectionVersions] = {}
+_VERSIONS_LOCK = threading.Lock()
+
+
+def get_versions(persist_dir: str) -> CollectionVersions:
+    key = os.path.abspath(persist_dir)
+    with _VERSIONS_LOCK:
+        if key not in _VERSIONS:
+            _VERSIONS[key] = CollectionVersions(key)
+        return _VERSIONS[key]
+
+
+def bump_collection_version(persist_dir: str, collection: str) -> int:
+    """供 ingest 等直接操作 Chroma 的地方调用，使聊天进程里的检索缓存失效"""
+    return get_versions(persist_dir).bump(collection)
+
+
+# ---------- 来源索引 ----------
+class SourceIndex:
+    """
+    来源 -> 块数（persist_dir/sources/<collection>.json），附带它对应的集合版本号；用于展开 @source:glob
+    - ingest --watch 每批写入后直接更新（update），不必重扫集合
+    - 其它写入方不维护它：读取时版本号对不上就重扫一次集合并写回
+    """
+
+    def __init__(self, persist_dir: str, collection: str):
+        self.path = os.path.join(persist_dir, "sources", f"{collection}.json")
+        self._lock = threading.Lock()
+        self._mtime: Optional[int] = None
+        self._data: Dict = {"version": -1, "counts": {}}
+
+    def _reload(self):
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            self._mtime, self._data = None, {"version": -1, "counts": {}}
+            return
+        if mtime == self._mtime:
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self._data = {"version": int(data["version"]), "counts": dict(data["counts"])}
+        except (OSError, ValueError, KeyError, TypeError):
+            self._data = {"version": -1, "counts": {}}
+        self._mtime = mtime
+
+    def _write(self, data: Dict):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp, self.path)
+        self._data, self._mtime = data, os.stat(self.path).st_mtime_ns
+
+    @contextlib.contextmanager
+    def _file_lock(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with self._lock, open(self.path + ".lock", "w") as lock_f:
+            if fcntl:
+                fcntl.flock(lock_f, fcntl.LOCK_EX)
+            yield
+
+    def counts(self, col, version: int, page: int = 5000) -> Dict[str, int]:
+        with self._lock:
+            self._reload()
+            if self._data["version"] == version:
+                return self._data["counts"]
+        counts: Dict[str, int] = {}
+        offset, total = 0, col.count()
+        while offset < total:
+            got = col.get(include=["metadatas"], limit=page, offset=offset)
+            metas = got.get("metadatas") or []
+            if not metas:
+                break
+            for m in metas:
+                if m and "source" in m:
+                    counts[str(m["source"])] = counts.get(str(m["source"]), 0) + 1
+            offset += len(metas)
+        with self._file_lock():
+            self._write({"version": version, "counts": counts})
+        return counts
+
+    def update(self, counts: Dict[str, int], base_version: int, version: int) -> bool:
+        """
+        写入方在一次写入（版本 base_version -> version）后设置这些来源的最新块数（0 = 删除）；
+        索引不是 base_version 时（中间有不维护索引的写入）不更新，留给读取方重扫
+        """
+        with self._file_lock():
+            self._mtime = None
+            self._reload()
+            if self._data["version"] != base_version:
+                return False
+            merged = dict(self._data["counts"])
+            for src, n in counts.items():
+                if n > 0:
+                    merged[src] = n
+                else:
+                    merged.pop(src, None)
+            self._write({"version": version, "counts": merged})
+            return True
+
+
+_SOURCE_INDEXES: Dict[tuple, SourceIndex] = {}
+
+
+def get_source_index(persist_dir: str, collection: str) -> SourceIndex:
+    key = (os.path.abspath(persist_dir), collection)
+    with _VERSIONS_LOCK:
+        if key not in _SOURCE_INDEXES:
+            _SOURCE_INDEXES[key] = SourceIndex(*key)
+        return _SOURCE_INDEXES[key]
+
+
+# ---------- 检索结果缓存 ----------
+def _cache_ns(versions_path: str, collection: str) -> str:
+    return f"{os.path.dirname(versions_path)}::{collection}"
+
+
+def _filter_key(f: Optional[Dict]) -> str:
+    return json.dumps(f, sort_keys=True, ensure_ascii=False) if f else ""
+
+
+def normalize_query(text: str) -> str:
+    return " ".join((text or "").split()).lower()
+
+
+def _embedding_digest(embedding: List[float]) -> str:
+    return hashlib.sha1(array("f", embedding).tobytes()).hexdigest()
+
+
+class QueryCache:
+    """LRU 缓存；key 的第一个元素是命名空间（persist_dir::collection），第二个是版本号"""
+
+    def __init__(self, max_entries: int = 512):
+        self.max_entries = max_entries
+        self._data: "OrderedDict[tuple, List[Dict]]" = OrderedDict()
+        self._ns_version: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _drop_ns(self, ns: str):
+        for key in [k for k in self._data if k[0] == ns]:
+            del self._data[key]
+
+    def get(self, key: tuple) -> Optional[List[Dict]]:
+        ns, version = key[0], key[1]
+        with self._lock:
+            if self._ns_version.get(ns) != version:
+                # 版本前进（含其它进程写入）：整个集合的旧结果作废
+                self._drop_ns(ns)
+                self._ns_version[ns] = version
+            hit = self._data.get(key)
+            if hit is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return [dict(h) for h in hit]
+
+    def put(self, key: tuple, value: List[Dict]):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            if self._ns_version.get(key[0]) != key[1]:
+                return  # 查询期间集合已被修改，结果不入缓存
+            self._data[key] = [dict(h) for h in value]
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def invalidate(self, ns: Optional[str] = None):
+        with self._lock:
+            if ns is None:
+                self._data.clear()
+                self._ns_version.clear()
+            else:
+                self._drop_ns(ns)
+                self._ns_version.pop(ns, None)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "max": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / total) if total else 0.0,
+            }
+
+
+_QUERY_CACHE = QueryCache(QUERY_CACHE_SIZE)
+
+
+def query_cache() -> QueryCache:
+    return _QUERY_CACHE
+
+
+def _locked(fn):
+    """写操作串行化：后台压缩替换集合时不会丢掉并发写入"""
+    @functools.wraps(fn)
+    def wrapper(self, *args, **kwargs):
+        with self.write_lock:
+            return fn(self, *args, **kwargs)
+    return wrapper
 
 
 class VectorMemory:
@@ -40,21 +333,67 @@ class VectorMemory:
             metadata={"hnsw:space": "cosine"},  # 余弦距离（越小越相似）
         )
         self.embedder = embedder or Embedder()
+        self.versions = get_versions(persist_dir)
+        self._ns = _cache_ns(self.versions.path, collection)
+        self.persist_dir = persist_dir
+        self._dedup: Optional[DedupIndex] = None
+        self.last_duplicates: List[tuple] = []  # 最近一次 add_memories 的 (位置, 已有 id, exact|near)
+        self.write_lock = threading.RLock()
+        self.hit_stats: Dict[str, tuple] = {}   # id -> (last_hit_at, hit_count)：本进程最新的召回记录
+        self.deleted_count = 0                  # 本进程累计删除条数（压缩判断用）
+        self._changes: Optional[set] = None     # 压缩复制期间被写过的 id（见 lifecycle.compact_collection）
+
+    @property
+    def dedup_index(self) -> DedupIndex:
+        """签名索引按需加载（DEDUP_POLICY=off 时不产生任何开销）"""
+        if self._dedup is None:
+            self._dedup = get_dedup_index(self.persist_dir, self.col.name, DEDUP_NEAR_BITS)
+        return self._dedup
+
+    @property
+    def version(self) -> int:
+        return self.versions.get(self.col.name)
+
+    @property
+    def name(self) -> str:
+        return self.col.name
+
+    def _bump(self):
+        self.versions.bump(self.col.name)
+
+    # ---------- 写入跟踪（后台压缩用）----------
+    @_locked
+    def track_changes(self):
+        """开始记录被写过的 id"""
+        self._changes = set()
+
+    @_locked
+    def take_changes(self) -> Optional[set]:
+        """结束记录并返回期间被写过的 id；期间集合被 reset 时返回 None"""
+        changes, self._changes = self._changes, None
+        return changes
+
+    def _mark(self, ids):
+        if self._changes is not None:
+            self._changes.update(ids)
 
     # ---------- 写入 ----------
+    @_locked
     def add_memories(
-        self, texts: List[str], metadatas: Optional[List[Dict]] = None
+        self,
+        texts: List[str],
+        metadatas: Optional[List[Dict]] = None,
+        dedup: Optional[str] = None,
     ) -> List[str]:
-        """写入多条文本到向量库；返回生成的 ids"""
+        """
+        写入多条文本到向量库；返回与 texts 一一对应的 ids（被去重的位置返回已有条目的 id）
+        dedup：skip / merge / newest / off，默认取 DEDUP_POLICY；命中情况记录在 self.last_duplicates
+        """
         texts = [t for t in (texts or []) if isinstance(t, str) and t.strip()]
+        self.last_duplicates = []
         if not texts:
             return []
 
-        embs = self.embedder.embed(texts)
-        ids = [
-            f"m-{int(time.time()*1000)}-{uuid.uuid4().hex[:8]}-{i}"
-            for i in range(len(texts))
-        ]
         metas = metadatas or [{} for _ in texts]
 
         # Chroma 要求 metadatas/documents/embeddings/ids 等长
@@ -63,43 +402,215 @@ class VectorMemory:
                 metas = metas + [{} for _ in range(len(texts) - len(metas))]
             else:
                 metas = metas[: len(texts)]
+        # 写入时间：支持 @since/@until 时间范围过滤
+        now = int(time.time())
+        metas = [{"created_at": now, **(m or {})} for m in metas]
 
+        ids = [
+            f"m-{int(time.time()*1000)}-{uuid.uuid4().hex[:8]}-{i}"
+            for i in range(len(texts))
+        ]
+        policy = dedup or DEDUP_POLICY
+        new_pos, replaced = list(range(len(texts))), []
+        if policy != "off":
+            new_pos, replaced = self._dedup_plan(texts, metas, ids, policy)
+        if not new_pos:
+            return ids
+
+        new_ids = [ids[i] for i in new_pos]
+        new_texts = [texts[i] for i in new_pos]
+        embs = self.embedder.embed(new_texts)
         self.col.add(
-            ids=ids,
-            documents=texts,
+            ids=new_ids,
+            documents=new_texts,
             embeddings=embs,
-            metadatas=metas,
+            metadatas=[metas[i] for i in new_pos],
         )
+        self._mark(new_ids)
+        if policy != "off":
+            self.dedup_index.add(zip(new_ids, new_texts))
+        # newest：新条目写入成功后才删除被替换的旧条目（向量化失败/熔断时旧记忆保持不变）
+        if replaced:
+            self.delete(replaced)
+        self._bump()
         return ids
 
+    def _names(self, ids: List[str]) -> Dict[str, Optional[str]]:
+        got = self.col.get(ids=ids, include=["metadatas"])
+        return {_id: (meta or {}).get("name") for _id, meta in zip(got.get("ids") or [], got.get("metadatas") or [])}
+
+    def _dedup_plan(self, texts: List[str], metas: List[Dict], ids: List[str], policy: str):
+        """
+        按策略处理重复项（会就地改写 ids），返回 (仍需写入的位置, newest 策略下待删除的旧 id)
+        带 name 的条目（命名记忆）只和同名条目去重：换个名字保存同样的内容要能按新名字找到
+        """
+        index = self.dedup_index
+        batch = DedupIndex(None, index.near_bits)  # 同一批次内部的重复
+        new_pos, merges, replaced = [], {}, []
+        names: Dict[str, Optional[str]] = {}
+        for i, text in enumerate(texts):
+            name = metas[i].get("name")
+            in_batch = batch.find(text)
+            if in_batch and metas[int(in_batch[0])].get("name") == name:
+                j = int(in_batch[0])
+                ids[i] = ids[j]
+                self.last_duplicates.append((i, ids[j], in_batch[1]))
+                continue
+            batch.add([(str(i), text)])
+            skip = set(replaced)
+            while True:
+                dup = index.find(text, exclude=skip)
+                if dup is None or name is None:
+                    break
+                if dup[0] not in names:
+                    names.update(self._names([dup[0]]))
+                if names.get(dup[0]) == name:
+                    break
+                skip.add(dup[0])  # 其它名字下的同样内容：继续找同名的
+            if dup is None:
+                new_pos.append(i)
+                continue
+            dup_id, kind = dup
+            self.last_duplicates.append((i, dup_id, kind))
+            if policy == "newest":
+                replaced.append(dup_id)
+                new_pos.append(i)
+            else:
+                ids[i] = dup_id
+                if policy == "merge":
+                    merges[dup_id] = {**merges.get(dup_id, {}), **(metas[i] or {})}
+
+        if merges:
+            got = self.col.get(ids=list(merges), include=["metadatas"])
+            old = dict(zip(got.get("ids") or [], got.get("metadatas") or []))
+            upd_ids = [_id for _id in merges if _id in old]
+            if upd_ids:
+                self.col.update(
+                    ids=upd_ids,
+                    metadatas=[
+                        {**(old[_id] or {}), **merges[_id], "dup_count": int((old[_id] or {}).get("dup_count", 1)) + 1}
+                        for _id in upd_ids
+                    ],
+                )
+                self._mark(upd_ids)
+                self._bump()
+        return new_pos, replaced
+
     # ---------- 检索 ----------
-    def query(self, query_text: str, k: int = 5) -> List[Dict]:
+    def query(
+        self,
+        query_text: str,
+        k: int = 5,
+        where: Optional[Dict] = None,
+        where_document: Optional[Dict] = None,
+    ) -> List[Dict]:
         """
         语义检索：返回按相似度降序排列的结果
+        where / where_document：直接下推给 Chroma 的元数据 / 文档内容过滤（只在范围内找候选）
         字段：
         - id: 文档ID
         - text: 文档内容
         - meta: 元信息
         - score: 相似度 [0~1]（越大越相似）
         """
+        # 0) 命中缓存：版本号未变，结果必然一致
+        key = (
+            self._ns, self.version, normalize_query(query_text), k,
+            _filter_key(where), _filter_key(where_document),
+        )
+        cached = _QUERY_CACHE.get(key)
+        if cached is not None:
+            return cached
+        out = self._query_uncached(query_text, k, where, where_document)
+        _QUERY_CACHE.put(key, out)
+        return out
+
+    def query_embeddings(
+        self,
+        embeddings: List[List[float]],
+        k: int = 5,
+        where: Optional[Dict] = None,
+        where_document: Optional[Dict] = None,
+    ) -> List[List[Dict]]:
+        """
+        用已算好的向量检索（多路检索时各探针共用一次批量向量化）；返回与 embeddings 一一对应的结果列表
+        缓存 key 用向量摘要代替查询文本；未命中的向量合并成一次 col.query
+        """
+        if not embeddings:
+            return []
+        version = self.version
+        wk, wdk = _filter_key(where), _filter_key(where_document)
+        keys = [(self._ns, version, "emb:" + _embedding_digest(e), k, wk, wdk) for e in embeddings]
+        out: List[Optional[List[Dict]]] = [_QUERY_CACHE.get(key) for key in keys]
+        missing = [i for i, hit in enumerate(out) if hit is None]
+        if not missing:
+            return out
+        if self.count() == 0:
+            return [hit or [] for hit in out]
+
+        res = self.col.query(
+            query_embeddings=[embeddings[i] for i in missing],
+            n_results=max(1, k),
+            where=where or None,
+            where_document=where_document or None,
+        )
+        for row, i in enumerate(missing):
+            ids   = (res.get("ids") or [])[row]
+            docs  = (res.get("documents") or [])[row]
+            metas = (res.get("metadatas") or [])[row]
+            dists = (res.get("distances") or [])[row]
+            hits = [
+                {"id": _id, "text": doc, "meta": meta or {}, "score": float(1.0 - dist)}
+                for _id, doc, meta, dist in zip(ids, docs, metas, dists)
+            ]
+            hits.sort(key=lambda x: x["score"], reverse=True)
+            out[i] = hits
+            _QUERY_CACHE.put(keys[i], hits)
+        return out
+
+    def get(self, where: Optional[Dict] = None, where_document: Optional[Dict] = None, limit: int = 100) -> List[Dict]:
+        """
+        按过滤条件列出条目（不做向量化，不调用 API）：顺序无意义，结果不带 score
+        字段：id / text / meta
+        """
+        key = (self._ns, self.version, "get:", limit, _filter_key(where), _filter_key(where_document))
+        cached = _QUERY_CACHE.get(key)
+        if cached is not None:
+            return cached
+        out = []
+        if self.count():
+            got = self.col.get(
+                where=where or None,
+                where_document=where_document or None,
+                limit=max(1, limit),
+                include=["documents", "metadatas"],
+            ) or {}
+            out = [
+                {"id": _id, "text": doc, "meta": meta or {}}
+                for _id, doc, meta in zip(got.get("ids") or [], got.get("documents") or [], got.get("metadatas") or [])
+            ]
+        _QUERY_CACHE.put(key, out)
+        return out
+
+    def _query_uncached(
+        self, query_text: str, k: int, where: Optional[Dict], where_document: Optional[Dict]
+    ) -> List[Dict]:
         # 1) 库里没有数据
         if self.count() == 0:
             return []
 
-        # 2) ✅ 空查询：用于 list memories，直接 peek 前 k 条
+        # 2) 空查询没有相关度可言：按条件列出条目请用 get()
         if not query_text or not query_text.strip():
-            peek = self.col.peek() or {}
-            ids   = (peek.get("ids") or [])[:k]
-            docs  = (peek.get("documents") or [])[:k]
-            metas = (peek.get("metadatas") or [])[:k]
-            return [
-                {"id": _id, "text": doc, "meta": meta, "score": 1.0}
-                for _id, doc, meta in zip(ids, docs, metas)
-            ]
+            return []
 
         # 3) 正常语义检索
         q_emb = self.embedder.embed_one(query_text)
-        res = self.col.query(query_embeddings=[q_emb], n_results=max(1, k))
+        res = self.col.query(
+            query_embeddings=[q_emb],
+            n_results=max(1, k),
+            where=where or None,
+            where_document=where_document or None,
+        )
 
         ids   = (res.get("ids") or [[]])[0]
         docs  = (res.get("documents") or [[]])[0]
@@ -108,31 +619,55 @@ class VectorMemory:
 
         out = []
         for _id, doc, meta, dist in zip(ids, docs, metas, dists):
-            out.append({"id": _id, "text": doc, "meta": meta, "score": float(1.0 - dist)})
+            out.append({"id": _id, "text": doc, "meta": meta or {}, "score": float(1.0 - dist)})
 
         out.sort(key=lambda x: x["score"], reverse=True)
         return out
-    # ✅ 正常语义检索
-        q_emb = self.embedder.embed_one(query_text)
-        res = self.col.query(query_embeddings=[q_emb], n_results=max(1, k))
 
-        ids   = (res.get("ids") or [[]])[0]
-        docs  = (res.get("documents") or [[]])[0]
-        metas = (res.get("metadatas") or [[]])[0]
-        dists = (res.get("distances") or [[]])[0]  # cosine 距离
+    def source_counts(self) -> Dict[str, int]:
+        """来源 -> 块数（见 SourceIndex；用于把 @source:glob 展开成 $in 列表）"""
+        return get_source_index(self.persist_dir, self.col.name).counts(self.col, self.version)
 
-        out = []
-        for _id, doc, meta, dist in zip(ids, docs, metas, dists):
-            out.append({"id": _id, "text": doc, "meta": meta, "score": float(1.0 - dist)})
+    # ---------- 维护 ----------
+    @_locked
+    def touch(self, ids: List[str], now: Optional[int] = None) -> None:
+        """
+        记录召回：写回 last_hit_at / hit_count。
+        不递增版本号（只是使用统计，检索内容不变）；缓存结果里的旧统计由 hit_stats 覆盖。
+        """
+        ids = list(dict.fromkeys(ids or []))
+        if not ids:
+            return
+        now = int(now or time.time())
+        got = self.col.get(ids=ids, include=["metadatas"])
+        upd_ids, upd_metas = [], []
+        for _id, meta in zip(got.get("ids") or [], got.get("metadatas") or []):
+            count = int((meta or {}).get("hit_count", 0)) + 1
+            self.hit_stats[_id] = (now, count)
+            upd_ids.append(_id)
+            upd_metas.append({"last_hit_at": now, "hit_count": count})
+        if upd_ids:
+            self.col.update(ids=upd_ids, metadatas=upd_metas)
+            self._mark(upd_ids)
 
-        out.sort(key=lambda x: x["score"], reverse=True)
-        return out
+    @_locked
+    def delete(self, ids: List[str]) -> None:
+        """按 id 删除（会使该集合的检索缓存失效）"""
+        if not ids:
+            return
+        self.col.delete(ids=list(ids))
+        self._mark(ids)
+        self.deleted_count += len(ids)
+        for _id in ids:
+            self.hit_stats.pop(_id, None)
+        if self._dedup is not None or DEDUP_POLICY != "off":
+            self.dedup_index.remove(ids)
+        self._bump()
 
-    # ---------- 维护 ----------
     def count(self) -> int:
-        peek = self.col.peek() or {}
-        return len(peek.get("ids") or [])
+        return self.col.count()
 
+    @_locked
     def reset(self):
         """清空集合（不可逆）"""
         name = self.col.name
@@ -140,21 +675,104 @@ class VectorMemory:
         self.col = self.client.get_or_create_collection(
             name=name, metadata={"hnsw:space": "cosine"}
         )
+        if self._dedup is not None or DEDUP_POLICY != "off":
+            self.dedup_index.clear()
+        self.hit_stats.clear()
+        self._changes = None  # 正在进行的压缩放弃替换
+        self._bump()
+
+
+class SnapshotMemory:
+    """
+    只读集合：进程内直接在快照上检索（向量内存映射，见 snapshot.Snapshot），换机器/重建后免导入即可使用
+    检索结果同样走 QueryCache；快照不会变化，版本号取快照的导出时间
+    """
+
+    read_only = True
+
+    def __init__(self, snap_dir: str, embedder: Optional[Embedder] = None):
+        self.snapshot = Snapshot(snap_dir)
+        self.name = self.snapshot.manifest.get("collection") or os.path.basename(snap_dir.rstrip("/"))
+        self.version = int(self.snapshot.manifest.get("created_at") or 0)
+        self.embedder = embedder or Embedder()
+        self._ns = f"snapshot::{os.path.abspath(snap_dir)}"
+        self._sources: Optional[Dict[str, int]] = None
+        self.hit_stats: Dict[str, tuple] = {}
+        self.last_duplicates: List[tuple] = []
+
+    def count(self) -> int:
+        return self.snapshot.count
+
+    def query(
+        self,
+        query_text: str,
+        k: int = 5,
+        where: Optional[Dict] = None,
+        where_document: Optional[Dict] = None,
+    ) -> List[Dict]:
+        key = (
+            self._ns, self.version, normalize_query(query_text), k,
+            _filter_key(where), _filter_key(where_document),
+        )
+        cached = _QUERY_CACHE.get(key)
+        if cached is not None:
+            return cached
+        out = []
+        if self.count() and query_text and query_text.strip():
+            out = self.snapshot.search(self.embedder.embed_one(query_text), k, where, where_document)
+        _QUERY_CACHE.put(key, out)
+        return out
+
+    def query_embeddings(
+        self,
+        embeddings: List[List[float]],
+        k: int = 5,
+        where: Optional[Dict] = None,
+        where_document: Optional[Dict] = None,
+    ) -> List[List[Dict]]:
+        wk, wdk = _filter_key(where), _filter_key(where_document)
+        out = []
+        for e in embeddings:
+            key = (self._ns, self.version, "emb:" + _embedding_digest(e), k, wk, wdk)
+            hits = _QUERY_CACHE.get(key)
+            if hits is None:
+                hits = self.snapshot.search(e, k, where, where_document)
+                _QUERY_CACHE.put(key, hits)
+            out.append(hits)
+        return out
+
+    def get(self, where: Optional[Dict] = None, where_document: Optional[Dict] = None, limit: int = 100) -> List[Dict]:
+        key = (self._ns, self.version, "get:", limit, _filter_key(where), _filter_key(where_document))
+        cached = _QUERY_CACHE.get(key)
+        if cached is not None:
+            return cached
+        out = self.snapshot.get(where, where_document, limit)
+        _QUERY_CACHE.put(key, out)
+        return out
+
+    def source_counts(self) -> Dict[str, int]:
+        if self._sources is None:
+            self._sources = self.snapshot.source_counts()
+        return self._sources
 
 
 class ChatMemory:
     """
     简单短期记忆：保存最近 N 轮对话（user/assistant 各算一条）
     用于 main.py 里的 memory.add(...) / memory.get()
+
+    trim_slack：允许超出上限的消息条数。超出 max_turns*2 + trim_slack 时才一次性裁回 max_turns*2，
+    这样历史开头不会每轮都移动，服务端的 prompt 前缀缓存能连续命中多轮。
     """
-    def __init__(self, max_turns: int = 10):
+    def __init__(self, max_turns: int = 10, trim_slack: int = 0):
         self.max_turns = max_turns
+        self.trim_slack = trim_slack
         self.turns: List[Dict] = []
 
     def add(self, role: str, content: str):
         self.turns.append({"role": role, "content": content})
         
-        if len(self.turns) > self.max_turns * 2:
+        if len(self.turns) > self.max_turns * 2 + self.trim_slack:
             self.turns = self.turns[-self.max_turns * 2:]
     
     # 在 ChatMemory 内部添加
@@ -0,0 +1,321 @@
+"""
+本地 OpenAI 兼容 mock（只用标准库，不读取 config / .env）：压测时替代真实 API
+- POST /v1/embeddings        确定性向量：字符 1-gram/2-gram 哈希到 dim 维后归一化（相似文本向量相近，RAG 行为可复现）
+- POST /v1/chat/completions  确定性回答；支持 stream=true（SSE，逐块发送）
+- GET  /_mock/stats          各接口请求数、注入的故障数
+
+延迟分布（毫秒）：fixed:200 / uniform:50,300 / normal:200,50 / lognormal:200,0.4（中位数, sigma）/ exp:200
+故障注入（按请求概率），类别与 main.py 的 testerr 一致：
+    rate    429 rate_limit_exceeded（带 retry-after-ms）
+    quota   429 insufficient_quota
+    auth    401 invalid_api_key
+    model   404 model_not_found
+    server  500 服务端错误
+    timeout 挂起 --hang 秒后断开（应大于客户端的 OPENAI_TIMEOUT）
+    network 不回任何内容直接断开连接
+    parse   200 但 choices / data 为空
+
+用法：
+    python -m src.src.mock_openai --port 8000 --chat-latency lognormal:400,0.4 --faults rate=0.05,timeout=0.01
+    OPENAI_BASE_URL=http://127.0.0.1:8000/v1 OPENAI_API_KEY=mock python -m src.src.main
+"""
+
+import os
+import re
+import json
+import math
+import time
+import random
+import socket
+import hashlib
+import argparse
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional
+
+FAULT_KINDS = ("rate", "quota", "auth", "model", "server", "timeout", "network", "parse")
+
+_ERRORS = {
+    "rate": (429, "rate_limit_exceeded", "requests", "Rate limit reached for requests. Please retry after 200ms."),
+    "quota": (429, "insufficient_quota", "insufficient_quota", "You exceeded your current quota."),
+    "auth": (401, "invalid_api_key", "invalid_request_error", "Incorrect API key provided."),
+    "model": (404, "model_not_found", "invalid_request_error", "The model does not exist."),
+    "server": (500, "server_error", "server_error", "The server had an error while processing your request."),
+}
+
+
+# ---------- 配置解析 ----------
+def parse_latency(spec: str) -> Callable[[], float]:
+    """'lognormal:400,0.4' -> 每次调用返回一个延迟（秒）"""
+    kind, _, args = (spec or "fixed:0").partition(":")
+    vals = [float(x) for x in args.split(",") if x.strip()] or [0.0]
+    kind = kind.strip().lower()
+    if kind == "fixed":
+        return lambda: vals[0] / 1000
+    if kind == "uniform":
+        lo, hi = vals[0], vals[1] if len(vals) > 1 else vals[0]
+        return lambda: random.uniform(lo, hi) / 1000
+    if kind == "normal":
+        mu, sd = vals[0], vals[1] if len(vals) > 1 else vals[0] / 4
+        return lambda: max(0.0, random.gauss(mu, sd)) / 1000
+    if kind == "lognormal":
+        median, sigma = vals[0], vals[1] if len(vals) > 1 else 0.4
+        mu = math.log(max(median, 1e-3))
+        return lambda: random.lognormvariate(mu, sigma) / 1000
+    if kind == "exp":
+        mean = max(vals[0], 1e-3)
+        return lambda: random.expovariate(1.0 / mean) / 1000
+    raise ValueError(f"不支持的延迟分布：{spec}（fixed/uniform/normal/lognormal/exp）")
+
+
+def parse_faults(spec: str) -> Dict[str, float]:
+    """'rate=0.05,timeout=0.01' -> {"rate": 0.05, "timeout": 0.01}"""
+    faults = {}
+    for part in (spec or "").split(","):
+        if not part.strip():
+            continue
+        kind, _, p = part.partition("=")
+        kind = kind.strip().lower()
+        if kind not in FAULT_KINDS:
+            raise ValueError(f"不支持的故障类别：{kind}（可选：{'/'.join(FAULT_KINDS)}）")
+        faults[kind] = float(p or 0)
+    if sum(faults.values()) > 1:
+        raise ValueError("故障概率之和不能超过 1")
+    return faults
+
+
+# ---------- 确定性内容 ----------
+def fake_embedding(text: str, dim: int) -> List[float]:
+    t = "".join((text or "").lower().split())
+    vec = [0.0] * dim
+    grams = list(t) + [t[i:i + 2] for i in range(len(t) - 1)]
+    for g in grams or [""]:
+        h = int.from_bytes(hashlib.blake2b(g.encode("utf-8"), digest_size=8).digest(), "big")
+        vec[h % dim] += 1.0 if (h >> 32) & 1 else -1.0
+    norm = math.sqrt(sum(v * v for v in vec)) or 1.0
+    return [v / norm for v in vec]
+
+
+def _approx_tokens(text: str) -> int:
+    # 粗略估算：中文约 1 字 1 token，其它约 4 字符 1 token
+    cjk = len(re.findall(r"[一-鿿]", text))
+    return max(1, cjk + (len(text) - cjk) // 4)
+
+
+def fake_reply(messages: List[Dict], reply_tokens: int) -> str:
+    last = next((m.get("content") or "" for m in reversed(messages) if m.get("role") == "user"), "")
+    head = f"（mock 回答）关于「{' '.join(str(last).split())[:30]}」："
+    filler = "这是用于压测的确定性回复内容。"
+    body = (filler * (reply_tokens // len(filler) + 1))[: max(0, reply_tokens - len(head))]
+    return head + body
+
+
+# ---------- 服务 ----------
+class MockState:
+    def __init__(self, args):
+        self.chat_latency = parse_latency(args.chat_latency)
+        self.embed_latency = parse_latency(args.embed_latency)
+        self.faults = parse_faults(args.faults)
+        self.dim = args.dim
+        self.reply_tokens = args.reply_tokens
+        self.stream_chunk = args.stream_chunk
+        self.stream_delay = args.stream_delay_ms / 1000
+        self.hang = args.hang
+        self.lock = threading.Lock()
+        self.requests: Counter = Counter()
+        self.injected: Counter = Counter()
+
+    def pick_fault(self) -> Optional[str]:
+        r = random.random()
+        for kind, p in self.faults.items():
+            if r < p:
+                return kind
+            r -= p
+        return None
+
+    def stats(self) -> Dict:
+        with self.lock:
+            return {"requests": dict(self.requests), "faults": dict(self.injected)}
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive：与客户端连接池的真实行为一致
+    state: MockState = None
+
+    def log_message(self, fmt, *args):
+        pass  # 压测时不刷屏
+
+    # ---- 输出 ----
+    def _send_json(self, status: int, payload: Dict, headers: Optional[Dict] = None):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error(self, kind: str):
+        status, code, etype, message = _ERRORS[kind]
+        headers = {"retry-after-ms": "200"} if kind == "rate" else None
+        self._send_json(status, {"error": {"message": message, "type": etype, "code": code, "param": None}}, headers)
+
+    def _drop(self):
+        self.close_connection = True
+        try:
+            self.connection.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    # ---- 路由 ----
+    def do_GET(self):
+        if self.path.rstrip("/") == "/_mock/stats":
+            self._send_json(200, self.state.stats())
+        else:
+            self._send_json(404, {"error": {"message": "not found", "type": "invalid_request_error", "code": None}})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            req = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            return self._send_json(400, {"error": {"message": "invalid json", "type": "invalid_request_error"}})
+        path = self.path.split("?", 1)[0].rstrip("/")
+        if path.endswith("/embeddings"):
+            endpoint, latency = "embeddings", self.state.embed_latency
+        elif path.endswith("/chat/completions"):
+            endpoint, latency = "chat", self.state.chat_latency
+        else:
+            return self._send_json(404, {"error": {"message": f"unknown path {path}", "type": "invalid_request_error"}})
+
+        fault = self.state.pick_fault()
+        with self.state.lock:
+            self.state.requests[endpoint] += 1
+            if fault:
+                self.state.injected[fault] += 1
+        if fault == "network":
+            return self._drop()
+        if fault == "timeout":
+            time.sleep(self.state.hang)
+            return self._drop()
+        time.sleep(latency())
+        if fault in _ERRORS:
+            return self._send_error(fault)
+
+        if endpoint == "embeddings":
+            return self._embeddings(req, empty=(fault == "parse"))
+        if req.get("stream"):
+            return self._chat_stream(req)
+        return self._chat(req, empty=(fault == "parse"))
+
+    def _embeddings(self, req: Dict, empty: bool = False):
+        inputs = req.get("input")
+        inputs = [inputs] if isinstance(inputs, str) else list(inputs or [])
+        dim = int(req.get("dimensions") or self.state.dim)
+        data = [] if empty else [
+            {"object": "embedding", "index": i, "embedding": fake_embedding(str(t), dim)}
+            for i, t in enumerate(inputs)
+        ]
+        tokens = sum(_approx_tokens(str(t)) for t in inputs)
+        self._send_json(200, {
+            "object": "list", "data": data, "model": req.get("model", "mock-embedding"),
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        })
+
+    def _usage(self, req: Dict, reply: str) -> Dict:
+        prompt = sum(_approx_tokens(str(m.get("content") or "")) for m in req.get("messages") or [])
+        completion = _approx_tokens(reply)
+        return {
+            "prompt_tokens": prompt, "completion_tokens": completion, "total_tokens": prompt + completion,
+            "prompt_tokens_details": {"cached_tokens": 0},
+        }
+
+    def _chat(self, req: Dict, empty: bool = False):
+        reply = fake_reply(req.get("messages") or [], self.state.reply_tokens)
+        choices = [] if empty else [{
+            "index": 0, "finish_reason": "stop",
+            "message": {"role": "assistant", "content": reply},
+        }]
+        self._send_json(200, {
+            "id": f"chatcmpl-mock-{random.getrandbits(48):012x}", "object": "chat.completion",
+            "created": int(time.time()), "model": req.get("model", "mock-chat"),
+            "choices": choices, "usage": self._usage(req, reply),
+        })
+
+    def _chat_stream(self, req: Dict):
+        reply = fake_reply(req.get("messages") or [], self.state.reply_tokens)
+        base = {"id": f"chatcmpl-mock-{random.getrandbits(48):012x}", "object": "chat.completion.chunk",
+                "created": int(time.time()), "model": req.get("model", "mock-chat")}
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")  # 不带长度的流：发完即关闭连接
+        self.end_headers()
+        self.close_connection = True
+
+        def emit(delta: Dict, finish: Optional[str] = None, usage: Optional[Dict] = None):
+            chunk = dict(base, choices=[{"index": 0, "delta": delta, "finish_reason": finish}])
+            if usage is not None:
+                chunk["usage"] = usage
+            self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        try:
+            emit({"role": "assistant", "content": ""})
+            step = max(1, self.state.stream_chunk)
+            for i in range(0, len(reply), step):
+                time.sleep(self.state.stream_delay)
+                emit({"content": reply[i:i + step]})
+            include_usage = (req.get("stream_options") or {}).get("include_usage")
+            emit({}, finish="stop", usage=self._usage(req, reply) if include_usage else None)
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # 客户端中途放弃
+
+
+def build_parser() -> argparse.ArgumentParser:
+    ap = argparse.ArgumentParser(description="本地 OpenAI 兼容 mock（压测用）")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8000, help="0 = 随机空闲端口")
+    ap.add_argument("--chat-latency", default="lognormal:400,0.4", help="补全接口延迟分布（毫秒）")
+    ap.add_argument("--embed-latency", default="lognormal:60,0.3", help="向量接口延迟分布（毫秒）")
+    ap.add_argument("--faults", default="", help="故障注入概率，例如 rate=0.05,timeout=0.01")
+    ap.add_argument("--hang", type=float, default=float(os.getenv("OPENAI_TIMEOUT", "60")) + 5,
+                    help="timeout 故障挂起秒数（默认 OPENAI_TIMEOUT + 5）")
+    ap.add_argument("--dim", type=int, default=256, help="向量维度")
+    ap.add_argument("--reply-tokens", type=int, default=80, help="回答长度（约等于 token 数）")
+    ap.add_argument("--stream-chunk", type=int, default=4, help="流式输出每块字符数")
+    ap.add_argument("--stream-delay-ms", type=float, default=20, help="流式输出块间隔")
+    return ap
+
+
+def start_server(args) -> ThreadingHTTPServer:
+    """后台线程启动 mock；返回 server（server.server_address 为实际地址，server.mock 为状态）"""
+    state = MockState(args)
+    handler = type("Handler", (MockHandler,), {"state": state})
+    server = ThreadingHTTPServer((args.host, args.port), handler)
+    server.daemon_threads = True
+    server.mock = state
+    threading.Thread(target=server.serve_forever, name="mock-openai", daemon=True).start()
+    return server
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    server = start_server(args)
+    host, port = server.server_address[:2]
+    print(f"🧪 mock OpenAI 已启动：http://{host}:{port}/v1")
+    print(f"   chat={args.chat_latency} embed={args.embed_latency} faults={args.faults or '无'}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        print("\n📊", json.dumps(server.mock.stats(), ensure_ascii=False))
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+OpenAI 客户端工厂：
+- 全进程共享一个 OpenAI 客户端（共享 HTTP 连接池，避免每次请求重新 TLS 握手）
+- 支持 HTTP/2（安装 h2 时自动启用）、keep-alive、连接池大小
+- 支持按调用覆盖超时：get_client(timeout=10)
+- 支持 base_url 覆盖（OPENAI_BASE_URL），方便指向本地 mock 做压测
+
+用法：
+    from .openai_client import get_client
+    client = get_client()                 # 默认超时
+    client = get_client(timeout=5.0)      # 本次调用单独的超时（仍共享连接池）
+"""
+
+import threading
+from typing import Optional
+
+import httpx
+from openai import OpenAI
+
+from .config import (
+    OPENAI_API_KEY,
+    OPENAI_BASE_URL,
+    OPENAI_TIMEOUT,
+    OPENAI_CONNECT_TIMEOUT,
+    OPENAI_MAX_CONNECTIONS,
+    OPENAI_MAX_KEEPALIVE,
+    OPENAI_KEEPALIVE_EXPIRY,
+    OPENAI_HTTP2,
+)
+
+_lock = threading.Lock()
+_client: Optional[OpenAI] = None
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401  pip install h2（httpx[http2]）
+    except Exception:
+        return False
+    return True
+
+
+def _build_timeout(total: float) -> httpx.Timeout:
+    return httpx.Timeout(total, connect=min(OPENAI_CONNECT_TIMEOUT, total))
+
+
+def _build_http_client() -> httpx.Client:
+    limits = httpx.Limits(
+        max_connections=OPENAI_MAX_CONNECTIONS,
+        max_keepalive_connections=OPENAI_MAX_KEEPALIVE,
+        keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY,
+    )
+    return httpx.Client(
+        limits=limits,
+        timeout=_build_timeout(OPENAI_TIMEOUT),
+        http2=OPENAI_HTTP2 and _http2_available(),
+        follow_redirects=True,
+    )
+
+
+def get_client(timeout: Optional[float] = None) -> OpenAI:
+    """
+    返回共享的 OpenAI 客户端。
+    timeout 不为空时返回 with_options 派生的客户端：超时不同，但连接池仍是同一个。
+    """
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                _client = OpenAI(
+                    api_key=OPENAI_API_KEY,
+                    base_url=OPENAI_BASE_URL,
+                    http_client=_build_http_client(),
+                    # 重试/熔断交给 resilience.py 统一处理，避免 SDK 内部重试叠加
+                    max_retries=0,
+                )
+    if timeout is not None:
+        return _client.with_options(timeout=_build_timeout(timeout))
+    return _client
+
+
+def close_client() -> None:
+    """关闭共享连接池（进程退出或测试结束时调用）"""
+    global _client
+    with _lock:
+        if _client is not None:
+            _client.close()
+            _client = None
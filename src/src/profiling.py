@@ -0,0 +1,270 @@
+"""
+性能剖析钩子：按轮 cProfile / 轮间 tracemalloc 对比 / 采样火焰图（默认全部关闭）
+- cProfile：每轮（ingest 为整次运行或每次同步）写一个 .pstats，可用 python -m pstats 或 snakeviz 查看
+  只剖析调用线程；同时只剖析一轮（并发会话时其余轮次跳过）
+- tracemalloc：每轮结束拍快照并与上一轮对比，打印增长最多的分配位置（排查 ChatMemory / Chroma 客户端的内存增长）
+- 采样：后台线程按固定频率抓取所有线程的调用栈，累计为 collapsed stacks（flamegraph.pl / speedscope 可直接读取），
+  覆盖线程池里的检索/向量化，这是 cProfile 看不到的部分
+- 全部关闭时 turn() 直接返回一个共享的空上下文，不产生任何额外开销
+
+环境变量（见 config.py）：
+    PROFILE=1  PROFILE_TRACEMALLOC=25  PROFILE_SAMPLE_HZ=100  PROFILE_DIR=.profiles
+
+用法：
+    profiler = get_profiler("chat")
+    with profiler.turn():
+        ...
+    profiler.close()  # 写出采样结果
+"""
+
+import io
+import os
+import sys
+import time
+import pstats
+import cProfile
+import threading
+import contextlib
+import tracemalloc
+from collections import Counter
+from typing import Optional
+
+from .config import PROFILE, PROFILE_DIR, PROFILE_TRACEMALLOC, PROFILE_SAMPLE_HZ, PROFILE_TOP
+
+_NULL = contextlib.nullcontext()
+
+# 剖析工具自身（tracemalloc / cProfile / 采样计数）与导入机制的分配不计入对比
+_TRACE_FILTERS = [
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, cProfile.__file__),
+    tracemalloc.Filter(False, __file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+]
+
+
+def _fmt_bytes(n: float) -> str:
+    sign = "-" if n < 0 else ""
+    n = abs(n)
+    for unit in ("B", "KB", "MB"):
+        if n < 1024:
+            return f"{sign}{n:.0f} {unit}" if unit == "B" else f"{sign}{n:.1f} {unit}"
+        n /= 1024
+    return f"{sign}{n:.1f} GB"
+
+
+# ---------- 采样 ----------
+class StackSampler:
+    """后台线程按 hz 抓取所有线程的调用栈，按“线程;根帧;…;叶帧”累计次数"""
+
+    def __init__(self, hz: float):
+        self.interval = 1.0 / max(1.0, hz)
+        self.counts: Counter = Counter()
+        self.samples = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            batch = []
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                batch.append(";".join(reversed(stack)))
+            with self._lock:
+                self.counts.update(batch)
+                self.samples += 1
+
+    def dump(self, path: str) -> int:
+        """写出 collapsed stacks（每行“栈 次数”）并清空计数，返回写出的行数"""
+        with self._lock:
+            counts, self.counts = self.counts, Counter()
+        if not counts:
+            return 0
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, n in counts.most_common():
+                f.write(f"{stack} {n}\n")
+        return len(counts)
+
+
+# ---------- 剖析器 ----------
+class Profiler:
+    def __init__(
+        self,
+        name: str = "chat",
+        out_dir: str = PROFILE_DIR,
+        cprofile: bool = PROFILE,
+        trace_frames: int = PROFILE_TRACEMALLOC,
+        sample_hz: float = PROFILE_SAMPLE_HZ,
+        top: int = PROFILE_TOP,
+    ):
+        self.name = name
+        self.out_dir = out_dir
+        self.top = top
+        self.cprofile = cprofile
+        self.trace_frames = 0
+        self.sampler: Optional[StackSampler] = None
+        self.turns = 0
+        self.last_pstats = ""      # 最近一次写出的 .pstats
+        self.last_mem_diff = ""    # 最近一次的内存对比报告
+        self._snapshot = None
+        self._started_tracing = False  # tracemalloc 是否由本剖析器开启（只停自己开的）
+        self._busy = threading.Lock()  # cProfile 同一时间只能有一个在跑
+        self._lock = threading.Lock()  # 保护轮次计数与快照交换（并发会话同时结束一轮）
+        if trace_frames:
+            self.start_tracemalloc(trace_frames)
+        if sample_hz:
+            self.start_sampling(sample_hz)
+
+    @property
+    def active(self) -> bool:
+        return self.cprofile or bool(self.trace_frames)
+
+    def _path(self, suffix: str) -> str:
+        os.makedirs(self.out_dir, exist_ok=True)
+        return os.path.join(self.out_dir, f"{self.name}-{time.strftime('%Y%m%d-%H%M%S')}-{self.turns:04d}{suffix}")
+
+    # ---- 开关 ----
+    def start_tracemalloc(self, frames: int = 25):
+        self.trace_frames = max(1, frames)
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.trace_frames)
+            self._started_tracing = True
+        self._snapshot = tracemalloc.take_snapshot().filter_traces(_TRACE_FILTERS)
+
+    def stop_tracemalloc(self):
+        self.trace_frames = 0
+        self._snapshot = None
+        if self._started_tracing:
+            self._started_tracing = False
+            if tracemalloc.is_tracing():
+                tracemalloc.stop()
+
+    def start_sampling(self, hz: float = 100.0):
+        if self.sampler is None:
+            self.sampler = StackSampler(hz)
+        self.sampler.start()
+
+    def stop_sampling(self) -> Optional[str]:
+        """停止采样并写出 .collapsed，返回文件路径（没有样本时为 None）"""
+        if self.sampler is None:
+            return None
+        self.sampler.stop()
+        path = self._path(".collapsed")
+        if not self.sampler.dump(path):
+            return None
+        print(f"🔥 采样栈已保存：{path}（flamegraph.pl {path} > flame.svg）")
+        return path
+
+    # ---- 每轮 ----
+    def turn(self, label: str = "turn"):
+        """包住一轮处理；全部关闭时返回共享的空上下文"""
+        if not self.active:
+            return _NULL
+        return self._turn(label)
+
+    @contextlib.contextmanager
+    def _turn(self, label: str):
+        prof = None
+        if self.cprofile and self._busy.acquire(blocking=False):
+            prof = cProfile.Profile()
+            prof.enable()
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            secs = time.perf_counter() - t0
+            with self._lock:
+                self.turns += 1
+            if prof is not None:
+                prof.disable()
+                self._busy.release()
+                self.last_pstats = self._path(f"-{label}.pstats")
+                prof.dump_stats(self.last_pstats)
+                print(f"🔬 {label} 用时 {secs:.2f}s，剖析已保存：{self.last_pstats}")
+            if self.trace_frames:
+                self.last_mem_diff = self.memory_diff()
+                print(self.last_mem_diff)
+
+    def memory_diff(self) -> str:
+        """与上一次快照对比，返回增长最多的分配位置"""
+        snap = tracemalloc.take_snapshot().filter_traces(_TRACE_FILTERS)
+        with self._lock:
+            prev, self._snapshot = self._snapshot, snap
+        current, peak = tracemalloc.get_traced_memory()
+        if prev is None:
+            return f"🧠 内存：当前 {_fmt_bytes(current)}，峰值 {_fmt_bytes(peak)}（首个快照）"
+        stats = snap.compare_to(prev, "lineno")
+        delta = sum(s.size_diff for s in stats)
+        lines = [f"🧠 内存：当前 {_fmt_bytes(current)}，峰值 {_fmt_bytes(peak)}，较上一轮 {_fmt_bytes(delta)}"]
+        for s in [s for s in stats if s.size_diff > 0][: self.top]:
+            frame = s.traceback[0]
+            lines.append(f"  {_fmt_bytes(s.size_diff):>10}  {s.count_diff:+6d} 块  {frame.filename}:{frame.lineno}")
+        return "\n".join(lines)
+
+    def pstats_text(self, path: Optional[str] = None, sort: str = "cumulative") -> str:
+        """最近一次（或指定）.pstats 的前 top 个函数"""
+        path = path or self.last_pstats
+        if not path:
+            return "（还没有剖析结果：profile on 后对话一轮）"
+        buf = io.StringIO()
+        pstats.Stats(path, stream=buf).strip_dirs().sort_stats(sort).print_stats(self.top)
+        return f"📄 {path}\n" + buf.getvalue().strip()
+
+    def stats_text(self) -> str:
+        sampling = self.sampler is not None and self.sampler.running
+        lines = [
+            f"cProfile：{'开启' if self.cprofile else '关闭'}；"
+            f"tracemalloc：{f'开启（栈深 {self.trace_frames}）' if self.trace_frames else '关闭'}；"
+            f"采样：{f'开启（{self.sampler.samples} 次）' if sampling else '关闭'}；"
+            f"输出目录 {self.out_dir}",
+        ]
+        if self.last_pstats:
+            lines.append(self.pstats_text())
+        if self.last_mem_diff:
+            lines.append(self.last_mem_diff)
+        return "\n".join(lines)
+
+    def close(self):
+        self.stop_sampling()
+        if self.trace_frames:
+            self.stop_tracemalloc()
+
+
+_PROFILER: Optional[Profiler] = None
+_PROFILER_LOCK = threading.Lock()
+
+
+def get_profiler(name: str = "chat") -> Profiler:
+    """进程内共享的剖析器（首次调用时按环境变量初始化；name 决定输出文件前缀）"""
+    global _PROFILER
+    with _PROFILER_LOCK:
+        if _PROFILER is None:
+            _PROFILER = Profiler(name=name)
+        return _PROFILER
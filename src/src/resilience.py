@@ -0,0 +1,300 @@
+"""
+OpenAI 调用的弹性层（补全 + 向量化共用）：
+- classify_openai_error / classify_error：把异常归类为 quota/auth/model/network/rate/timeout/server/unknown
+- CircuitBreaker：按错误类别计数的熔断器；打开后直接抛 CircuitOpenError，快速失败
+- backoff_delay：带抖动的指数退避，优先遵循服务端 Retry-After
+- hedged_call：可选的对冲请求——超过 p95 延迟仍未返回就再发一份，谁先成功用谁
+- ResilientCaller：把以上组合起来；chat_guard / embed_guard 为全进程共享实例
+
+用法：
+    resp = chat_guard.call(lambda: client.chat.completions.create(...))
+"""
+
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from email.utils import parsedate_to_datetime
+from typing import Callable, Dict, Optional
+
+from .config import (
+    OPENAI_MAX_TRIES,
+    OPENAI_BACKOFF_BASE,
+    OPENAI_BACKOFF_CAP,
+    OPENAI_BREAKER_COOLDOWN,
+    OPENAI_HEDGE,
+    OPENAI_HEDGE_MIN_SAMPLES,
+)
+
+# 可重试的错误类别（其余类别直接失败）
+RETRYABLE_KINDS = ("rate", "timeout", "network", "server")
+
+# 连续失败多少次后熔断（未列出的类别不计入熔断）
+BREAKER_THRESHOLDS: Dict[str, int] = {
+    "quota": 1, "auth": 1, "model": 1,
+    "rate": 5, "timeout": 3, "network": 3, "server": 3,
+}
+# 不可恢复类错误（额度/鉴权/模型）熔断更久，避免每轮都白白请求一次
+BREAKER_COOLDOWN_FACTOR: Dict[str, float] = {"quota": 15, "auth": 15, "model": 15}
+
+
+# ---------- 错误分类 ----------
+def classify_openai_error(text: str) -> str:
+    """只有错误文本时的兜底分类（优先用 classify_error，它先看状态码和错误码）"""
+    t = (text or "").lower()
+    if "insufficient_quota" in t:
+        return "quota"
+    if "invalid_api_key" in t or "authentication" in t or "unauthorized" in t:
+        return "auth"
+    if "model_not_found" in t:
+        return "model"
+    if "timeout" in t or "timed out" in t:
+        return "timeout"
+    if "connection" in t or "dns" in t or "resolve host" in t:
+        return "network"
+    if "ratelimit" in t or "rate limit" in t or "rate_limit" in t:
+        return "rate"
+    if "internalserver" in t or "overloaded" in t or "unavailable" in t:
+        return "server"
+    return "unknown"
+
+
+def classify_error(e: BaseException) -> str:
+    """
+    按 OpenAI SDK 异常上的 code / status_code 分类；没有状态码的（APITimeoutError / APIConnectionError）
+    再带上异常类名按文本兜底
+    """
+    code = getattr(e, "code", None)
+    status = getattr(e, "status_code", None)
+    if code == "insufficient_quota":
+        return "quota"
+    if code == "invalid_api_key" or status in (401, 403):
+        return "auth"
+    if code == "model_not_found":
+        return "model"
+    if isinstance(status, int):
+        if status == 429:
+            return "rate"
+        if status == 408:
+            return "timeout"
+        if status >= 500:
+            return "server"
+        return "unknown"
+    return classify_openai_error(f"{e.__class__.__name__}: {e}")
+
+
+def retry_after_seconds(e: BaseException) -> Optional[float]:
+    """读取响应头里的 retry-after-ms / retry-after（秒数或 HTTP 日期）"""
+    headers = getattr(getattr(e, "response", None), "headers", None)
+    if not headers:
+        return None
+    try:
+        ms = headers.get("retry-after-ms")
+        if ms:
+            return max(0.0, float(ms) / 1000.0)
+        ra = headers.get("retry-after")
+        if not ra:
+            return None
+        try:
+            return max(0.0, float(ra))
+        except ValueError:
+            return max(0.0, parsedate_to_datetime(ra).timestamp() - time.time())
+    except Exception:
+        return None
+
+
+def backoff_delay(
+    attempt: int,
+    retry_after: Optional[float] = None,
+    base: float = OPENAI_BACKOFF_BASE,
+    cap: float = OPENAI_BACKOFF_CAP,
+) -> float:
+    """第 attempt 次失败后的等待秒数：有 Retry-After 就听服务端的，否则指数退避 + 抖动"""
+    if retry_after is not None:
+        return min(cap, retry_after) + random.uniform(0, base)
+    d = min(cap, base * (2 ** (attempt - 1)))
+    return d / 2 + random.uniform(0, d / 2)
+
+
+# ---------- 熔断器 ----------
+class CircuitOpenError(RuntimeError):
+    """熔断器打开时抛出：kind=触发熔断的错误类别，remaining=剩余冷却秒数"""
+
+    def __init__(self, name: str, kind: str, remaining: float):
+        super().__init__(f"{name} 熔断中（{kind}），{remaining:.0f}s 后再试")
+        self.name = name
+        self.kind = kind
+        self.remaining = remaining
+
+
+class CircuitBreaker:
+    """
+    closed -> open（某类错误连续失败达到阈值）-> half-open（冷却结束，放行一个探测请求）
+    探测成功则 closed，失败则重新 open。
+    """
+
+    def __init__(self, name: str, cooldown: float = OPENAI_BREAKER_COOLDOWN):
+        self.name = name
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._failures: Dict[str, int] = {}
+        self._open_kind: Optional[str] = None
+        self._open_until = 0.0
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._open_kind is None:
+                return "closed"
+            return "open" if time.time() < self._open_until else "half-open"
+
+    def before_call(self) -> bool:
+        """调用前检查；熔断中则抛 CircuitOpenError。返回 True 表示本次调用是半开状态下的探测请求"""
+        with self._lock:
+            if self._open_kind is None:
+                return False
+            now = time.time()
+            if now < self._open_until:
+                raise CircuitOpenError(self.name, self._open_kind, self._open_until - now)
+            if self._probing:  # 半开状态下只放行一个探测请求
+                raise CircuitOpenError(self.name, self._open_kind, 0.0)
+            self._probing = True
+            return True
+
+    def end_probe(self) -> None:
+        """探测请求结束（含被 KeyboardInterrupt 等打断、没有记下成败的情况）：允许下一个探测"""
+        with self._lock:
+            self._probing = False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures.clear()
+            self._open_kind = None
+            self._probing = False
+
+    def record_failure(self, kind: str) -> None:
+        threshold = BREAKER_THRESHOLDS.get(kind)
+        with self._lock:
+            self._probing = False
+            if threshold is None:
+                return
+            n = self._failures.get(kind, 0) + 1
+            self._failures[kind] = n
+            if n >= threshold or self._open_kind is not None:
+                self._open_kind = kind
+                self._open_until = time.time() + self.cooldown * BREAKER_COOLDOWN_FACTOR.get(kind, 1)
+
+
+# ---------- 对冲请求 ----------
+class LatencyTracker:
+    """最近 N 次成功调用的耗时，用于估计 p95"""
+
+    def __init__(self, maxlen: int = 200):
+        self._samples = deque(maxlen=maxlen)
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def percentile(self, q: float) -> Optional[float]:
+        with self._lock:
+            data = sorted(self._samples)
+        if not data:
+            return None
+        idx = min(len(data) - 1, int(round(q * (len(data) - 1))))
+        return data[idx]
+
+
+_hedge_pool: Optional[ThreadPoolExecutor] = None
+_hedge_lock = threading.Lock()
+
+
+def _get_hedge_pool() -> ThreadPoolExecutor:
+    global _hedge_pool
+    if _hedge_pool is None:
+        with _hedge_lock:
+            if _hedge_pool is None:
+                _hedge_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="hedge")
+    return _hedge_pool
+
+
+def hedged_call(fn: Callable, delay: float):
+    """先发一份；delay 秒内没返回就再发一份，取先成功的那个（两份都失败则抛最后的异常）"""
+    pool = _get_hedge_pool()
+    pending = {pool.submit(fn)}
+    done, pending = wait(pending, timeout=delay)
+    if not done:
+        pending.add(pool.submit(fn))
+    last_exc: Optional[BaseException] = None
+    while True:
+        for f in done:
+            if f.exception() is None:
+                return f.result()
+            last_exc = f.exception()
+        if not pending:
+            raise last_exc
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+
+
+# ---------- 组合 ----------
+class ResilientCaller:
+    def __init__(self, name: str, hedge: bool = False, max_tries: int = OPENAI_MAX_TRIES):
+        self.name = name
+        self.hedge = hedge
+        self.max_tries = max_tries
+        self.breaker = CircuitBreaker(name)
+        self.latency = LatencyTracker()
+
+    def hedge_delay(self) -> Optional[float]:
+        if len(self.latency) < OPENAI_HEDGE_MIN_SAMPLES:
+            return None  # 样本不足时不对冲，避免无谓的重复请求
+        return self.latency.percentile(0.95)
+
+    def call(
+        self,
+        fn: Callable,
+        max_tries: Optional[int] = None,
+        hedge: Optional[bool] = None,
+        on_retry: Optional[Callable[[str, float, BaseException], None]] = None,
+    ):
+        """
+        执行 fn()；可重试错误按退避重试，熔断打开时抛 CircuitOpenError，
+        其它错误原样抛出（由调用方决定如何提示）。
+        on_retry(kind, delay, exc)：每次重试前回调，用于打印提示。
+        """
+        tries = max_tries or self.max_tries
+        use_hedge = self.hedge if hedge is None else hedge
+        for attempt in range(1, tries + 1):
+            probe = self.breaker.before_call()
+            delay = self.hedge_delay() if use_hedge else None
+            t0 = time.perf_counter()
+            try:
+                result = hedged_call(fn, delay) if delay else fn()
+            except Exception as e:
+                kind = classify_error(e)
+                self.breaker.record_failure(kind)
+                if kind not in RETRYABLE_KINDS or attempt >= tries:
+                    raise
+                err = e  # except 块结束时 e 会被删除，重试提示要用
+                wait_s = backoff_delay(attempt, retry_after_seconds(e))
+            else:
+                self.latency.add(time.perf_counter() - t0)
+                self.breaker.record_success()
+                return result
+            finally:
+                if probe:
+                    self.breaker.end_probe()
+            if on_retry:
+                on_retry(kind, wait_s, err)
+            time.sleep(wait_s)
+
+
+# 全进程共享：补全与向量化各自独立熔断
+chat_guard = ResilientCaller("chat", hedge=OPENAI_HEDGE)
+embed_guard = ResilientCaller("embeddings", hedge=OPENAI_HEDGE)
@@ -0,0 +1,121 @@
+"""
+检索门控：在 query_all 前用本地规则判断本轮是否真的需要 RAG
+- skip ：寒暄/致谢/纯标点等，不检索
+- reuse：“继续”“展开说说”等追问，直接复用上一轮的命中
+- full ：其它情况，正常三库检索
+
+统计：各决策次数、按完整检索平均耗时估算的节省时间、
+以及“完整检索结果与上一轮完全相同”（本可复用）的次数。
+"""
+
+import re
+import time
+from typing import Callable, List, Optional, Tuple
+
+SKIP = "skip"
+REUSE = "reuse"
+FULL = "full"
+
+# 纯寒暄/客套：整句匹配才跳过，避免误伤“你好，帮我查一下…”
+_GREETING_RE = re.compile(
+    r"^(你好|您好|嗨|哈喽|早上好|中午好|下午好|晚上好|早安|晚安|谢谢|谢谢你|多谢|感谢|辛苦了|好的|好|嗯|嗯嗯|哦|ok|okay|"
+    r"收到|明白了?|知道了|再见|拜拜|hi|hello|hey|thanks|thank you|thx|bye)"
+    r"[\s,，。.!！~～啊呀呢哈]*$",
+    flags=re.I,
+)
+
+# 追问/续写：上下文不变，复用上一轮命中即可
+_FOLLOWUP_RE = re.compile(
+    r"^(请)?(继续|接着(说|讲|写)?|展开(说说|讲讲|一下)?|详细(点|一点|一些|说说|讲讲)|具体(点|一点|说说)|"
+    r"还有(吗|呢)|然后呢|再(说|讲)(说|讲|一下)?|举(个|几个)例子|换(个|种)说法|简短(点|一点)|总结(一下)?|"
+    r"continue|go on|more|elaborate)"
+    r"[\s,，。.!！?？~～吧呢啊]*$",
+    flags=re.I,
+)
+
+# 很短、且主要靠指代（这个/那个/它/上面）的句子，通常是在追问上一轮
+_REFERENTIAL_RE = re.compile(r"(这个|那个|这些|那些|它|上面|刚才|前面)")
+_REFERENTIAL_MAX_LEN = 10
+
+_PUNCT_ONLY_RE = re.compile(r"^[\W_]*$")
+
+Result = Tuple[list, list, list, str]  # 与 query_all 返回值一致：(docs, facts, notes, block)
+EMPTY_RESULT: Result = ([], [], [], "")
+
+
+def _hit_ids(result: Result) -> List[str]:
+    return [h.get("id") for hits in result[:3] for h in hits]
+
+
+class RetrievalGate:
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.last_result: Optional[Result] = None
+        self.last_hit_ids: List[str] = []
+        self.counts = {SKIP: 0, REUSE: 0, FULL: 0}
+        self.redundant_full = 0          # 完整检索结果与上一轮相同（本可复用）
+        self.full_seconds = 0.0          # 完整检索累计耗时
+
+    # ---------- 决策 ----------
+    def decide(self, query: str) -> str:
+        if not self.enabled:
+            return FULL
+        q = " ".join((query or "").split())
+        if not q or _PUNCT_ONLY_RE.match(q) or _GREETING_RE.match(q):
+            return SKIP
+        if _FOLLOWUP_RE.match(q):
+            # 没有上一轮命中可复用：追问本身没有检索价值
+            return REUSE if self.last_hit_ids else SKIP
+        if len(q) <= _REFERENTIAL_MAX_LEN and _REFERENTIAL_RE.search(q) and self.last_hit_ids:
+            return REUSE
+        return FULL
+
+    def run(self, query: str, search: Callable[[], Result], force: bool = False) -> Tuple[str, Result]:
+        """按决策执行：search 为真正的检索函数（例如 lambda: query_all(...)）；force=True 时总是完整检索"""
+        decision = FULL if force else self.decide(query)
+        if decision == REUSE and self.last_result is not None:
+            result = self.last_result
+        elif decision == SKIP:
+            result = EMPTY_RESULT
+        else:
+            decision = FULL
+            t0 = time.perf_counter()
+            result = search()
+            self.full_seconds += time.perf_counter() - t0
+            ids = _hit_ids(result)
+            if ids and ids == self.last_hit_ids:
+                self.redundant_full += 1
+            self.last_result = result
+            self.last_hit_ids = ids
+        self.counts[decision] += 1
+        return decision, result
+
+    def reset(self):
+        """上下文被清空/切换时调用，避免复用过期命中"""
+        self.last_result = None
+        self.last_hit_ids = []
+
+    # ---------- 统计 ----------
+    @property
+    def turns(self) -> int:
+        return sum(self.counts.values())
+
+    def avg_full_seconds(self) -> float:
+        n = self.counts[FULL]
+        return self.full_seconds / n if n else 0.0
+
+    def saved_seconds(self) -> float:
+        """按完整检索的平均耗时估算：跳过 + 复用的轮数 × 平均耗时"""
+        return (self.counts[SKIP] + self.counts[REUSE]) * self.avg_full_seconds()
+
+    def stats_text(self) -> str:
+        t = self.turns
+        if not t:
+            return "（暂无对话轮次）"
+        skipped = self.counts[SKIP] + self.counts[REUSE]
+        return (
+            f"轮次 {t}：full={self.counts[FULL]} reuse={self.counts[REUSE]} skip={self.counts[SKIP]}"
+            f"（免检索 {skipped / t:.0%}）\n"
+            f"完整检索平均 {self.avg_full_seconds() * 1000:.0f} ms，估计节省 {self.saved_seconds():.2f} s；"
+            f"与上一轮结果相同的完整检索 {self.redundant_full} 次"
+        )
@@ -0,0 +1,320 @@
+"""
+向量集合快照：导出 / 导入 / 直接在快照上检索（不调用任何 API）
+
+目录结构（按列存放）：
+    <snapshot>/manifest.json     格式版本、集合名、条数、维度、向量模型、距离度量
+    <snapshot>/embeddings.npy    float16 [count, dim]，可 np.load(mmap_mode="r") 内存映射
+    <snapshot>/ids.jsonl         每行一个 JSON 字符串
+    <snapshot>/documents.jsonl   每行一个 JSON 字符串
+    <snapshot>/metadatas.jsonl   每行一个 JSON 对象（或 null）
+
+manifest.json 最后写入：存在即代表快照完整。
+
+用法：
+    n = export_collection(coll, "snap/docs", embed_model="text-embedding-3-small")
+    n = import_snapshot(coll, "snap/docs")
+    hits = Snapshot("snap/docs").search(q_emb, k=5, where={"source": "a.md"})
+"""
+
+import os
+import json
+import time
+import threading
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+
+FORMAT_VERSION = 1
+MANIFEST = "manifest.json"
+EMBEDDINGS = "embeddings.npy"
+COLUMNS = ("ids", "documents", "metadatas")
+
+EXPORT_PAGE = 5000       # 每次从 Chroma 读取的条数
+IMPORT_BATCH = 4096      # 每次 upsert 的条数（需小于 Chroma 的 max_batch_size）
+SEARCH_BLOCK = 65536     # 快照检索时每次参与矩阵乘的行数
+
+
+def _col_path(snap_dir: str, name: str) -> str:
+    return os.path.join(snap_dir, f"{name}.jsonl")
+
+
+def read_manifest(snap_dir: str) -> Dict:
+    path = os.path.join(snap_dir, MANIFEST)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"不是完整的快照目录（缺少 {MANIFEST}）：{snap_dir}")
+    with open(path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("format") != FORMAT_VERSION:
+        raise ValueError(f"不支持的快照格式版本：{manifest.get('format')}")
+    return manifest
+
+
+# ---------- 导出 ----------
+def export_collection(coll, out_dir: str, embed_model: Optional[str] = None, page: int = EXPORT_PAGE) -> int:
+    """把 Chroma 集合分页导出为快照；返回导出条数"""
+    os.makedirs(out_dir, exist_ok=True)
+    manifest_path = os.path.join(out_dir, MANIFEST)
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)  # 覆盖导出：先让旧快照失效
+
+    total = coll.count()
+    files = {name: open(_col_path(out_dir, name), "w", encoding="utf-8") for name in COLUMNS}
+    emb = None
+    n, dim = 0, 0
+    try:
+        offset = 0
+        while offset < total:
+            res = coll.get(
+                include=["documents", "metadatas", "embeddings"],
+                limit=page,
+                offset=offset,
+            )
+            ids = res.get("ids") or []
+            if not ids:
+                break
+            vecs = np.asarray(res.get("embeddings"), dtype=np.float32)
+            if emb is None:
+                dim = int(vecs.shape[1])
+                emb = np.lib.format.open_memmap(
+                    os.path.join(out_dir, EMBEDDINGS),
+                    mode="w+", dtype=np.float16, shape=(total, dim),
+                )
+            rows = min(len(ids), total - n)  # 导出期间集合变大时不越界
+            emb[n:n + rows] = vecs[:rows].astype(np.float16)
+            docs = res.get("documents") or [None] * len(ids)
+            metas = res.get("metadatas") or [None] * len(ids)
+            for _id, doc, meta in list(zip(ids, docs, metas))[:rows]:
+                files["ids"].write(json.dumps(_id, ensure_ascii=False) + "\n")
+                files["documents"].write(json.dumps(doc, ensure_ascii=False) + "\n")
+                files["metadatas"].write(json.dumps(meta or None, ensure_ascii=False) + "\n")
+            n += rows
+            offset += len(ids)
+            print(f"  … 已导出 {n}/{total}")
+    finally:
+        for f in files.values():
+            f.close()
+        if emb is not None:
+            emb.flush()
+            del emb
+
+    meta = coll.metadata or {}
+    manifest = {
+        "format": FORMAT_VERSION,
+        "collection": coll.name,
+        "count": n,   # embeddings.npy 可能多预留了行，读取时以 count 为准
+        "dim": dim,
+        "dtype": "float16",
+        "space": meta.get("hnsw:space", "l2"),
+        "embed_model": embed_model,
+        "created_at": int(time.time()),
+    }
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    return n
+
+
+# ---------- 读取 ----------
+def _iter_column(snap_dir: str, name: str) -> Iterator:
+    with open(_col_path(snap_dir, name), "r", encoding="utf-8") as f:
+        for line in f:
+            yield json.loads(line)
+
+
+def load_embeddings(snap_dir: str, count: Optional[int] = None) -> np.ndarray:
+    """返回内存映射的 float16 向量矩阵（只读）"""
+    emb = np.load(os.path.join(snap_dir, EMBEDDINGS), mmap_mode="r")
+    return emb[:count] if count is not None else emb
+
+
+# ---------- 导入 ----------
+def import_snapshot(coll, snap_dir: str, batch: int = IMPORT_BATCH, dedup_index=None) -> int:
+    """
+    把快照批量 upsert 回 Chroma（零 API 调用）；返回导入条数
+    dedup_index 不为空时同时登记导入的文档签名，否则写入时去重看不到这些条目
+    """
+    manifest = read_manifest(snap_dir)
+    count = manifest["count"]
+    if not count:
+        return 0
+    emb = load_embeddings(snap_dir, count)
+    cols = [_iter_column(snap_dir, name) for name in COLUMNS]
+
+    done = 0
+    while done < count:
+        j = min(done + batch, count)
+        ids, docs, metas = [], [], []
+        for _ in range(j - done):
+            _id, doc, meta = (next(c) for c in cols)
+            ids.append(_id)
+            docs.append(doc)
+            metas.append(meta or None)
+        coll.upsert(
+            ids=ids,
+            documents=docs,
+            metadatas=metas,
+            embeddings=emb[done:j].astype(np.float32).tolist(),
+        )
+        if dedup_index is not None:
+            dedup_index.add((_id, doc) for _id, doc in zip(ids, docs) if doc)
+        done = j
+        print(f"  … 已导入 {done}/{count}")
+    return done
+
+
+
+# ---------- 快照上直接检索 ----------
+def match_where(meta: Dict, where: Optional[Dict]) -> bool:
+    """Chroma where 语法的子集（filters.py 会生成的）：字段相等 / $eq / $ne / $in / $gt(e) / $lt(e) / $and / $or"""
+    if not where:
+        return True
+    if "$and" in where:
+        return all(match_where(meta, w) for w in where["$and"])
+    if "$or" in where:
+        return any(match_where(meta, w) for w in where["$or"])
+    for field, cond in where.items():
+        value = meta.get(field)
+        if not isinstance(cond, dict):
+            cond = {"$eq": cond}
+        for op, arg in cond.items():
+            if op == "$eq":
+                ok = value == arg
+            elif op == "$ne":
+                ok = value != arg
+            elif op == "$in":
+                ok = value in arg
+            elif op == "$nin":
+                ok = value not in arg
+            elif op in ("$gt", "$gte", "$lt", "$lte"):
+                if not isinstance(value, (int, float)) or isinstance(value, bool):
+                    return False
+                ok = {"$gt": value > arg, "$gte": value >= arg, "$lt": value < arg, "$lte": value <= arg}[op]
+            else:
+                raise ValueError(f"快照检索不支持的条件：{op}")
+            if not ok:
+                return False
+    return True
+
+
+def match_document(doc: Optional[str], where_document: Optional[Dict]) -> bool:
+    """where_document 子集：$contains / $not_contains / $and / $or"""
+    if not where_document:
+        return True
+    if "$and" in where_document:
+        return all(match_document(doc, w) for w in where_document["$and"])
+    if "$or" in where_document:
+        return any(match_document(doc, w) for w in where_document["$or"])
+    if "$contains" in where_document:
+        return where_document["$contains"] in (doc or "")
+    if "$not_contains" in where_document:
+        return where_document["$not_contains"] not in (doc or "")
+    raise ValueError(f"快照检索不支持的文档条件：{where_document}")
+
+
+class Snapshot:
+    """
+    只读快照：向量内存映射，文档/元数据按行偏移按需读取（带过滤条件时才整列载入）。
+    免导入即可检索（DOCS_SNAPSHOT，见 memory.SnapshotMemory），返回结构与 VectorMemory.query 一致。
+    """
+
+    def __init__(self, snap_dir: str):
+        self.dir = snap_dir
+        self.manifest = read_manifest(snap_dir)
+        self.count = self.manifest["count"]
+        self.embeddings = load_embeddings(snap_dir, self.count)
+        self.ids: List[str] = list(_iter_column(snap_dir, "ids"))
+        self._columns: Dict[str, List] = {}
+        self._offsets: Dict[str, List[int]] = {}
+        self._norms: Optional[np.ndarray] = None
+        self._lock = threading.Lock()
+
+    def column(self, name: str) -> List:
+        """整列载入（documents / metadatas），之后常驻内存"""
+        with self._lock:
+            if name not in self._columns:
+                self._columns[name] = list(_iter_column(self.dir, name))
+            return self._columns[name]
+
+    def _line_offsets(self, name: str) -> List[int]:
+        with self._lock:
+            if name not in self._offsets:
+                offsets, pos = [], 0
+                with open(_col_path(self.dir, name), "rb") as f:
+                    for line in f:
+                        offsets.append(pos)
+                        pos += len(line)
+                self._offsets[name] = offsets
+            return self._offsets[name]
+
+    def _read_row(self, name: str, idx: int):
+        if name in self._columns:
+            return self._columns[name][idx]
+        with open(_col_path(self.dir, name), "rb") as f:
+            f.seek(self._line_offsets(name)[idx])
+            return json.loads(f.readline().decode("utf-8"))
+
+    def _row(self, idx: int) -> Dict:
+        return {"id": self.ids[idx], "text": self._read_row("documents", idx),
+                "meta": self._read_row("metadatas", idx) or {}}
+
+    def _mask(self, where: Optional[Dict], where_document: Optional[Dict]) -> Optional[np.ndarray]:
+        """满足条件的行；没有条件时返回 None"""
+        if not where and not where_document:
+            return None
+        mask = np.ones(self.count, dtype=bool)
+        if where:
+            mask &= np.fromiter((match_where(m or {}, where) for m in self.column("metadatas")), bool, self.count)
+        if where_document:
+            mask &= np.fromiter((match_document(d, where_document) for d in self.column("documents")), bool, self.count)
+        return mask
+
+    def _row_norms(self) -> np.ndarray:
+        with self._lock:
+            if self._norms is None:
+                norms = np.empty(self.count, dtype=np.float32)
+                for i in range(0, self.count, SEARCH_BLOCK):
+                    block = self.embeddings[i:i + SEARCH_BLOCK].astype(np.float32)
+                    norms[i:i + SEARCH_BLOCK] = np.linalg.norm(block, axis=1)
+                self._norms = np.maximum(norms, 1e-12)
+            return self._norms
+
+    def search(
+        self,
+        query_embedding: List[float],
+        k: int = 5,
+        where: Optional[Dict] = None,
+        where_document: Optional[Dict] = None,
+    ) -> List[Dict]:
+        """余弦相似度暴力检索（分块矩阵乘，内存占用与块大小相关）；where / where_document 同 Chroma"""
+        if not self.count:
+            return []
+        q = np.asarray(query_embedding, dtype=np.float32)
+        q = q / max(float(np.linalg.norm(q)), 1e-12)
+        norms = self._row_norms()
+        scores = np.empty(self.count, dtype=np.float32)
+        for i in range(0, self.count, SEARCH_BLOCK):
+            block = self.embeddings[i:i + SEARCH_BLOCK].astype(np.float32)
+            scores[i:i + SEARCH_BLOCK] = block @ q / norms[i:i + SEARCH_BLOCK]
+        candidates = np.arange(self.count)
+        mask = self._mask(where, where_document)
+        if mask is not None:
+            candidates = candidates[mask]
+        if not len(candidates):
+            return []
+        k = min(max(1, k), len(candidates))
+        top = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        top = top[np.argsort(-scores[top])]
+        return [dict(self._row(int(i)), score=float(scores[i])) for i in top]
+
+    def get(self, where: Optional[Dict] = None, where_document: Optional[Dict] = None, limit: int = 100) -> List[Dict]:
+        """按条件列出（快照顺序，不带 score）"""
+        mask = self._mask(where, where_document)
+        rows = range(self.count) if mask is None else np.flatnonzero(mask)
+        return [self._row(int(i)) for i in list(rows)[:max(1, limit)]]
+
+    def source_counts(self) -> Dict[str, int]:
+        counts: Dict[str, int] = {}
+        for meta in self.column("metadatas"):
+            source = (meta or {}).get("source")
+            if source:
+                counts[source] = counts.get(source, 0) + 1
+        return counts
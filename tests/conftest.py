@@ -0,0 +1,6 @@
+import os
+import sys
+
+# config.py 导入时要求 OPENAI_API_KEY；测试不访问真实 API
+os.environ.setdefault("OPENAI_API_KEY", "test")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
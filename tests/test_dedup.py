@@ -0,0 +1,68 @@
+from src.src.dedup import DedupIndex, content_hash, dedupe_collection, hamming, simhash
+
+TEXT = ("向量数据库在删除大量条目之后需要重建索引，否则检索会越来越慢，这是压缩任务存在的原因。"
+        "检索门控在寒暄时跳过检索，在追问时复用上一轮命中，其它情况正常检索三个集合并合并结果。")
+
+
+def test_hash_ignores_case_and_whitespace():
+    assert content_hash("Hello   World") == content_hash(" hello world ")
+    assert simhash("Hello World") == simhash("helloworld")
+    assert simhash("") == 0
+
+
+def test_simhash_distance():
+    near = TEXT.replace("三个", "3个")
+    assert hamming(simhash(TEXT), simhash(near)) <= 3
+    assert hamming(simhash(TEXT), simhash("完全无关的一句话 about cats")) > 3
+
+
+def test_index_exact_near_exclude_remove():
+    index = DedupIndex(None, near_bits=3)
+    index.add([("a", TEXT)])
+    assert index.find(TEXT.upper()) == ("a", "exact")
+    assert index.find(TEXT.replace("三个", "3个")) == ("a", "near")
+    assert index.find(TEXT.replace("三个", "3个"), near=False) is None
+    assert index.find(TEXT, exclude={"a"}) is None
+    assert index.find(TEXT, exclude_prefix="a") is None
+    index.remove(["a"])
+    assert index.find(TEXT) is None
+    assert len(index) == 0
+
+
+def test_index_persists(tmp_path):
+    path = str(tmp_path / "dedup.log")
+    index = DedupIndex(path)
+    index.add([("a", "one"), ("b", "two")])
+    index.remove(["a"])
+    reloaded = DedupIndex(path)
+    assert reloaded.find("two") == ("b", "exact")
+    assert reloaded.find("one") is None
+
+
+class FakeCollection:
+    def __init__(self, rows):
+        self.rows = rows  # [(id, doc, meta)]
+
+    def count(self):
+        return len(self.rows)
+
+    def get(self, include=None, limit=None, offset=0):
+        page = self.rows[offset:offset + limit]
+        return {"ids": [r[0] for r in page], "documents": [r[1] for r in page], "metadatas": [r[2] for r in page]}
+
+    def delete(self, ids):
+        self.rows = [r for r in self.rows if r[0] not in set(ids)]
+
+
+def test_dedupe_collection_keeps_newest_per_name():
+    coll = FakeCollection([
+        ("a1", "同一段内容", {"name": "A", "created_at": 1}),
+        ("a2", "同一段内容", {"name": "A", "created_at": 2}),
+        ("b1", "同一段内容", {"name": "B", "created_at": 1}),
+        ("x1", "同一段内容", {"created_at": 1}),
+        ("x2", "同一段内容", None),
+    ])
+    index = DedupIndex(None)
+    assert dedupe_collection(coll, index, page=2) == (5, 2)
+    assert sorted(r[0] for r in coll.rows) == ["a2", "b1", "x1"]
+    assert len(index) == 3
@@ -0,0 +1,84 @@
+import time
+
+from src.src.expansion import QueryExpander, rrf_fuse
+
+
+def _hit(_id, score):
+    return {"id": _id, "score": score}
+
+
+def test_rrf_prefers_ids_found_by_several_lists():
+    fused = rrf_fuse([
+        [_hit("a", 0.9), _hit("b", 0.8)],
+        [_hit("b", 0.7), _hit("c", 0.95)],
+    ])
+    assert [h["id"] for h in fused] == ["b", "a", "c"]
+    b = fused[0]
+    assert b["score"] == 0.8  # 保留各路中的最高相似度
+    assert b["rrf"] > fused[1]["rrf"]
+
+
+def test_rrf_limit_and_inputs_untouched():
+    first = [_hit("a", 0.9), _hit("b", 0.8)]
+    fused = rrf_fuse([first, [_hit("c", 0.5)]], limit=2)
+    assert len(fused) == 2
+    assert "rrf" not in first[0]
+
+
+def test_rrf_empty():
+    assert rrf_fuse([]) == []
+    assert rrf_fuse([[], []]) == []
+
+
+class FakeEmbedder:
+    def __init__(self):
+        self.batches = []
+
+    def embed(self, texts):
+        self.batches.append(list(texts))
+        return [[float(len(t))] for t in texts]
+
+
+class FakeStore:
+    """按向量（= 文本长度）返回一个确定的命中；query 记录普通检索"""
+
+    def __init__(self):
+        self.plain = []
+
+    def query(self, text, k=5, **_):
+        self.plain.append(text)
+        return [_hit("plain", 0.9)]
+
+    def query_embeddings(self, embs, k=5, **_):
+        return [[_hit(f"len{int(e[0])}", 0.5)] for e in embs]
+
+
+def test_rules_mode_embeds_query_and_rewrites_in_one_batch():
+    emb, store = FakeEmbedder(), FakeStore()
+    expander = QueryExpander(embedder=emb, mode="rules")
+    (hits,) = expander.search("请问怎么安装", [store], k=5)
+    assert emb.batches == [["请问怎么安装", "怎么安装", "如何安装"]]
+    assert store.plain == []
+    assert {h["id"] for h in hits} == {"len6", "len4"}
+
+
+def test_llm_mode_falls_back_to_plain_on_deadline(monkeypatch):
+    emb, store = FakeEmbedder(), FakeStore()
+    expander = QueryExpander(embedder=emb, mode="llm", deadline_ms=50)
+    monkeypatch.setattr(expander, "_llm_rewrites", lambda q, t: time.sleep(0.3) or ["慢的改写"])
+    t0 = time.monotonic()
+    (hits,) = expander.search("怎么安装", [store], k=5)
+    assert time.monotonic() - t0 < 0.25
+    assert [h["id"] for h in hits] == ["plain"]
+    assert expander.counts["fallback"] == 1
+
+
+def test_llm_mode_fuses_plain_with_rewrites(monkeypatch):
+    emb, store = FakeEmbedder(), FakeStore()
+    expander = QueryExpander(embedder=emb, mode="llm", deadline_ms=1000)
+    monkeypatch.setattr(expander, "_llm_rewrites", lambda q, t: ["一个假设性的回答"])
+    (hits,) = expander.search("怎么安装", [store], k=5)
+    assert store.plain == ["怎么安装"]
+    assert emb.batches == [["如何安装", "一个假设性的回答"]]  # 改写探针一次批量向量化，不含原句
+    assert {h["id"] for h in hits} == {"plain", "len4", "len8"}
+    assert expander.counts["expanded"] == 1
@@ -0,0 +1,59 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from src.src.filters import MAX_SOURCES, NO_MATCH, parse_scope, source_matches
+
+
+def test_parse_scope_extracts_conditions_anywhere():
+    q, scope = parse_scope("@source:manual/*.md 安装步骤 @has:pip @chunk:0 @name:计划")
+    assert q == "安装步骤"
+    assert scope.source_glob == "manual/*.md"
+    assert scope.contains == ["pip"]
+    assert scope.equals == {"chunk": 0, "name": "计划"}
+
+
+def test_parse_scope_without_conditions():
+    q, scope = parse_scope("发邮件给 a@b:c 怎么写")
+    assert q == "发邮件给 a@b:c 怎么写"
+    assert not scope
+
+
+def test_parse_scope_time_range():
+    _, scope = parse_scope("@since:7d @until:2025-10-31")
+    assert abs(scope.since - (time.time() - 7 * 86400)) < 5
+    assert time.localtime(scope.until)[:6] == (2025, 10, 31, 23, 59, 59)
+    with pytest.raises(ValueError):
+        parse_scope("@since:昨天")
+
+
+def test_source_matches_path_suffix():
+    assert source_matches("data/manual/a.md", "manual/*.md")
+    assert source_matches("data\\manual\\a.md", "manual/*.md")
+    assert not source_matches("data/manual/a.txt", "manual/*.md")
+
+
+def _vmem(*sources):
+    return SimpleNamespace(source_counts=lambda: {s: 1 for s in sources})
+
+
+def test_filters_for_expands_source_glob():
+    _, scope = parse_scope("@source:manual/*.md @has:pip")
+    f = scope.filters_for(_vmem("data/manual/b.md", "data/manual/a.md", "data/other/c.md"))
+    assert f["where"] == {"source": {"$in": ["data/manual/a.md", "data/manual/b.md"]}}
+    assert f["where_document"] == {"$contains": "pip"}
+
+
+def test_filters_for_combines_conditions():
+    _, scope = parse_scope("@source:*.md @kind:system")
+    f = scope.filters_for(_vmem("a.md"))
+    assert f["where"] == {"$and": [{"source": "a.md"}, {"kind": "system"}]}
+
+
+def test_filters_for_no_match_and_cap():
+    _, scope = parse_scope("@source:*.pdf")
+    assert scope.filters_for(_vmem("a.md"))["where"] is NO_MATCH
+    _, scope = parse_scope("@source:*.md")
+    with pytest.raises(ValueError):
+        scope.filters_for(_vmem(*(f"{i}.md" for i in range(MAX_SOURCES + 1))))
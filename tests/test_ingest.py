@@ -0,0 +1,122 @@
+import glob
+import os
+from types import SimpleNamespace
+
+import pytest
+
+from src.src import ingest
+from src.src.ingest import chunk_text
+from src.src.dedup import DedupIndex
+from src.src.memory import get_source_index, get_versions
+
+
+class FakeCollection:
+    def __init__(self):
+        self.rows = {}  # id -> (doc, meta)
+
+    def upsert(self, ids, documents, metadatas, embeddings):
+        for _id, doc, meta in zip(ids, documents, metadatas):
+            self.rows[_id] = (doc, meta)
+
+    def count(self):
+        return len(self.rows)
+
+    def get(self, where=None, include=None, limit=None, offset=0):
+        if where is None:
+            metas = [m for _, m in self.rows.values()][offset:offset + limit]
+            return {"metadatas": metas}
+        want = where["source"]
+        want = set(want["$in"]) if isinstance(want, dict) else {want}
+        return {"ids": [i for i, (_, m) in self.rows.items() if m["source"] in want]}
+
+    def delete(self, ids):
+        for _id in ids:
+            self.rows.pop(_id, None)
+
+
+def _fake_embed(monkeypatch):
+    monkeypatch.setattr(ingest, "embed_batch", lambda texts: [[0.0] for _ in texts])
+
+
+def test_upsert_dedups_only_within_one_source(monkeypatch):
+    _fake_embed(monkeypatch)
+    coll, index = FakeCollection(), DedupIndex(None)
+    ids = ingest.upsert_chunks(coll, [("a.md", "x" * 10 + "y" * 10 + "x" * 10)], 10, 0, index)
+    assert ids == ["a.md::0", "a.md::1"]  # 文件内的重复块跳过
+    # 另一个文件内容相同也要写入：a.md 被删除后 b.md 的内容不能跟着消失
+    assert ingest.upsert_chunks(coll, [("b.md", "x" * 10)], 10, 0, index) == ["b.md::0"]
+    ingest.remove_sources(coll, ["a.md"], index)
+    assert list(coll.rows) == ["b.md::0"]
+    assert index.find("x" * 10) == ("b.md::0", "exact")
+
+
+def test_short_text_is_single_chunk():
+    # 比 chunk_overlap 还短的文本曾经让 start 回退到 0 而死循环
+    assert chunk_text("短文本", chunk_size=800, chunk_overlap=100) == ["短文本"]
+
+
+def test_chunks_overlap_and_cover_text():
+    text = "".join(str(i % 10) for i in range(25))
+    chunks = chunk_text(text, chunk_size=10, chunk_overlap=3)
+    assert chunks == [text[0:10], text[7:17], text[14:24], text[21:25]]
+
+
+def test_whitespace_collapsed_and_empty():
+    assert chunk_text("a  b\n\nc", chunk_size=800) == ["a b c"]
+    assert chunk_text("   ") == []
+    assert chunk_text("abc", chunk_size=0) == ["abc"]
+
+
+@pytest.mark.parametrize("pattern", ["**/*.*", "**/*.md", "*.md", "docs/*.txt", "**/a?.md", "**/[ab]*.md"])
+def test_pattern_regex_agrees_with_glob(tmp_path, pattern):
+    for rel in ("a.md", "ab.md", "b.txt", "docs/c.txt", "docs/deep/a1.md", ".hidden/x.md", "docs/.h.md", "x.bin"):
+        fp = tmp_path / rel
+        fp.parent.mkdir(parents=True, exist_ok=True)
+        fp.write_text("x")
+    src = str(tmp_path)
+    regex = ingest.pattern_regex(pattern)
+    candidates = [os.path.join(d, f) for d, _, fs in os.walk(src) for f in fs]
+    assert sorted(p for p in candidates if ingest.matches_source(p, src, regex)) == \
+        sorted(ingest.list_source_files(src, pattern))
+
+
+def _args(tmp_path):
+    return SimpleNamespace(persist=str(tmp_path / "db"), collection="watch_test",
+                           chunk_size=5, chunk_overlap=0, near_dup=False)
+
+
+def test_sync_changes_writes_new_chunks_then_drops_stale(tmp_path, monkeypatch):
+    _fake_embed(monkeypatch)
+    args, coll = _args(tmp_path), FakeCollection()
+    get_source_index(args.persist, args.collection).counts(coll, 0)  # 空集合先建好来源索引
+    fp = str(tmp_path / "a.md")
+    open(fp, "w").write("aaaaabbbbbccccc")
+    assert ingest.sync_changes(coll, args, [fp], []) == (3, 0, [])
+    open(fp, "w").write("zzzzz")
+    assert ingest.sync_changes(coll, args, [fp], []) == (1, 2, [])
+    assert list(coll.rows) == [f"{fp}::0"] and coll.rows[f"{fp}::0"][0] == "zzzzz"
+    version = get_versions(args.persist).get(args.collection)
+    assert version == 2
+    monkeypatch.setattr(coll, "count", lambda: pytest.fail("来源索引应随同步更新，不必重扫"))
+    assert get_source_index(args.persist, args.collection).counts(coll, version) == {fp: 1}
+
+    os.remove(fp)
+    assert ingest.sync_changes(coll, args, [], [fp]) == (0, 1, [])
+    assert coll.rows == {}
+    assert get_source_index(args.persist, args.collection).counts(coll, version + 1) == {}
+
+
+def test_sync_changes_keeps_old_chunks_when_embedding_fails(tmp_path, monkeypatch):
+    _fake_embed(monkeypatch)
+    args, coll = _args(tmp_path), FakeCollection()
+    fp = str(tmp_path / "a.md")
+    open(fp, "w").write("aaaaabbbbb")
+    ingest.sync_changes(coll, args, [fp], [])
+
+    def boom(texts):
+        raise RuntimeError("embeddings down")
+    monkeypatch.setattr(ingest, "embed_batch", boom)
+    open(fp, "w").write("new content")
+    assert ingest.sync_changes(coll, args, [fp], []) == (0, 0, [fp])
+    assert [doc for doc, _ in coll.rows.values()] == ["aaaaa", "bbbbb"]
+    assert get_versions(args.persist).get(args.collection) == 1
@@ -0,0 +1,59 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from src.src.lifecycle import parse_retention, rerank
+
+
+def test_parse_retention():
+    assert parse_retention("") == {}
+    assert parse_retention("long_term:ttl=180,max=5000; user_notes:max=2000") == {
+        "long_term": {"ttl_days": 180.0, "max": 5000},
+        "user_notes": {"ttl_days": None, "max": 2000},
+    }
+    with pytest.raises(ValueError):
+        parse_retention("long_term:size=10")
+
+
+def test_rerank_boosts_recent_and_used_memories():
+    now = time.time()
+    vmem = SimpleNamespace(hit_stats={"old": (now - 365 * 86400, 0)})
+    hits = [
+        {"id": "old", "score": 0.80, "meta": {"created_at": now - 365 * 86400}},
+        {"id": "new", "score": 0.78, "meta": {"created_at": now, "hit_count": 5}},
+    ]
+    out = rerank(vmem, hits, now=now)
+    assert [h["id"] for h in out] == ["new", "old"]
+    assert out[0]["sim"] == 0.78 and out[0]["score"] > 0.78
+    assert all(h["score"] >= h["sim"] for h in out)
+
+
+def test_rerank_prefers_process_hit_stats_over_metadata():
+    now = time.time()
+    vmem = SimpleNamespace(hit_stats={"a": (now, 10)})
+    hits = [
+        {"id": "a", "score": 0.5, "meta": {"created_at": 0}},
+        {"id": "b", "score": 0.5, "meta": {"created_at": 0}},
+    ]
+    assert rerank(vmem, hits, now=now)[0]["id"] == "a"
+
+
+def test_rerank_without_store_is_noop():
+    hits = [{"id": "a", "score": 0.5}]
+    assert rerank(None, hits) == [{"id": "a", "score": 0.5}]
+
+
+def test_boost_does_not_lift_low_similarity_over_min_score():
+    from src.src.main import build_recalled_context
+
+    now = time.time()
+    vmem = SimpleNamespace(hit_stats={"fresh": (now, 20)})
+    hits = [
+        {"id": "fresh", "text": "刚用过但不相关", "score": 0.15, "meta": {"created_at": now}},
+        {"id": "match", "text": "相关", "score": 0.5, "meta": {"created_at": 0}},
+    ]
+    hits = rerank(vmem, hits, now=now)
+    assert hits[0]["score"] > 0.2  # 加分后超过阈值
+    kept, _ = build_recalled_context(hits, min_score=0.2)
+    assert [h["id"] for h in kept] == ["match"]
@@ -0,0 +1,135 @@
+from types import SimpleNamespace
+
+import httpx
+import openai
+import pytest
+
+from src.src import main
+from src.src.main import cmd_saveas, dispatch, run_batch, run_command
+
+
+class FakeNotes:
+    """只记录写入；dup_of 中的内容视为已有记忆的重复"""
+
+    def __init__(self, dup_of=None, fail=False):
+        self.dup_of = dup_of or {}
+        self.fail = fail
+        self.calls = []
+        self.last_duplicates = []
+
+    def add_memories(self, texts, metas):
+        if self.fail:
+            raise RuntimeError("boom")
+        self.calls.append((list(texts), list(metas)))
+        ids, self.last_duplicates = [], []
+        for pos, text in enumerate(texts):
+            if text in self.dup_of:
+                self.last_duplicates.append((pos, self.dup_of[text], "exact"))
+                ids.append(self.dup_of[text])
+            else:
+                ids.append(f"id{len(ids)}")
+        return ids
+
+
+def _session(notes):
+    return SimpleNamespace(stores=SimpleNamespace(notes=notes))
+
+
+def test_dispatch():
+    cmd, m = dispatch("saveas 计划：周五发布")
+    assert cmd.handler is cmd_saveas
+    assert (m.group("name"), m.group("content")) == ("计划", "周五发布")
+    cmd, m = dispatch("SAVEAS bad")
+    assert cmd.handler is cmd_saveas and m is None
+    assert dispatch("你好") is None
+
+
+def test_run_command_usage_and_non_command():
+    res = run_command(_session(FakeNotes()), "saveas bad")
+    assert not res.ok and res.text.startswith("⚠️ 用法")
+    assert run_command(_session(FakeNotes()), "随便聊聊") is None
+
+
+def test_run_batch_coalesces_saveas_and_reports_duplicates():
+    notes = FakeNotes(dup_of={"旧内容": "old1"})
+    lines = ["# 注释", "saveas a: 新内容", "", "saveas b: 旧内容", "不是命令"]
+    results = run_batch(_session(notes), lines)
+    assert len(notes.calls) == 1  # 连续的 saveas 一次写入
+    assert notes.calls[0][1] == [{"type": "user_note", "name": "a"}, {"type": "user_note", "name": "b"}]
+    assert results[0] is None and results[2] is None and results[4] is None
+    assert results[1].ok and results[1].text == "✅ 已保存记忆：a"
+    assert "old1" in results[3].text and results[3].data == ["old1"]
+
+
+def test_run_batch_duplicate_positions_across_note_batches(monkeypatch):
+    monkeypatch.setattr(main, "NOTE_BATCH", 2)
+    notes = FakeNotes(dup_of={"重复": "old1"})
+    lines = ["saveas a: x", "saveas b: y", "saveas c: 重复"]
+    results = run_batch(_session(notes), lines)
+    assert len(notes.calls) == 2
+    assert [r.text.startswith("✅") for r in results] == [True, True, False]
+    assert "old1" in results[2].text
+
+
+def test_run_batch_write_failure():
+    results = run_batch(_session(FakeNotes(fail=True)), ["saveas a: x"])
+    assert not results[0].ok and "boom" in results[0].text
+
+
+def test_handlers_return_output_instead_of_printing(capsys):
+    session = SimpleNamespace(stores=SimpleNamespace(prompts=None), system_prompt="s", developer_hint="d")
+    res = run_command(session, "testerr rate")
+    assert res.text.startswith("🔬 模拟：限速429") and "请求被限速（429）" in res.text
+    res = run_command(session, "evalprompts default,active: /不存在/questions.txt")
+    assert not res.ok and "读取问题文件失败" in res.text
+    assert capsys.readouterr().out == ""
+
+
+def test_openai_error_text_includes_hint():
+    text = main.openai_error_text(Exception("Incorrect API key provided: invalid_api_key"))
+    assert text.startswith("❌ 鉴权失败") and "💡" in text
+    assert main.openai_error_text(Exception("???")).startswith("❌ 未知错误")
+
+
+def test_retrieve_degrades_on_embedding_error(monkeypatch, capsys):
+    def failing_query_all(*args, **kwargs):
+        raise openai.APITimeoutError(request=httpx.Request("POST", "http://test/embeddings"))
+
+    monkeypatch.setattr(main, "query_all", failing_query_all)
+    sess = main.Session.__new__(main.Session)
+    sess.stores = SimpleNamespace(docs=None, facts=None, notes=None, expander=None)
+    sess.gate = SimpleNamespace(run=lambda q, fn, force=False: ("run", fn()))
+    assert sess.retrieve("怎么配置") == ([], [], [], "")
+    assert "本轮不使用 RAG" in capsys.readouterr().out
+
+
+def _patch_main(monkeypatch):
+    closed = []
+    monkeypatch.setattr(main, "Stores", lambda: SimpleNamespace(close=lambda: closed.append(1)))
+    monkeypatch.setattr(main, "Session", lambda stores: SimpleNamespace(stores=stores))
+    return closed
+
+
+def test_main_closes_stores_on_eof(monkeypatch, capsys):
+    closed = _patch_main(monkeypatch)
+
+    def eof(prompt=""):
+        raise EOFError
+
+    monkeypatch.setattr("builtins.input", eof)
+    main.main([])
+    assert closed == [1]
+    assert "再见" in capsys.readouterr().out
+
+
+def test_main_closes_stores_on_error(monkeypatch):
+    closed = _patch_main(monkeypatch)
+    monkeypatch.setattr("builtins.input", lambda prompt="": "你好")
+
+    def boom(session, text):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(main, "run_command", boom)
+    with pytest.raises(RuntimeError):
+        main.main([])
+    assert closed == [1]
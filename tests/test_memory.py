@@ -0,0 +1,100 @@
+from src.src.memory import QueryCache
+
+HITS = [{"id": "a", "text": "x", "score": 0.9}]
+
+
+def test_hit_after_put_returns_copy():
+    cache = QueryCache(4)
+    key = ("ns", 1, "q")
+    assert cache.get(key) is None
+    cache.put(key, HITS)
+    got = cache.get(key)
+    assert got == HITS
+    got[0]["score"] = 0
+    assert cache.get(key)[0]["score"] == 0.9
+
+
+def test_version_bump_drops_namespace():
+    cache = QueryCache(4)
+    cache.get(("ns", 1, "q"))
+    cache.put(("ns", 1, "q"), HITS)
+    cache.get(("other", 1, "q"))
+    cache.put(("other", 1, "q"), HITS)
+    assert cache.get(("ns", 2, "q")) is None
+    assert cache.stats()["size"] == 1
+    assert cache.get(("other", 1, "q")) == HITS
+
+
+def test_put_with_stale_version_is_ignored():
+    cache = QueryCache(4)
+    cache.get(("ns", 2, "q"))
+    cache.put(("ns", 1, "q"), HITS)
+    assert cache.stats()["size"] == 0
+
+
+def test_lru_eviction_and_invalidate():
+    cache = QueryCache(2)
+    for q in ("a", "b"):
+        cache.get(("ns", 1, q))
+        cache.put(("ns", 1, q), HITS)
+    cache.get(("ns", 1, "a"))  # a 变成最近使用
+    cache.put(("ns", 1, "c"), HITS)
+    assert cache.get(("ns", 1, "b")) is None
+    assert cache.get(("ns", 1, "a")) == HITS
+    cache.invalidate("ns")
+    assert cache.stats()["size"] == 0
+
+
+def test_disabled_cache_stores_nothing():
+    cache = QueryCache(0)
+    cache.get(("ns", 1, "q"))
+    cache.put(("ns", 1, "q"), HITS)
+    assert cache.get(("ns", 1, "q")) is None
+
+
+class CountingEmbedder:
+    def __init__(self):
+        self.calls = 0
+
+    def _vec(self, text):
+        v = [0.0] * 8
+        for ch in text:
+            v[ord(ch) % 8] += 1.0
+        return v
+
+    def embed(self, texts):
+        self.calls += 1
+        return [self._vec(t) for t in texts]
+
+    def embed_one(self, text):
+        return self.embed([text])[0]
+
+
+def test_vector_memory_write_bumps_version_and_invalidates_cache(tmp_path):
+    from src.src.memory import VectorMemory
+
+    emb = CountingEmbedder()
+    vm = VectorMemory(embedder=emb, persist_dir=str(tmp_path), collection="cache_test")
+    vm.add_memories(["第一条记忆"])
+    v1 = vm.version
+    first = vm.query("记忆", k=5)
+    calls = emb.calls
+    assert vm.query("  记忆 ", k=5) == first  # 规范化后命中缓存
+    assert emb.calls == calls
+
+    vm.add_memories(["第二条完全不同的内容"])
+    assert vm.version == v1 + 1
+    assert len(vm.query("记忆", k=5)) == 2
+    assert emb.calls == calls + 2  # 写入一次 + 重新检索一次
+
+    vm.delete([first[0]["id"]])
+    assert vm.version == v1 + 2
+    assert [h["id"] for h in vm.query("记忆", k=5)] != [first[0]["id"]]
+
+
+def test_cache_command_only_takes_known_subcommands():
+    from src.src.main import cmd_cache, dispatch
+
+    assert dispatch("cache stats")[0].handler is cmd_cache
+    assert dispatch("cache clear")[0].handler is cmd_cache
+    assert dispatch("cache 是什么") is None  # 当作普通对话
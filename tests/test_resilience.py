@@ -0,0 +1,103 @@
+import time
+
+import pytest
+
+from src.src.resilience import CircuitBreaker, CircuitOpenError, ResilientCaller, backoff_delay
+
+
+def test_backoff_follows_retry_after_with_cap():
+    assert 3 <= backoff_delay(1, retry_after=3, base=1, cap=20) <= 4
+    assert 20 <= backoff_delay(1, retry_after=100, base=1, cap=20) <= 21
+
+
+def test_backoff_exponential_with_jitter():
+    for _ in range(50):
+        assert 0.5 <= backoff_delay(1, base=1, cap=20) <= 1
+        assert 2 <= backoff_delay(3, base=1, cap=20) <= 4
+        assert 10 <= backoff_delay(10, base=1, cap=20) <= 20
+
+
+def test_breaker_opens_after_threshold():
+    br = CircuitBreaker("t", cooldown=60)
+    for _ in range(4):
+        br.record_failure("rate")
+    assert br.state == "closed"
+    br.record_failure("rate")
+    assert br.state == "open"
+    with pytest.raises(CircuitOpenError) as info:
+        br.before_call()
+    assert info.value.kind == "rate"
+
+
+def test_breaker_ignores_unknown_and_resets_on_success():
+    br = CircuitBreaker("t", cooldown=60)
+    for _ in range(10):
+        br.record_failure("unknown")
+    assert br.state == "closed"
+    for _ in range(4):
+        br.record_failure("rate")
+    br.record_success()
+    br.record_failure("rate")
+    assert br.state == "closed"
+
+
+def test_breaker_half_open_allows_single_probe():
+    br = CircuitBreaker("t", cooldown=0.01)
+    for _ in range(3):
+        br.record_failure("server")
+    time.sleep(0.02)
+    assert br.state == "half-open"
+    br.before_call()  # 探测请求放行
+    with pytest.raises(CircuitOpenError):
+        br.before_call()
+    br.record_success()
+    assert br.state == "closed"
+    br.before_call()
+
+
+def test_breaker_probe_failure_reopens():
+    br = CircuitBreaker("t", cooldown=0.01)
+    for _ in range(3):
+        br.record_failure("server")
+    time.sleep(0.02)
+    br.before_call()
+    br.record_failure("server")
+    assert br.state == "open"
+
+
+def _half_open_caller():
+    caller = ResilientCaller("t", max_tries=2)
+    caller.breaker.cooldown = 0.01
+    for _ in range(3):
+        caller.breaker.record_failure("server")
+    time.sleep(0.02)
+    return caller
+
+
+def test_probe_released_after_base_exception():
+    caller = _half_open_caller()
+
+    def interrupted():
+        raise KeyboardInterrupt
+
+    with pytest.raises(KeyboardInterrupt):
+        caller.call(interrupted)
+    assert caller.breaker.state == "half-open"
+    assert caller.call(lambda: "ok") == "ok"  # 不会卡在“探测中”
+    assert caller.breaker.state == "closed"
+
+
+def test_retry_passes_exception_to_on_retry(monkeypatch):
+    monkeypatch.setattr(time, "sleep", lambda s: None)
+    caller = ResilientCaller("t", max_tries=2)
+    seen, calls = [], []
+
+    def flaky():
+        calls.append(1)
+        if len(calls) == 1:
+            raise TimeoutError("timed out")
+        return "ok"
+
+    assert caller.call(flaky, on_retry=lambda kind, wait_s, e: seen.append((kind, e))) == "ok"
+    assert [k for k, _ in seen] == ["timeout"]
+    assert isinstance(seen[0][1], TimeoutError)
@@ -0,0 +1,38 @@
+from src.src.retrieval_gate import FULL, REUSE, SKIP, RetrievalGate
+
+HITS = ([{"id": "d1"}], [], [], "block")
+EMPTY = ([], [], [], "")
+
+
+def test_greetings_and_punctuation_skip():
+    gate = RetrievalGate()
+    for q in ("你好", "谢谢！", "ok", "  ", "？？", ""):
+        assert gate.decide(q) == SKIP, q
+
+
+def test_greeting_with_request_is_full():
+    assert RetrievalGate().decide("你好，帮我查一下安装步骤") == FULL
+
+
+def test_followup_reuses_only_with_previous_hits():
+    gate = RetrievalGate()
+    assert gate.decide("继续") == SKIP
+    gate.run("怎么安装 chroma", lambda: HITS)
+    assert gate.decide("继续") == REUSE
+    assert gate.decide("这个呢") == REUSE
+    decision, result = gate.run("展开说说", lambda: EMPTY)
+    assert decision == REUSE and result is HITS
+
+
+def test_reset_drops_previous_hits():
+    gate = RetrievalGate()
+    gate.run("怎么安装 chroma", lambda: HITS)
+    gate.reset()
+    assert gate.decide("继续") == SKIP
+
+
+def test_disabled_and_force_always_full():
+    assert RetrievalGate(enabled=False).decide("你好") == FULL
+    decision, _ = RetrievalGate().run("你好", lambda: HITS, force=True)
+    assert decision == FULL
+
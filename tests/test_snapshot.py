@@ -0,0 +1,84 @@
+import numpy as np
+
+from src.src import snapshot
+from src.src.dedup import DedupIndex
+
+
+class FakeCollection:
+    def __init__(self, name="docs", rows=None):
+        self.name = name
+        self.metadata = {"hnsw:space": "cosine"}
+        self.rows = rows or []  # [(id, doc, meta, emb)]
+
+    def count(self):
+        return len(self.rows)
+
+    def get(self, include=None, limit=None, offset=0):
+        page = self.rows[offset:offset + limit]
+        return {
+            "ids": [r[0] for r in page],
+            "documents": [r[1] for r in page],
+            "metadatas": [r[2] for r in page],
+            "embeddings": [r[3] for r in page],
+        }
+
+    def upsert(self, ids, documents, metadatas, embeddings):
+        self.rows += list(zip(ids, documents, metadatas, embeddings))
+
+
+ROWS = [
+    ("a::0", "安装步骤：pip install", {"source": "a.md", "chunk": 0}, [1.0, 0.0, 0.0]),
+    ("a::1", "配置 OPENAI_API_KEY", {"source": "a.md", "chunk": 1}, [0.0, 1.0, 0.0]),
+    ("b::0", "常见问题", {"source": "faq/b.md", "chunk": 0}, [0.6, 0.0, 0.8]),
+]
+
+
+def _export(tmp_path):
+    out = str(tmp_path / "snap")
+    assert snapshot.export_collection(FakeCollection(rows=list(ROWS)), out, embed_model="m", page=2) == 3
+    return out
+
+
+def test_export_import_roundtrip_registers_signatures(tmp_path):
+    out = _export(tmp_path)
+    target, index = FakeCollection(), DedupIndex(None)
+    assert snapshot.import_snapshot(target, out, batch=2, dedup_index=index) == 3
+    assert [r[0] for r in target.rows] == [r[0] for r in ROWS]
+    assert np.allclose([r[3] for r in target.rows], [r[3] for r in ROWS], atol=1e-3)
+    assert index.find("配置 openai_api_key") == ("a::1", "exact")
+
+
+def test_snapshot_search_with_filters(tmp_path):
+    snap = snapshot.Snapshot(_export(tmp_path))
+    hits = snap.search([1.0, 0.0, 0.0], k=2)
+    assert [h["id"] for h in hits] == ["a::0", "b::0"]
+    assert hits[0]["text"] == "安装步骤：pip install" and hits[0]["meta"]["source"] == "a.md"
+    assert abs(hits[0]["score"] - 1.0) < 1e-3
+    hits = snap.search([1.0, 0.0, 0.0], k=5, where={"source": {"$in": ["faq/b.md"]}})
+    assert [h["id"] for h in hits] == ["b::0"]
+    hits = snap.search([1.0, 0.0, 0.0], k=5, where={"$and": [{"source": "a.md"}, {"chunk": {"$gte": 1}}]})
+    assert [h["id"] for h in hits] == ["a::1"]
+    assert snap.search([1.0, 0.0, 0.0], k=5, where_document={"$contains": "不存在"}) == []
+    assert [r["id"] for r in snap.get(where={"source": "a.md"}, limit=1)] == ["a::0"]
+    assert snap.source_counts() == {"a.md": 2, "faq/b.md": 1}
+
+
+def test_snapshot_memory_matches_vector_memory_interface(tmp_path):
+    from src.src.filters import parse_scope
+    from src.src.memory import SnapshotMemory
+
+    class FakeEmbedder:
+        calls = 0
+
+        def embed_one(self, text):
+            FakeEmbedder.calls += 1
+            return [0.0, 1.0, 0.0]
+
+    vm = SnapshotMemory(_export(tmp_path), embedder=FakeEmbedder())
+    assert vm.name == "docs" and vm.count() == 3
+    assert vm.query("key 怎么配", k=1)[0]["id"] == "a::1"
+    vm.query("key 怎么配", k=1)
+    assert FakeEmbedder.calls == 1  # 第二次命中缓存
+    _, scope = parse_scope("@source:faq/*.md")
+    assert [h["id"] for h in vm.query("问题", k=3, **scope.filters_for(vm))] == ["b::0"]
+    assert vm.query("   ") == []